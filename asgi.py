@@ -0,0 +1,3 @@
+from dmtoolkit.asgi import init_asgi_app
+
+app = init_asgi_app()
@@ -1,5 +1,6 @@
 """Flask configuration."""
-from os import environ, path
+from datetime import timedelta
+from os import cpu_count, environ, path
 from dotenv import load_dotenv
 
 
@@ -10,10 +11,39 @@ load_dotenv(path.join(basedir, '.env'))
 class Config:
     """Base config."""
     SECRET_KEY = environ.get('SECRET_KEY')
-    SESSION_COOKIE_NAME = environ.get('SESSION_COOKIE_NAME')
-    SESSION_TYPE = "null"
+    SESSION_COOKIE_NAME = environ.get('SESSION_COOKIE_NAME', 'session')
+    # See dmtoolkit/session_store.py
+    SESSION_TYPE = environ.get('SESSION_TYPE', 'sqlite')
+    SESSION_SQLITE_PATH = environ.get('SESSION_SQLITE_PATH', path.join(basedir, 'instance', 'sessions.sqlite3'))
+    SESSION_REDIS_URL = environ.get('SESSION_REDIS_URL', 'redis://localhost:6379')
+    # Sessions are only written when they change, and kept for a year after that
+    SESSION_REFRESH_EACH_REQUEST = False
+    PERMANENT_SESSION_LIFETIME = timedelta(days=int(environ.get('SESSION_LIFETIME_DAYS', 365)))
     STATIC_FOLDER = 'static'
     TEMPLATES_FOLDER = 'templates'
+    MACRO_CACHE_SIZE = int(environ.get('MACRO_CACHE_SIZE', 4096))
+    STATBLOCK_CACHE_SIZE = int(environ.get('STATBLOCK_CACHE_SIZE', 512))
+    STATBLOCK_CACHE_WARM = environ.get('STATBLOCK_CACHE_WARM', '').lower() in ('1', 'true', 'yes')
+    PRELOAD_COMPENDIUM = environ.get('PRELOAD_COMPENDIUM', '').lower() in ('1', 'true', 'yes')
+    ENABLE_DIAGNOSTICS = environ.get('ENABLE_DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+    # Per gunicorn worker, so keep it small: 4 workers with 2 each already start 8 processes
+    SIMULATION_WORKERS = int(environ.get('SIMULATION_WORKERS', 2))
+    SIMULATION_TIME_BUDGET = float(environ.get('SIMULATION_TIME_BUDGET', 2.0))
+    ENCOUNTER_LIBRARY_PATH = environ.get('ENCOUNTER_LIBRARY_PATH', path.join(basedir, 'instance', 'encounters.sqlite3'))
+    # Which library is whose is kept in a cookie of its own (see library_owner in dmtoolkit/api/routes.py).
+    #   It's renewed whenever the library is used; browsers don't keep cookies longer than 400 days.
+    LIBRARY_COOKIE_NAME = environ.get('LIBRARY_COOKIE_NAME', 'library_id')
+    LIBRARY_COOKIE_LIFETIME = timedelta(days=400)
+    # Where live tracker sessions are kept: "memory" only works with a single worker, "redis" is
+    #   shared by every worker (see dmtoolkit/inittracker/sessions.py)
+    TRACKER_STORE = environ.get('TRACKER_STORE', 'memory')
+    TRACKER_REDIS_URL = environ.get('TRACKER_REDIS_URL', 'redis://localhost:6379')
+    # Most clients each worker streams live tracker updates to; each one holds a thread for as long as it's connected
+    TRACKER_MAX_SUBSCRIBERS = int(environ.get('TRACKER_MAX_SUBSCRIBERS', 32))
+    # How many worker processes serve the app (gunicorn.conf.py sets it for gunicorn's workers)
+    WEB_CONCURRENCY = int(environ.get('WEB_CONCURRENCY', 1))
+    ASGI_THREADS = int(environ.get('ASGI_THREADS', 256))
+    ASGI_RENDER_THREADS = int(environ.get('ASGI_RENDER_THREADS', min(4, cpu_count() or 1)))
 
 
 class ProdConfig(Config):
@@ -1,24 +1,28 @@
+from typing import Optional
+
 from flask import Flask
-from flask_session import Session
 from flask_wtf import CSRFProtect
 
+from dmtoolkit.context import init_request_state
 from dmtoolkit.filters import add_filters
+from dmtoolkit.session_store import init_session_store
 
 csrf = CSRFProtect()
-# session = Session()
 
-def init_app():
-    """Create the app."""
+def init_app(preload: Optional[bool] = None):
+    """Create the app. If 'preload' is True, all of the compendium data is loaded before the app is
+    returned; by default, this is controlled by the PRELOAD_COMPENDIUM config option."""
     app = Flask(__name__, instance_relative_config=False)
     app.config.from_object("config.DevConfig")
 
     app.jinja_env.lstrip_blocks = True # Prevent weird indents from templates
 
     csrf.init_app(app)
-    # session.init_app(app)
+    init_session_store(app)
 
     with app.app_context():
         from .inittracker.routes import tracker_bp
+        from .inittracker.sessions import init_tracker_store
         from .players.routes import players_bp
         from .api.routes import api_bp
         from .settings.routes import settings_bp
@@ -32,5 +36,16 @@ def init_app():
         app.register_blueprint(kibbles_bp)
 
         add_filters(app)
+        init_request_state(app)
+        init_tracker_store(app)
+
+        if preload if preload is not None else app.config.get("PRELOAD_COMPENDIUM"):
+            from .preload import preload_compendium
+            preload_compendium()
+
+        from .inittracker.statblocks import STATBLOCKS, warm_statblock_cache
+        STATBLOCKS.resize(app.config.get("STATBLOCK_CACHE_SIZE", STATBLOCKS.maxsize))
+        if app.config.get("STATBLOCK_CACHE_WARM"):
+            warm_statblock_cache(app)
     
     return app
\ No newline at end of file
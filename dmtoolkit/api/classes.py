@@ -1,17 +1,16 @@
 from pathlib import Path
 
 from dmtoolkit.api.models import Class
-from dmtoolkit.api.serialize import load_json
+from dmtoolkit.api.registry import LazyRegistry
+from dmtoolkit.api.snapshot import load_data_file
 
 DATADIR = Path(__file__).parent / "data"
 CLASS_DATA_PATH = DATADIR / "classes.json"
 
-CLASSES: dict[str, Class] = {}
+def _load_classes() -> dict[str, Class]:
+    return {c.name: c for c in load_data_file(CLASS_DATA_PATH)}
 
-def _load_classes():
-    global CLASSES
-    with CLASS_DATA_PATH.open("r") as f:
-        CLASSES = {c.name: c for c in load_json(f)}
+CLASSES: LazyRegistry[str, Class] = LazyRegistry("classes", _load_classes)
 
 
 def list_classes() -> list[Class]:
@@ -21,7 +20,3 @@ def list_classes() -> list[Class]:
 
 def get_class(name: str) -> Class:
     return CLASSES[name]
-
-# Make sure we load the classes dict at least once on load
-if not CLASSES:
-    _load_classes()
\ No newline at end of file
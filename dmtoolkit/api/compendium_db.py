@@ -0,0 +1,360 @@
+"""
+An optional SQLite backend for the items, spells and monsters. The LazyRegistry for each of them
+holds every object in memory, in every process; `dmk compendium build` compiles the same data into
+a read-only database instead, so `get_item`, `get_spell` and `get_monster` can fetch just the
+objects a request asks for. The most recently used objects are kept in a small LRU cache in front
+of the database.
+
+The database also has an FTS5 index over the names and entry text, so the compendium can be
+searched for what things *say* ("spells that mention frightened"), not only for their names.
+
+Like the snapshot (see dmtoolkit.api.snapshot), the database is only used while it is fresh: every
+source file must still be the same as when it was built, and the models must still have the same
+fields. Once a registry has been loaded anyway (because something needed every object, like
+`list_items` or the search index), the getters use it instead, since it's faster.
+"""
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Iterator
+from html import escape
+from os import environ
+from pathlib import Path
+import pickle
+import re
+import sqlite3
+from threading import Lock, local
+from typing import Any, NamedTuple, Optional
+
+from dmtoolkit.api.models import Entry, Section, Table
+from dmtoolkit.api.snapshot import _source_key, _source_stamp, get_schema_hash
+from dmtoolkit.constants import ROOT_DIR
+from dmtoolkit.util import LRUCache, get_logger
+
+log = get_logger(__name__)
+
+# Bump this whenever the tables change
+DB_FORMAT_VERSION = 1
+
+DB_PATH = ROOT_DIR / "api" / "data" / "compendium.sqlite3"
+
+# Set DMTOOLKIT_NO_COMPENDIUM_DB to always use the in-memory registries, even if the database is fresh
+DB_ENABLED = "DMTOOLKIT_NO_COMPENDIUM_DB" not in environ
+
+# How many objects each process keeps unpickled
+HOT_OBJECTS = 512
+
+# The registries the database can stand in for, by kind
+REGISTRY_KINDS = {"items": "item", "spells": "spell", "monsters": "monster"}
+
+_SCHEMA = """
+CREATE TABLE meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE sources (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE objects (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+-- Each namespace ("item", "spell", "spell_2024", "monster") maps its lookup keys to the objects
+CREATE TABLE keys (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    object_id INTEGER NOT NULL REFERENCES objects (id),
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+-- The rowid of each document is the id of its object
+CREATE VIRTUAL TABLE text_index USING fts5(
+    name, text, kind UNINDEXED,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+"""
+
+# {@condition frightened} -> frightened, {@damage 2d6|...} -> 2d6
+_MACRO = re.compile(r"\{@\w+(?: ([^{}|]*)[^{}]*)?\}")
+_HTML_TAG = re.compile(r"<[^>]*>")
+_WORD = re.compile(r"\w+")
+
+# Marks the matches in snippets, until the rest of the snippet has been escaped
+_MATCH_START, _MATCH_END = "\x02", "\x03"
+
+
+class _Kind(NamedTuple):
+    paths: Callable[[], tuple[Path, ...]]
+    # Returns the lookup keys for each namespace
+    load: Callable[[], dict[str, dict[str, Any]]]
+    key: Callable[[Any], str]
+    source: Callable[[Any], str]
+
+
+def _load_items() -> dict[str, dict[str, Any]]:
+    from dmtoolkit.api import items
+    return {"item": items._load_items()}
+
+
+def _load_spells() -> dict[str, dict[str, Any]]:
+    from dmtoolkit.api import spells
+    spell_lists = spells._load_spells()
+    return {"spell": spell_lists[False], "spell_2024": spell_lists[True]}
+
+
+def _load_monsters() -> dict[str, dict[str, Any]]:
+    from dmtoolkit.api import monsters
+    return {"monster": monsters._load_monsters()}
+
+
+def _item_paths() -> tuple[Path, ...]:
+    from dmtoolkit.api import items
+    return items.ITEM_DATA_PATHS
+
+
+def _spell_paths() -> tuple[Path, ...]:
+    from dmtoolkit.api import spells
+    return (spells.SPELL_DATA_PATH,)
+
+
+def _monster_paths() -> tuple[Path, ...]:
+    from dmtoolkit.api import monsters
+    return (monsters.DEFAULT_MONSTERS_FILE,)
+
+
+KINDS: dict[str, _Kind] = {
+    "item": _Kind(_item_paths, _load_items, lambda item: item.id(), lambda item: item.source[0]),
+    "spell": _Kind(_spell_paths, _load_spells, lambda spell: spell.name, lambda spell: spell.source),
+    "monster": _Kind(_monster_paths, _load_monsters, lambda monster: monster.key, lambda monster: monster.source),
+}
+
+
+def _text_parts(value: Any) -> Iterator[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, Table):
+        yield value.caption
+        yield from value.col_labels
+        for row in value.rows:
+            yield from _text_parts(row)
+    elif isinstance(value, Entry):
+        yield value.title
+        yield from _text_parts(value.body)
+    elif isinstance(value, Section):
+        yield from (value.title, value.header, value.body)
+    elif isinstance(value, (list, tuple)):
+        for part in value:
+            yield from _text_parts(part)
+
+
+def entry_text(obj: Any) -> str:
+    """Returns the plain text of an item's, spell's or monster's entries, without any markup."""
+    parts = []
+    for field_name in ("entries", "traits", "actions", "bonus_actions", "reactions", "legendary_actions"):
+        parts.extend(_text_parts(getattr(obj, field_name, None)))
+    text = "\n".join(part for part in parts if part)
+    text = _MACRO.sub(lambda match: match.group(1) or "", text)
+    return _HTML_TAG.sub(" ", text)
+
+
+def fresh_kinds(sources: Iterable[tuple[str, str, int, int]], built: str) -> set[str]:
+    """Given the (path, kind, size, mtime_ns) of every source something was `built` from, returns
+    the kinds whose sources are all unchanged since."""
+    fresh, stale = set(), set()
+    for path, kind, size, mtime_ns in sources:
+        try:
+            is_fresh = _source_stamp(ROOT_DIR / path) == (size, mtime_ns)
+        except FileNotFoundError:
+            is_fresh = False
+        (fresh if is_fresh else stale).add(kind)
+    if stale:
+        log.info(f"Ignoring stale {', '.join(sorted(stale))}s in {built}")
+    return fresh - stale
+
+
+def build_compendium_db(outfile: Path = DB_PATH, kinds: Iterable[str] = KINDS) -> dict[str, int]:
+    """Loads the items, spells and monsters (from the snapshot, or JSON), and writes them to a
+    compendium database. Kinds whose data files are missing are left out. Returns how many objects
+    of each kind were written."""
+    tmpfile = outfile.with_suffix(outfile.suffix + ".tmp")
+    tmpfile.unlink(missing_ok=True)
+    counts: dict[str, int] = {}
+    db = sqlite3.connect(tmpfile, isolation_level=None)
+    try:
+        db.executescript(_SCHEMA)
+        db.execute("BEGIN")
+        db.executemany("INSERT INTO meta (name, value) VALUES (?, ?)", [
+            ("version", str(DB_FORMAT_VERSION)),
+            ("schema", get_schema_hash()),
+        ])
+        for kind in kinds:
+            try:
+                counts[kind] = _insert_kind(db, kind, KINDS[kind])
+            except FileNotFoundError as e:
+                log.warning(f"Leaving {kind}s out of the compendium database: {e}")
+        db.execute("INSERT INTO text_index (text_index) VALUES ('optimize')")
+        db.execute("COMMIT")
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    tmpfile.replace(outfile) # Atomic, so a running app never sees a half-written database
+    return counts
+
+
+def _insert_kind(db: sqlite3.Connection, kind: str, spec: _Kind) -> int:
+    paths = spec.paths()
+    # Stamp the sources before loading them, so a change while we load shows up as stale
+    stamps = {_source_key(path): _source_stamp(path) for path in paths}
+    namespaces = spec.load()
+    db.executemany(
+        "INSERT INTO sources (path, kind, size, mtime_ns) VALUES (?, ?, ?, ?)",
+        [(path, kind, size, mtime_ns) for path, (size, mtime_ns) in stamps.items()],
+    )
+    object_ids: dict[int, int] = {}
+    for namespace, objects in namespaces.items():
+        for key, obj in objects.items():
+            if (object_id := object_ids.get(id(obj))) is None:
+                object_id = db.execute(
+                    "INSERT INTO objects (kind, key, name, source, payload) VALUES (?, ?, ?, ?, ?)",
+                    (kind, spec.key(obj), obj.name, spec.source(obj), pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)),
+                ).lastrowid
+                db.execute(
+                    "INSERT INTO text_index (rowid, name, text, kind) VALUES (?, ?, ?, ?)",
+                    (object_id, obj.name, entry_text(obj), kind),
+                )
+                object_ids[id(obj)] = object_id
+            db.execute("INSERT INTO keys (namespace, key, object_id) VALUES (?, ?, ?)", (namespace, key, object_id))
+    return len(object_ids)
+
+
+class TextMatch(NamedTuple):
+    kind: str
+    key: str
+    name: str
+    source: str
+    # HTML, with the matching words in <mark> tags
+    snippet: str
+    score: float
+
+
+def _fts_query(query: str) -> str:
+    """Turns what the user typed into an FTS5 query which matches every word, the last one by
+    prefix (so results show up while the user is still typing)."""
+    words = _WORD.findall(query.lower())
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+class CompendiumDB:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._local = local()
+        # (namespace, key) -> object id, and object id -> object
+        self._keys = LRUCache(maxsize=HOT_OBJECTS * 4)
+        self.objects = LRUCache(maxsize=HOT_OBJECTS)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if (db := getattr(self._local, "db", None)) is None:
+            db = self._local.db = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        return db
+
+    def check(self) -> set[str]:
+        """Returns the kinds the database has up-to-date copies of. Returns an empty set if the
+        database was built for another version of the models."""
+        meta = dict(self.db.execute("SELECT name, value FROM meta"))
+        if meta.get("version") != str(DB_FORMAT_VERSION) or meta.get("schema") != get_schema_hash():
+            log.info("Ignoring compendium database built for an old version of the models")
+            return set()
+        sources = self.db.execute("SELECT path, kind, size, mtime_ns FROM sources")
+        return fresh_kinds(sources, "the compendium database")
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns the object with the given key, or 'None' if there isn't one."""
+        if (object_id := self._keys.get((namespace, key))) is None:
+            row = self.db.execute("SELECT object_id FROM keys WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            if row is None:
+                return None
+            object_id = self._keys[(namespace, key)] = row[0]
+        if (obj := self.objects.get(object_id)) is None:
+            (payload,) = self.db.execute("SELECT payload FROM objects WHERE id = ?", (object_id,)).fetchone()
+            obj = self.objects[object_id] = pickle.loads(payload)
+        return obj
+
+    def search_text(self, query: str, kinds: Optional[Iterable[str]] = None, limit: int = 20) -> list[TextMatch]:
+        """Full-text search over the names and entries. Matches in names count for more."""
+        if not (fts_query := _fts_query(query)):
+            return []
+        sql = f"""
+            SELECT o.kind, o.key, o.name, o.source,
+                snippet(text_index, 1, '{_MATCH_START}', '{_MATCH_END}', '…', 16),
+                bm25(text_index, 5.0, 1.0) AS score
+            FROM text_index JOIN objects o ON o.id = text_index.rowid
+            WHERE text_index MATCH ?
+        """
+        params: list[Any] = [fts_query]
+        if kinds:
+            kinds = list(kinds)
+            sql += f" AND text_index.kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        return [
+            TextMatch(kind, key, name, source, _mark(snippet), -score)
+            for kind, key, name, source, snippet, score in self.db.execute(sql, params)
+        ]
+
+
+def _mark(snippet: str) -> str:
+    return escape(snippet).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
+
+
+_DB: Optional[CompendiumDB] = None
+_FRESH_KINDS: set[str] = set()
+_DB_LOCK = Lock()
+
+
+def _open() -> Optional[CompendiumDB]:
+    global _DB, _FRESH_KINDS
+    if _DB is None:
+        with _DB_LOCK:
+            if _DB is None:
+                db = CompendiumDB(DB_PATH)
+                fresh: set[str] = set()
+                if DB_ENABLED and DB_PATH.exists():
+                    try:
+                        fresh = db.check()
+                    except sqlite3.Error as e:
+                        log.warning(f"Unable to read compendium database {DB_PATH}: {e}")
+                _FRESH_KINDS = fresh
+                _DB = db
+    return _DB if _FRESH_KINDS else None
+
+
+def get_compendium_db(kind: str) -> Optional[CompendiumDB]:
+    """Returns the compendium database, if it has an up-to-date copy of the given kind of object."""
+    db = _open()
+    return db if kind in _FRESH_KINDS else None
+
+
+def search_text(query: str, kinds: Optional[Iterable[str]] = None, limit: int = 20) -> Optional[list[TextMatch]]:
+    """Full-text search over the up-to-date parts of the compendium database. Returns 'None' if
+    there's no usable database."""
+    if (db := _open()) is None:
+        return None
+    kinds = [kind for kind in (kinds or KINDS) if kind in _FRESH_KINDS]
+    return db.search_text(query, kinds, limit) if kinds else []
+
+
+def reset():
+    """Forget the open database (and what was fresh in it), so it's checked again on next use."""
+    global _DB, _FRESH_KINDS
+    with _DB_LOCK:
+        _DB = None
+        _FRESH_KINDS = set()
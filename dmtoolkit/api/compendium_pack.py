@@ -0,0 +1,232 @@
+"""
+The compendium pack: a read-only file of the items, spells and monsters, which each process
+memory-maps instead of loading. Built by `dmk compendium pack`.
+
+Every worker maps the same file, so the data sits once in the OS page cache and is shared by all of
+them, without the copy-on-write pages (and frozen garbage collector) preloading relies on. Lookups
+binary search the mapped index in place; an object is only unpickled when a route asks for it, and
+the most recently used ones are kept in a small LRU cache.
+
+The file is laid out as:
+
+    MAGIC, header length (u32), pickled header
+    string table: every lookup key, UTF-8
+    offset index: for each namespace, a sorted array of (key offset, key length, object offset,
+        object length) records, all u32 and relative to the end of the header
+    objects: one pickle per object, shared by all of its keys
+
+Like the compendium database (see dmtoolkit.api.compendium_db), the pack is only used while it's
+fresh. When both are fresh, the getters use the pack.
+"""
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator
+import mmap
+from os import environ
+from pathlib import Path
+import pickle
+import struct
+from threading import Lock
+from typing import Any, Optional
+
+from dmtoolkit.api.compendium_db import KINDS, CompendiumDB, fresh_kinds, get_compendium_db
+from dmtoolkit.api.snapshot import _source_key, _source_stamp, get_schema_hash
+from dmtoolkit.constants import ROOT_DIR
+from dmtoolkit.util import LRUCache, get_logger
+
+log = get_logger(__name__)
+
+MAGIC = b"DMKPACK\0"
+# Bump this whenever the layout of the file changes
+PACK_FORMAT_VERSION = 1
+
+PACK_PATH = ROOT_DIR / "api" / "data" / "compendium.pack"
+
+# Set DMTOOLKIT_NO_COMPENDIUM_PACK to never use the pack, even if it's fresh
+PACK_ENABLED = "DMTOOLKIT_NO_COMPENDIUM_PACK" not in environ
+
+# How many objects each process keeps unpickled
+HOT_OBJECTS = 512
+
+_LENGTH = struct.Struct("<I")
+_RECORD = struct.Struct("<IIII")
+
+
+def build_compendium_pack(outfile: Path = PACK_PATH, kinds: Iterable[str] = KINDS) -> dict[str, int]:
+    """Loads the items, spells and monsters (from the snapshot, or JSON), and writes them to a
+    compendium pack. Kinds whose data files are missing are left out. Returns how many objects of
+    each kind were written."""
+    sources: dict[str, tuple[str, int, int]] = {}
+    namespaces: dict[str, list[tuple[bytes, int]]] = {}
+    blobs: list[bytes] = []
+    counts: dict[str, int] = {}
+    for kind in kinds:
+        spec = KINDS[kind]
+        try:
+            # Stamp the sources before loading them, so a change while we load shows up as stale
+            stamps = {_source_key(path): _source_stamp(path) for path in spec.paths()}
+            loaded = spec.load()
+        except FileNotFoundError as e:
+            log.warning(f"Leaving {kind}s out of the compendium pack: {e}")
+            continue
+        sources |= {path: (kind, size, mtime_ns) for path, (size, mtime_ns) in stamps.items()}
+        object_ids: dict[int, int] = {}
+        for namespace, objects in loaded.items():
+            keys = namespaces.setdefault(namespace, [])
+            for key, obj in objects.items():
+                if (object_id := object_ids.get(id(obj))) is None:
+                    object_id = object_ids[id(obj)] = len(blobs)
+                    blobs.append(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+                keys.append((key.encode(), object_id))
+        counts[kind] = len(object_ids)
+
+    # Lay out the string table, then the index, then the objects
+    strings = bytearray()
+    key_offsets: dict[str, list[tuple[int, int, int]]] = {}
+    for namespace, keys in namespaces.items():
+        key_offsets[namespace] = []
+        for key, object_id in sorted(keys):
+            key_offsets[namespace].append((len(strings), len(key), object_id))
+            strings += key
+    index_start = len(strings)
+    objects_start = index_start + sum(len(keys) for keys in namespaces.values()) * _RECORD.size
+    object_offsets, offset = [], objects_start
+    for blob in blobs:
+        object_offsets.append(offset)
+        offset += len(blob)
+
+    header = {
+        "version": PACK_FORMAT_VERSION,
+        "schema": get_schema_hash(),
+        "sources": sources,
+        "namespaces": {},
+    }
+    index = bytearray()
+    for namespace, records in key_offsets.items():
+        header["namespaces"][namespace] = (index_start + len(index), len(records))
+        for key_offset, key_length, object_id in records:
+            index += _RECORD.pack(key_offset, key_length, object_offsets[object_id], len(blobs[object_id]))
+    if offset > 0xFFFFFFFF:
+        raise ValueError("The compendium is too big for a pack")
+
+    tmpfile = outfile.with_suffix(outfile.suffix + ".tmp")
+    header_blob = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    with tmpfile.open("wb") as f:
+        f.write(MAGIC + _LENGTH.pack(len(header_blob)) + header_blob)
+        f.write(strings)
+        f.write(index)
+        for blob in blobs:
+            f.write(blob)
+    tmpfile.replace(outfile) # Atomic, so a running app never sees a half-written pack
+    return counts
+
+
+class CompendiumPack:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            # Mapped read-only, so every process shares the same pages of the page cache
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} isn't a compendium pack")
+        (header_length,) = _LENGTH.unpack_from(self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + _LENGTH.size
+        self.header: dict[str, Any] = pickle.loads(self._mmap[header_start:header_start + header_length])
+        self._start = header_start + header_length
+        self._view = memoryview(self._mmap)
+        # Object offset -> object, so every key of an object gives the same one
+        self.objects = LRUCache(maxsize=HOT_OBJECTS)
+
+    def check(self) -> set[str]:
+        """Returns the kinds the pack has up-to-date copies of. Returns an empty set if the pack was
+        built with another format, or for another version of the models."""
+        if self.header.get("version") != PACK_FORMAT_VERSION or self.header.get("schema") != get_schema_hash():
+            log.info("Ignoring compendium pack built for an old version of the models")
+            return set()
+        sources = self.header["sources"].items()
+        return fresh_kinds(((path, *source) for path, source in sources), "the compendium pack")
+
+    def _record(self, namespace_start: int, i: int) -> tuple[int, int, int, int]:
+        return _RECORD.unpack_from(self._mmap, self._start + namespace_start + i * _RECORD.size)
+
+    def _key(self, offset: int, length: int) -> bytes:
+        return self._mmap[self._start + offset:self._start + offset + length]
+
+    def _find(self, namespace: str, key: str) -> Optional[tuple[int, int]]:
+        """Binary searches the namespace's index for the key. Returns the object's offset and length."""
+        if namespace not in self.header["namespaces"]:
+            return None
+        namespace_start, count = self.header["namespaces"][namespace]
+        target = key.encode()
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            key_offset, key_length, object_offset, object_length = self._record(namespace_start, mid)
+            mid_key = self._key(key_offset, key_length)
+            if mid_key < target:
+                low = mid + 1
+            elif mid_key > target:
+                high = mid
+            else:
+                return object_offset, object_length
+        return None
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns the object with the given key, or 'None' if there isn't one."""
+        if (found := self._find(namespace, key)) is None:
+            return None
+        offset, length = found
+        if (obj := self.objects.get(offset)) is None:
+            start = self._start + offset
+            obj = self.objects[offset] = pickle.loads(self._view[start:start + length])
+        return obj
+
+    def keys(self, namespace: str) -> Iterator[str]:
+        """Every key in the namespace, in (UTF-8) order."""
+        namespace_start, count = self.header["namespaces"].get(namespace, (0, 0))
+        for i in range(count):
+            key_offset, key_length, _, _ = self._record(namespace_start, i)
+            yield self._key(key_offset, key_length).decode()
+
+
+_PACK: Optional[CompendiumPack] = None
+_FRESH_KINDS: set[str] = set()
+_OPENED = False
+_PACK_LOCK = Lock()
+
+
+def _open() -> Optional[CompendiumPack]:
+    global _PACK, _FRESH_KINDS, _OPENED
+    if not _OPENED:
+        with _PACK_LOCK:
+            if not _OPENED:
+                if PACK_ENABLED and PACK_PATH.exists():
+                    try:
+                        pack = CompendiumPack(PACK_PATH)
+                        _FRESH_KINDS = pack.check()
+                        _PACK = pack
+                    except Exception as e:
+                        log.warning(f"Unable to read compendium pack {PACK_PATH}: {e}")
+                _OPENED = True
+    return _PACK
+
+
+def get_compendium_pack(kind: str) -> Optional[CompendiumPack]:
+    """Returns the compendium pack, if it has an up-to-date copy of the given kind of object."""
+    pack = _open()
+    return pack if kind in _FRESH_KINDS else None
+
+
+def get_compendium_store(kind: str) -> Optional[CompendiumPack | CompendiumDB]:
+    """Returns where to look up the given kind of object instead of its registry: the pack or the
+    database, whichever is fresh (the pack, if both are). Returns 'None' if neither is."""
+    return get_compendium_pack(kind) or get_compendium_db(kind)
+
+
+def reset():
+    """Forget the open pack (and what was fresh in it), so it's checked again on next use."""
+    global _PACK, _FRESH_KINDS, _OPENED
+    with _PACK_LOCK:
+        _PACK = None
+        _FRESH_KINDS = set()
+        _OPENED = False
@@ -1,8 +1,10 @@
 from pathlib import Path
 
 from dmtoolkit.util import normalize_name, get_logger
+from dmtoolkit.api.compendium_pack import get_compendium_store
 from dmtoolkit.api.models import Item
-from dmtoolkit.api.serialize import load_json
+from dmtoolkit.api.registry import LazyRegistry
+from dmtoolkit.api.snapshot import load_data_file
 
 log = get_logger(__name__)
 
@@ -16,23 +18,23 @@ ITEM_DATA_PATHS = (
     KIBBLES_DIR / "variants.json",
 )
 
-ITEMS: dict[str, Item] = {}
-
-def _load_items():
-    global ITEMS
-    ITEMS = {}
+def _load_items() -> dict[str, Item]:
+    items = {}
     for ITEM_DATA_PATH in ITEM_DATA_PATHS:
-        with ITEM_DATA_PATH.open("r") as f:
-            try:
-                item_objects: list[Item] = load_json(f)
-            except Exception as e:
-                log.error(f"Unable to load items from {ITEM_DATA_PATH}: {e}")
-                raise e
-            for item in item_objects:
-                item_name = normalize_name(item.name)
-                item_source = item.source[0].lower()
-                ITEMS[item_name] = item
-                ITEMS[f"{item_name}|{item_source}"] = item
+        try:
+            item_objects: list[Item] = load_data_file(ITEM_DATA_PATH)
+        except Exception as e:
+            log.error(f"Unable to load items from {ITEM_DATA_PATH}: {e}")
+            raise e
+        for item in item_objects:
+            item_name = normalize_name(item.name)
+            item_source = item.source[0].lower()
+            items[item_name] = item
+            items[f"{item_name}|{item_source}"] = item
+    return items
+
+# Maps normalized item names (with and without "|source") to the items
+ITEMS: LazyRegistry[str, Item] = LazyRegistry("items", _load_items)
 
 
 def list_items() -> list[Item]:
@@ -45,10 +47,13 @@ def get_item(name: str) -> Item | None:
     # If the key also has the source, we need to normalize differently
     if "|" in name:
         norm_name = "|".join(normalize_name(part) for part in name.split("|")[:2])
-    try:
-        return ITEMS[norm_name]
-    except:
+    if not ITEMS.loaded and (store := get_compendium_store("item")):
+        item = store.get("item", norm_name)
+    else:
+        item = ITEMS.get(norm_name)
+    if item is None:
         log.warning(f"Unable to find item {norm_name}")
+    return item
 
 
 def find_item_by_name(name: str) -> list[Item]:
@@ -61,8 +66,3 @@ def find_item_by_name(name: str) -> list[Item]:
             matches.add(item)
 
     return list(matches)
-
-
-# Make sure we load the items dict at least once on load
-if not ITEMS:
-    _load_items()
\ No newline at end of file
@@ -9,6 +9,7 @@ from typing import Any, Optional, TypeVar, Generic, Type
 import dominate.tags as dtags
 from flask import render_template_string
 
+from dmtoolkit import dice
 from dmtoolkit.util import get_logger
 
 log = get_logger(__name__)
@@ -66,7 +67,7 @@ class Monster(Model):
     legendary_actions: Optional[Section] = None
     
     spellcasting: Optional[list[SpellCasting]] = field(default_factory=list)
-    # environment: list[str]
+    environment: Optional[list[str]] = field(default_factory=list)
 
     other_sources: list[dict] = field(default_factory=list)
     subtype: Optional[str] = None
@@ -136,6 +137,15 @@ class HP:
     def __int__(self):
         return self.average
 
+    def roll(self) -> int:
+        """Rolls the HP formula, falling back to the average for HP without a (valid) formula."""
+        if self.formula:
+            try:
+                return max(dice.compile(self.formula).roll(), 1)
+            except ValueError:
+                log.debug("Couldn't roll HP formula '%s'", self.formula)
+        return self.average
+
 
 @dataclass
 class Scalar:
@@ -890,6 +900,8 @@ class ItemWeapon(Item):
     attunement: str = ""
     range: str = ""
 
+    __hash__ = Item.__hash__
+
     @classmethod
     def from_spec(cls: Type[ItemWeapon], spec: dict[str, Any]) -> Item:
         # Do some field conversion
@@ -905,6 +917,8 @@ class ItemArmor(Item):
     min_strength: int = 0
     affects_stealth: bool = False
 
+    __hash__ = Item.__hash__
+
     @classmethod
     def from_spec(cls: Type[ItemArmor], spec: dict[str, Any]) -> Item:
         # Do some field conversion
@@ -917,4 +931,6 @@ class ItemArmor(Item):
 @dataclass(kw_only=True)
 class KibblesIngredient(Item):
     ingredient_type: str
-    locales: list[str] = field(default_factory=list)
\ No newline at end of file
+    locales: list[str] = field(default_factory=list)
+
+    __hash__ = Item.__hash__
\ No newline at end of file
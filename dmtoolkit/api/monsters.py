@@ -1,24 +1,54 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from fractions import Fraction
+import heapq
+import math
 from pathlib import Path
+from threading import Lock
+from typing import Iterable, Iterator
 
+from dmtoolkit.api.compendium_pack import get_compendium_store
 from dmtoolkit.api.models import Monster
-from dmtoolkit.api.serialize import load_json
+from dmtoolkit.api.registry import LazyRegistry
+from dmtoolkit.api.snapshot import load_data_file
+from dmtoolkit.util import normalize_name
 
 DEFAULT_MONSTERS_FILE = Path(__file__).parent / "data" / "monsters.json"
-MONSTERS: dict[str, Monster] = {}
+
+# Monsters that show up in most campaigns. They're suggested first until the tracker has seen which
+#   monsters actually get used.
+COMMON_MONSTERS = (
+    "Bandit-MM",
+    "Bugbear-MM",
+    "Ghoul-MM",
+    "Gnoll-MM",
+    "Goblin-MM",
+    "Hobgoblin-MM",
+    "Kobold-MM",
+    "Ogre-MM",
+    "Orc-MM",
+    "Skeleton-MM",
+    "Wolf-MM",
+    "Zombie-MM",
+)
+
+def _load_monsters() -> dict[str, Monster]:
+    monster_list: list[Monster] = load_data_file(DEFAULT_MONSTERS_FILE)
+    return {monster.key: monster for monster in monster_list}
+
+MONSTERS: LazyRegistry[str, Monster] = LazyRegistry("monsters", _load_monsters)
 
 def get_monsters() -> dict[str, Monster]:
-    """Returns the MONSTERS dict."""
-    if not MONSTERS:
-        with DEFAULT_MONSTERS_FILE.open("r") as f:
-            monster_list: list[Monster] = load_json(f)
-        for monster in monster_list:
-            MONSTERS[monster.key] = monster
-    
-    return MONSTERS
+    """Returns the MONSTERS dict, loading it if needed."""
+    return MONSTERS.data
 
 
 def get_monster(key: str) -> Monster | None:
     """Fetch a specific monster by key. Returns 'None' if there is no monster with that key."""
+    if not MONSTERS.loaded and (store := get_compendium_store("monster")):
+        return store.get("monster", key)
     return get_monsters().get(key, None)
 
 
@@ -30,8 +60,216 @@ def get_monster_names(prefer_reprinted: bool = False) -> list[tuple[str, str]]:
     """
     namelist = []
     for monster_key, monster in get_monsters().items():
-        # Exclude 2014 or 2024 depending on settings
-        if monster.has_2024 == prefer_reprinted:
+        # Exclude 2014 or 2024 depending on settings, the same way as spells
+        if monster.has_2024 if prefer_reprinted else monster.is_2024:
             continue
         namelist.append((monster_key, monster.name))
-    return namelist
\ No newline at end of file
+    return namelist
+
+
+def _build_suggestions() -> dict[bool, list[tuple[str, str, bool]]]:
+    """For each value of `prefer_reprinted`, builds a sorted list of (normalized name, monster key,
+    True) entries. The rest of the name from every later word gets an entry too, marked False, so
+    "dragon" suggests "Adult Red Dragon"."""
+    suggestions: dict[bool, list[tuple[str, str, bool]]] = {}
+    for prefer_reprinted in (False, True):
+        entries = []
+        for monster_key, name in get_monster_names(prefer_reprinted):
+            words = normalize_name(name).split()
+            for i in range(len(words)):
+                entries.append((" ".join(words[i:]), monster_key, i == 0))
+        entries.sort()
+        suggestions[prefer_reprinted] = entries
+    return suggestions
+
+SUGGESTIONS: LazyRegistry[bool, list[tuple[str, str, bool]]] = LazyRegistry("monster_suggestions", _build_suggestions)
+
+# How many times each monster has been added to the tracker, by this process
+MONSTER_POPULARITY: Counter[str] = Counter({key: 1 for key in COMMON_MONSTERS})
+_POPULARITY_LOCK = Lock()
+
+
+def record_monster_use(key: str):
+    """Counts a monster being added to the tracker, so it's suggested sooner from now on."""
+    with _POPULARITY_LOCK:
+        MONSTER_POPULARITY[key] += 1
+
+
+def suggest_monsters(prefix: str, prefer_reprinted: bool = False, limit: int = 10) -> list[tuple[str, str]]:
+    """Returns the keys and names of monsters whose name (or any word in it) starts with the prefix.
+    The most used monsters come first, then names starting with the prefix, then the shortest."""
+    prefix = normalize_name(prefix).strip()
+    if not prefix:
+        return []
+    entries = SUGGESTIONS[bool(prefer_reprinted)]
+    # Maps each matching monster to whether its name starts with the prefix
+    matches: dict[str, bool] = {}
+    i = bisect_left(entries, (prefix,))
+    while i < len(entries) and entries[i][0].startswith(prefix):
+        _, monster_key, is_name_start = entries[i]
+        matches[monster_key] = matches.get(monster_key, False) or is_name_start
+        i += 1
+    monsters = get_monsters()
+    ranked = heapq.nsmallest(
+        limit,
+        matches,
+        key=lambda key: (-MONSTER_POPULARITY[key], not matches[key], len(monsters[key].name), monsters[key].name),
+    )
+    return [(key, monsters[key].name) for key in ranked]
+
+
+class MonsterIndex:
+    """Secondary indexes over the monsters. Every monster gets an ID, which is its position when
+    sorted by CR, so a range of CRs is a range of IDs. The other indexes map each (lowercase) type,
+    size, source and environment to the sorted IDs of the monsters that have it, and each of those
+    is also stored per monster, so candidates from one index can be checked against the others."""
+
+    def __init__(self, monsters: Iterable[Monster]):
+        # There are only a few dozen different CRs, so only parse each of them once. They're kept as
+        #   floats, which compare much faster than Fractions, and represent 1/8, 1/4 and 1/2 exactly.
+        cr_values: dict[str, float] = {}
+        def cr_key(monster: Monster) -> float:
+            if (value := cr_values.get(monster.cr)) is None:
+                try:
+                    value = float(monster.cr_num)
+                except (ValueError, ZeroDivisionError):
+                    value = math.inf # Sorts after every real CR, so it's never in a range
+                cr_values[monster.cr] = value
+            return value
+
+        self.monsters = sorted(monsters, key=lambda m: (cr_key(m), m.name, m.key))
+        self.crs = [cr_key(m) for m in self.monsters]
+        self.columns: dict[str, list[frozenset[str]]] = {
+            "type": [frozenset((m.maintype.lower(),)) for m in self.monsters],
+            "size": [frozenset((m.size_str.lower(),)) for m in self.monsters],
+            "source": [frozenset((m.source.lower(),)) for m in self.monsters],
+            "environment": [frozenset(env.lower() for env in m.environment or ()) for m in self.monsters],
+        }
+        self.postings: dict[str, dict[str, list[int]]] = {}
+        for column, values in self.columns.items():
+            postings = defaultdict(list)
+            for monster_id, monster_values in enumerate(values):
+                for value in monster_values:
+                    postings[value].append(monster_id)
+            self.postings[column] = dict(postings)
+
+    def cr_range(self, low: Fraction, high: Fraction) -> range:
+        """Returns the IDs of the monsters with a CR from `low` to `high`, inclusive."""
+        return range(bisect_left(self.crs, float(low)), bisect_right(self.crs, float(high)))
+
+    def ids(self, column: str, values: frozenset[str]) -> list[int]:
+        """Returns the sorted IDs of the monsters with any of the values in a column."""
+        if len(values) == 1:
+            return self.postings[column].get(next(iter(values)), [])
+        return sorted({i for value in values for i in self.postings[column].get(value, ())})
+
+
+_MONSTER_INDEX: MonsterIndex | None = None
+_MONSTER_INDEX_LOCK = Lock()
+
+def get_monster_index() -> MonsterIndex:
+    """Returns the secondary indexes over the monsters, building them on first use."""
+    global _MONSTER_INDEX
+    if _MONSTER_INDEX is None:
+        with _MONSTER_INDEX_LOCK:
+            if _MONSTER_INDEX is None:
+                _MONSTER_INDEX = MonsterIndex(get_monsters().values())
+    return _MONSTER_INDEX
+
+
+def reset_monster_index():
+    """Forget the monster indexes, so they're rebuilt from the current monsters on next use."""
+    global _MONSTER_INDEX
+    with _MONSTER_INDEX_LOCK:
+        _MONSTER_INDEX = None
+
+
+def _parse_cr(cr: str | int | float | Fraction) -> Fraction:
+    return Fraction(cr) if not isinstance(cr, float) else Fraction(cr).limit_denominator(8)
+
+
+class MonsterQuery:
+    """Finds the monsters matching some filters, using the secondary indexes. Each filter narrows the
+    results down further; giving one filter several values matches any of them.
+
+        MonsterQuery().cr(1, 5).type("undead").environment("swamp", "underdark").keys()
+
+    Only the smallest set of candidates is walked, and the rest of the filters are checked on those,
+    so a query costs about as much as the number of monsters it could return, not the whole bestiary.
+    Results are sorted by CR, then name.
+    """
+
+    def __init__(self):
+        self._cr: tuple[Fraction, Fraction] | None = None
+        self._filters: dict[str, frozenset[str]] = {}
+        self._prefer_reprinted: bool | None = None
+
+    def cr(self, low: str | int | float | Fraction, high: str | int | float | Fraction | None = None) -> MonsterQuery:
+        """Only monsters with a CR from `low` to `high`, inclusive. With only `low`, that exact CR."""
+        low = _parse_cr(low)
+        high = _parse_cr(high) if high is not None else low
+        if self._cr:
+            low, high = max(low, self._cr[0]), min(high, self._cr[1])
+        self._cr = (low, high)
+        return self
+
+    def _filter(self, column: str, values: tuple[str, ...]) -> MonsterQuery:
+        values = frozenset(value.lower() for value in values)
+        if column in self._filters:
+            values &= self._filters[column]
+        self._filters[column] = values
+        return self
+
+    def type(self, *types: str) -> MonsterQuery:
+        return self._filter("type", types)
+
+    def size(self, *sizes: str) -> MonsterQuery:
+        return self._filter("size", sizes)
+
+    def source(self, *sources: str) -> MonsterQuery:
+        return self._filter("source", sources)
+
+    def environment(self, *environments: str) -> MonsterQuery:
+        return self._filter("environment", environments)
+
+    def prefer_reprinted(self, prefer_reprinted: bool) -> MonsterQuery:
+        """Leaves out either the 2024 monsters, or the 2014 ones which were reprinted, like the
+        `use_new_content` setting does."""
+        self._prefer_reprinted = bool(prefer_reprinted)
+        return self
+
+    def _ids(self, index: MonsterIndex) -> Iterator[int]:
+        candidates: list[range | list[int]] = []
+        if self._cr:
+            candidates.append(index.cr_range(*self._cr))
+        for column, values in self._filters.items():
+            candidates.append(index.ids(column, values))
+        if not candidates:
+            candidates.append(range(len(index.monsters)))
+        smallest = min(candidates, key=len)
+
+        checks = [(index.columns[column], values) for column, values in self._filters.items()]
+        cr_range = index.cr_range(*self._cr) if self._cr else None
+        for monster_id in smallest:
+            if cr_range is not None and monster_id not in cr_range:
+                continue
+            if not all(column[monster_id] & values for column, values in checks):
+                continue
+            if self._prefer_reprinted is not None:
+                monster = index.monsters[monster_id]
+                if monster.has_2024 if self._prefer_reprinted else monster.is_2024:
+                    continue
+            yield monster_id
+
+    def __iter__(self) -> Iterator[Monster]:
+        index = get_monster_index()
+        return (index.monsters[monster_id] for monster_id in self._ids(index))
+
+    def all(self) -> list[Monster]:
+        return list(self)
+
+    def keys(self) -> list[str]:
+        return [monster.key for monster in self]
+
+    def count(self) -> int:
+        return sum(1 for _ in self._ids(get_monster_index()))
@@ -1,10 +1,11 @@
 from dataclasses import dataclass, asdict
 from pathlib import Path
 
-from flask import Response, request
+from flask import g, session
 
 from dmtoolkit.api.models import Player, Race
 from dmtoolkit.api.serialize import load_json_string, dump_json_string
+from dmtoolkit.session_store import migrate_cookie
 
 DATA_DIR = Path(__file__).parent / "data"
 
@@ -26,7 +27,13 @@ SAMPLE_PLAYERS = [
 ]
 
 def list_players() -> list[Player]:
-   return load_json_string(request.cookies.get("players", "[]")) or SAMPLE_PLAYERS
+    """Returns the players in the current session, loaded once per request."""
+    if "players" not in g:
+        data = session.get("players")
+        if data is None and (data := migrate_cookie("players")) is not None:
+            session["players"] = data
+        g.players = load_json_string(data or "[]") or list(SAMPLE_PLAYERS)
+    return g.players
 
 def list_player_tags() -> list[str]:
     """Return all tags currently in use."""
@@ -40,14 +47,15 @@ def get_player(player_name: str) -> Player | None:
         if player.name == player_name:
             return player
 
-def create_player(response: Response, params: dict) -> Player:
+def create_player(params: dict) -> Player:
     player = Player(**params)
-    _save_players(response, list_players() + [player])
+    save_players(list_players() + [player])
     return player
 
-def delete_player(response: Response, player_name: str):
+def delete_player(player_name: str):
     players = [p for p in list_players() if p.name != player_name]
-    _save_players(response, players)
+    save_players(players)
 
-def _save_players(response: Response, players: list[Player]) -> None:
-    response.set_cookie("players", dump_json_string(players))
+def save_players(players: list[Player]) -> None:
+    session["players"] = dump_json_string(players)
+    g.players = players
@@ -1,27 +1,23 @@
 from pathlib import Path
 
 from dmtoolkit.api.models import Race
-from dmtoolkit.api.serialize import load_json
+from dmtoolkit.api.registry import LazyRegistry
+from dmtoolkit.api.snapshot import load_data_file
 
 DATADIR = Path(__file__).parent / "data"
 RACE_DATA_PATH = DATADIR / "races.json"
 
-RACES: dict[str, Race] = {}
+def _load_races() -> dict[str, Race]:
+    return {race.name: race for race in load_data_file(RACE_DATA_PATH)}
+
+RACES: LazyRegistry[str, Race] = LazyRegistry("races", _load_races)
+
 
 def list_races() -> list[str]:
-    """Returns a list of all race names. Also lazily loads the Races dictionary."""
-    if not RACES:
-        with RACE_DATA_PATH.open("r") as f:
-            races: list[Race] = load_json(f)
-        for race in races:
-            RACES[race.name] = race
-    
+    """Returns a list of all race names."""
     return list(RACES.keys())
 
 
 def get_race(name: str) -> Race | None:
     """Returns the race with the given name. If no race with the name exists, return None."""
     return RACES.get(name)
-
-# Populate race list
-list_races()
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Lazily loaded compendium data. Each domain (items, spells, ...) is a LazyRegistry, which only loads
+its data the first time it's accessed, instead of when its module is imported. This keeps importing
+the app (and running `dmk` commands, or tests which never touch the data) cheap.
+"""
+from collections.abc import Iterator, Mapping
+from threading import RLock
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+# Every registry that has been created, by name
+REGISTRIES: dict[str, "LazyRegistry"] = {}
+
+
+class LazyRegistry(Mapping[K, V], Generic[K, V]):
+    """A read-only mapping which calls `loader` to build its data on first access. Concurrent first
+    accesses are safe: only one thread runs the loader, and the others wait for it to finish."""
+
+    def __init__(self, name: str, loader: Callable[[], dict[K, V]]):
+        self.name = name
+        self.loader = loader
+        self.load_time: Optional[float] = None
+        self._data: Optional[dict[K, V]] = None
+        # Re-entrant, so a loader that (indirectly) reads its own registry fails loudly instead of hanging
+        self._lock = RLock()
+        REGISTRIES[name] = self
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> dict[K, V]:
+        """The loaded data, loading it first if needed."""
+        if (data := self._data) is not None:
+            return data
+        return self.load()
+
+    def load(self) -> dict[K, V]:
+        """Loads the data, unless another thread already has. Returns the loaded data."""
+        with self._lock:
+            if self._data is not None:
+                return self._data
+            start = time.perf_counter()
+            data = self.loader()
+            self.load_time = time.perf_counter() - start
+            self._data = data
+        log.info(f"Loaded {len(data)} {self.name} in {self.load_time * 1000:.1f}ms")
+        return data
+
+    def reset(self):
+        """Forget the loaded data, so it's loaded again on the next access."""
+        with self._lock:
+            self._data = None
+            self.load_time = None
+
+    def __getitem__(self, key: K) -> V:
+        return self.data[key]
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"<LazyRegistry {self.name} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def load_times() -> dict[str, Optional[float]]:
+    """Returns how long each registry took to load, in seconds. Registries which haven't been
+    loaded yet are 'None'."""
+    return {name: registry.load_time for name, registry in REGISTRIES.items()}
@@ -1,12 +1,20 @@
 from dataclasses import asdict
 import json
+import math
+import re
+import uuid
 
-from flask import Blueprint, request, make_response
+from flask import Blueprint, Response, after_this_request, current_app, request, make_response, session
 
 import dmtoolkit.api.players as players_api
 from dmtoolkit.api.models import Class
-from dmtoolkit.api import races, classes
+from dmtoolkit.api import compendium_db, races, classes, monsters
 from dmtoolkit.api.serialize import dump_json_string
+from dmtoolkit.asgi import run_sync
+from dmtoolkit.context import get_request_state
+from dmtoolkit.diagnostics import memory_report
+from dmtoolkit.encounters import difficulty, generator, library, simulator
+from dmtoolkit import search as search_api
 
 
 api_bp = Blueprint(
@@ -34,12 +42,12 @@ def list_players():
 
 
 @api_bp.route("/races/<rid>", methods=["GET"])
-def get_race(rid: str):
+async def get_race(rid: str):
     race = races.get_race(rid)
     if not race:
         return json.dumps({"null"}), 404
     else:
-        return json.dumps(race)
+        return await run_sync(json.dumps, race)
 
 def _get_class(class_name: str) -> tuple[Class|str, int]:
     try:
@@ -53,17 +61,329 @@ def _get_class(class_name: str) -> tuple[Class|str, int]:
 
 
 @api_bp.route("/classes/<class_name>", methods=["GET"])
-def get_class(class_name: str):
+async def get_class(class_name: str):
     resp, code = _get_class(class_name)
     if code != 200:
         return str(resp), code
-    return dump_json_string(resp), 200
+    return await run_sync(dump_json_string, resp), 200
 
 @api_bp.route("/classes/<class_name>/subclasses", methods=["GET"])
-def list_subclasses(class_name: str):
+async def list_subclasses(class_name: str):
     resp, code = _get_class(class_name)
     if code != 200:
         return str(resp), code
     
     class_ = classes.get_class(class_name)
-    return dump_json_string([c.name for c in class_.subclasses]), 200
\ No newline at end of file
+    return dump_json_string([c.name for c in class_.subclasses]), 200
+
+
+@api_bp.route("/monsters/suggest", methods=["GET"])
+async def suggest_monsters():
+    """Typeahead for the tracker's monster picker."""
+    prefix = request.args.get("prefix", "")
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+    suggestions = monsters.suggest_monsters(prefix, get_request_state().use_new_content, limit)
+    return json.dumps([{"key": key, "name": name} for key, name in suggestions])
+
+
+@api_bp.route("/search", methods=["GET"])
+async def search():
+    """Searches the monsters, spells and items. 'kind' optionally limits the results to a
+    comma-separated list of kinds."""
+    query = request.args.get("q", "")
+    kinds = [kind for kind in request.args.get("kind", "").split(",") if kind]
+    if unknown := set(kinds) - set(search_api.KINDS):
+        return json.dumps({"message": f"Unknown kind(s): {', '.join(sorted(unknown))}"}), 400
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    results = await run_sync(search_api.search, query, kinds, limit)
+    return json.dumps([result._asdict() for result in results])
+
+
+@api_bp.route("/search/text", methods=["GET"])
+async def search_text():
+    """Full-text search over what the spells, items and monsters say, like "frightened". Needs the
+    compendium database (`dmk compendium build`)."""
+    query = request.args.get("q", "")
+    kinds = [kind for kind in request.args.get("kind", "").split(",") if kind]
+    if unknown := set(kinds) - set(search_api.KINDS):
+        return json.dumps({"message": f"Unknown kind(s): {', '.join(sorted(unknown))}"}), 400
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    results = await run_sync(compendium_db.search_text, query, kinds, limit)
+    if results is None:
+        return json.dumps({"message": "Full-text search isn't available on this server"}), 503
+    return json.dumps([result._asdict() for result in results])
+
+
+@api_bp.route("/encounters/evaluate", methods=["POST"])
+def evaluate_encounters():
+    """Scores a batch of encounters against a party. Takes {"party": [levels], "rules": "2014" or
+    "2024", "encounters": [[monster key or {"key": ..., "count": ...}, ...], ...]}."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    rules = str(body.get("rules", "2014"))
+    try:
+        party = [int(level) for level in body.get("party", [])]
+        encounters = difficulty.resolve_encounters(body.get("encounters", []))
+        results = difficulty.evaluate_many(party, encounters, rules)
+        thresholds = difficulty.party_thresholds(party, rules)
+    except KeyError as e:
+        return json.dumps({"message": f"Unknown monster: {e.args[0]}"}), 400
+    except (TypeError, ValueError, AttributeError) as e:
+        return json.dumps({"message": str(e) or "Invalid encounter"}), 400
+    return json.dumps({
+        "rules": rules,
+        "thresholds": thresholds,
+        "encounters": [result._asdict() for result in results],
+    })
+
+
+@api_bp.route("/encounters/generate", methods=["POST"])
+def generate_encounters():
+    """Generates random encounters for a party. Takes {"party": [levels], "difficulty": ..., "rules":
+    ..., "count": ..., "types": [...], "sizes": [...], "environments": [...], "max_monsters": ...,
+    "seed": ...}; everything but the party (of up to 12 characters) is optional."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    rules = str(body.get("rules", "2014"))
+    try:
+        encounters = generator.generate_encounters(
+            [int(level) for level in body.get("party", [])],
+            difficulty=str(body.get("difficulty", "medium" if rules == "2014" else "moderate")),
+            rules=rules,
+            count=min(max(int(body.get("count", 10)), 1), 100),
+            types=[str(t) for t in body.get("types", [])],
+            sizes=[str(s) for s in body.get("sizes", [])],
+            environments=[str(e) for e in body.get("environments", [])],
+            max_monsters=min(max(int(body.get("max_monsters", 8)), 1), 20),
+            prefer_reprinted=get_request_state().use_new_content,
+            seed=body.get("seed"),
+        )
+    except (TypeError, ValueError) as e:
+        return json.dumps({"message": str(e) or "Invalid encounter"}), 400
+    return json.dumps([
+        {
+            "monsters": [
+                {"key": monster.key, "name": monster.name, "cr": monster.cr, "count": count}
+                for monster, count in encounter.monsters
+            ],
+            **encounter.difficulty._asdict(),
+        }
+        for encounter in encounters
+    ])
+
+
+def _finite(value, name: str):
+    """Rejects the NaN and Infinity that Python's JSON parser lets through."""
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return value
+
+
+@api_bp.route("/encounters/simulate", methods=["POST"])
+def simulate_encounter():
+    """Simulates a fight between a party and some monsters. Takes {"party": [level or {"level": ...,
+    "hp": ..., "ac": ..., "to_hit": ..., "damage": ..., "attacks": ...}, ...], "monsters": [monster
+    key or {"key": ..., "count": ...}, ...], "trials": ..., "seed": ..., "time_budget": ...}.
+
+    Streams a JSON summary of the results on each line as the simulation goes, the last of which
+    has "done" set."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    try:
+        if len(body.get("party", [])) > simulator.MAX_PARTY_SIZE:
+            return json.dumps({"message": f"At most {simulator.MAX_PARTY_SIZE} characters can be simulated"}), 400
+        party = [simulator.parse_character(spec) for spec in body.get("party", [])]
+        combatants = []
+        for key, count in difficulty.encounter_entries(body.get("monsters", [])):
+            if len(combatants) + count > simulator.MAX_MONSTERS:
+                return json.dumps({"message": f"At most {simulator.MAX_MONSTERS} monsters can be simulated"}), 400
+            if (monster := monsters.get_monster(key)) is None:
+                return json.dumps({"message": f"Unknown monster: {key}"}), 400
+            combatants.extend([simulator.monster_combatant(monster)] * count)
+        max_time = current_app.config.get("SIMULATION_TIME_BUDGET", 2.0)
+        summaries = simulator.simulate(
+            party,
+            combatants,
+            trials=min(max(int(_finite(body.get("trials", 10_000), "trials")), 1), 100_000),
+            seed=int(_finite(body["seed"], "seed")) if body.get("seed") is not None else None,
+            time_budget=min(max(_finite(float(body.get("time_budget", max_time)), "time_budget"), 0), max_time),
+            workers=current_app.config.get("SIMULATION_WORKERS"),
+        )
+        # Check the arguments now, rather than once the response has started
+        first = next(summaries)
+    except KeyError as e:
+        return json.dumps({"message": f"Missing field: {e.args[0]}"}), 400
+    except (TypeError, ValueError, AttributeError) as e:
+        return json.dumps({"message": str(e) or "Invalid simulation"}), 400
+
+    def stream():
+        yield json.dumps(first._asdict()) + "\n"
+        for summary in summaries:
+            yield json.dumps(summary._asdict()) + "\n"
+    return Response(stream(), mimetype="application/x-ndjson")
+
+
+LIBRARY_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def _set_library_cookie(library_id: str):
+    """Sends the library ID back in its cookie, which renews the cookie."""
+    config = current_app.config
+
+    @after_this_request
+    def set_cookie(response: Response) -> Response:
+        response.set_cookie(
+            config["LIBRARY_COOKIE_NAME"], library_id, max_age=config["LIBRARY_COOKIE_LIFETIME"],
+            secure=config["SESSION_COOKIE_SECURE"], httponly=True, samesite=config["SESSION_COOKIE_SAMESITE"] or "Lax",
+        )
+        return response
+
+
+def library_owner() -> str:
+    """The ID the current user's encounter library is kept under. It's kept in a cookie of its own
+    rather than the session, so the library outlives the session, and can be moved to another
+    browser with its key (see `set_library_key`). Libraries used to be kept under an ID in the session,
+    which is moved to the cookie the first time it's used."""
+    library_id = request.cookies.get(current_app.config["LIBRARY_COOKIE_NAME"], "")
+    if not LIBRARY_ID.fullmatch(library_id):
+        library_id = session.pop("library_id", None) or uuid.uuid4().hex
+    _set_library_cookie(library_id)
+    return library_id
+
+
+def _encounter_library() -> library.EncounterLibrary:
+    return library.get_encounter_library(current_app.config["ENCOUNTER_LIBRARY_PATH"])
+
+
+def _library_page(**filters) -> str:
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 50, type=int)
+    encounters, total = _encounter_library().search(
+        library_owner(), sort=request.args.get("sort", "name"), page=page, per_page=per_page, **filters
+    )
+    return json.dumps({
+        "encounters": [encounter.summary() for encounter in encounters],
+        "total": total,
+        "page": page,
+        "per_page": min(max(per_page, 1), library.MAX_PER_PAGE),
+    })
+
+
+@api_bp.route("/encounters/library", methods=["GET"])
+def list_library_encounters():
+    """Lists a page of the encounter library, without the monsters. Takes ?page=, ?per_page= and
+    ?sort= (name, xp, level or updated, with a '-' in front for the other way around)."""
+    try:
+        return _library_page()
+    except ValueError as e:
+        return json.dumps({"message": str(e)}), 400
+
+
+@api_bp.route("/encounters/library/search", methods=["GET"])
+def search_library_encounters():
+    """Like listing the library, but only encounters which match ?q= (in the name), every ?tag=,
+    ?min_xp=, ?max_xp= and ?level= (the party level)."""
+    try:
+        return _library_page(
+            query=request.args.get("q", "").strip(),
+            tags=request.args.getlist("tag"),
+            min_xp=request.args.get("min_xp", type=int),
+            max_xp=request.args.get("max_xp", type=int),
+            party_level=request.args.get("level", type=int),
+        )
+    except ValueError as e:
+        return json.dumps({"message": str(e)}), 400
+
+
+@api_bp.route("/encounters/library/tags", methods=["GET"])
+def list_library_tags():
+    return json.dumps([{"tag": tag, "count": count} for tag, count in _encounter_library().tags(library_owner())])
+
+
+@api_bp.route("/encounters/library", methods=["POST"])
+def save_library_encounter():
+    """Saves an encounter to the library, replacing any with the same name."""
+    try:
+        encounter = library.SavedEncounter.from_dict(request.get_json(silent=True))
+    except ValueError as e:
+        return json.dumps({"message": str(e)}), 400
+    return json.dumps(_encounter_library().save(library_owner(), encounter).to_dict())
+
+
+@api_bp.route("/encounters/library/<int:encounter_id>", methods=["GET"])
+def get_library_encounter(encounter_id: int):
+    if (encounter := _encounter_library().get(library_owner(), encounter_id)) is None:
+        return json.dumps({"message": f"Unknown encounter: {encounter_id}"}), 404
+    return json.dumps(encounter.to_dict())
+
+
+@api_bp.route("/encounters/library/<int:encounter_id>", methods=["DELETE"])
+def delete_library_encounter(encounter_id: int):
+    if not _encounter_library().delete(library_owner(), encounter_id):
+        return json.dumps({"message": f"Unknown encounter: {encounter_id}"}), 404
+    return json.dumps({})
+
+
+@api_bp.route("/encounters/library/import", methods=["POST"])
+def import_library_encounters():
+    """Imports encounters from an uploaded JSON file ('file'), or the request body. Takes an
+    export, a list of encounters, or the tracker's old localStorage format."""
+    try:
+        if upload := request.files.get("file"):
+            data = json.load(upload.stream)
+        else:
+            data = request.get_json(silent=True)
+        encounters = library.read_encounters(data)
+    except ValueError as e:
+        # JSONDecodeError is a ValueError too
+        return json.dumps({"message": str(e)}), 400
+    return json.dumps({"imported": _encounter_library().import_encounters(library_owner(), encounters)})
+
+
+@api_bp.route("/encounters/library/key", methods=["GET"])
+def get_library_key():
+    """The key to the user's library, which opens it in another browser (or after the cookie's lost)."""
+    return json.dumps({"library_id": library_owner()})
+
+
+@api_bp.route("/encounters/library/key", methods=["POST"])
+def set_library_key():
+    """Switches to the library with the given key (in 'library_id'). Returns how many encounters it has."""
+    body = request.get_json(silent=True)
+    library_id = body.get("library_id") if isinstance(body, dict) else None
+    if not isinstance(library_id, str) or not LIBRARY_ID.fullmatch(library_id := library_id.strip().lower()):
+        return json.dumps({"message": "That isn't a library key"}), 400
+    _set_library_cookie(library_id)
+    _, total = _encounter_library().search(library_id, per_page=1)
+    return json.dumps({"library_id": library_id, "total": total})
+
+
+@api_bp.route("/encounters/library/export", methods=["GET"])
+def export_library_encounters():
+    """Downloads the whole library as a JSON file, which can be imported again."""
+    encounters = _encounter_library().export(library_owner())
+
+    def stream():
+        # One encounter at a time, so big libraries never sit in memory all at once
+        yield '{"encounters": ['
+        for i, encounter in enumerate(encounters):
+            data = encounter.to_dict()
+            del data["id"]
+            yield ("," if i else "") + json.dumps(data)
+        yield "]}"
+    return Response(
+        stream(),
+        mimetype="application/json",
+        headers={"Content-Disposition": "attachment; filename=encounters.json"},
+    )
+
+
+@api_bp.route("/diagnostics/memory", methods=["GET"])
+def get_memory_diagnostics():
+    """Reports the memory used by each gunicorn worker, to check they share the preloaded data."""
+    if not current_app.config.get("ENABLE_DIAGNOSTICS"):
+        return json.dumps({"message": "Diagnostics are disabled."}), 404
+    return json.dumps(memory_report())
\ No newline at end of file
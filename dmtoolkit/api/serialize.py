@@ -2,10 +2,10 @@
 Code for serializing and deserializing the custom classes.
 """
 from collections.abc import Mapping, Sequence
-from dataclasses import fields, is_dataclass
+from dataclasses import MISSING, fields, is_dataclass
 import inspect
 import json
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable
 
 import dmtoolkit.api.models
 from dmtoolkit.util import get_logger
@@ -30,27 +30,40 @@ def _get_models() -> dict[str, type]:
     return _MODELS
 
 
-def _asdict_inner(o: DataclassInstance) -> dict:
-    data = o.__dict__
-   
-    field_types = {field.name: field.type for field in fields(o.__class__)}
-    delfields = []
-    for field, val in data.items():
-        # Check if optional
-        field_type = field_types.get(field)
-        if not isinstance(field_type, str):
-            field_type = repr(field_type)
-        if not field_type:
-            continue
+# Maps each dataclass to its name, and the names of its Optional and Reference fields
+_ENCODER_PLANS: dict[type, tuple[str, frozenset[str], frozenset[str]]] = {}
+
+def _get_encoder_plan(class_: type) -> tuple[str, frozenset[str], frozenset[str]]:
+    """Returns the name of a dataclass, and which of its fields are optional (and left out when
+    empty) or references (and written as "$Class.id"). Only worked out once per class."""
+    if plan := _ENCODER_PLANS.get(class_):
+        return plan
+    optional, references = set(), set()
+    for field in fields(class_):
+        field_type = field.type if isinstance(field.type, str) else repr(field.type)
         if field_type.startswith("Optional["):
-            if val is None or (hasattr(val, "__iter__") and len(val) == 0):
-                delfields.append(field)
+            optional.add(field.name)
         elif field_type.startswith("Reference["):
-            data[field] = f"${type(o).__name__}.{val._id}"
-    for field in delfields:
-        del data[field]
+            references.add(field.name)
+    plan = _ENCODER_PLANS[class_] = (class_.__name__, frozenset(optional), frozenset(references))
+    return plan
+
+
+def _asdict_inner(o: DataclassInstance) -> dict:
+    class_name, optional, references = _get_encoder_plan(type(o))
+    if not optional and not references:
+        return o.__dict__ | {"__dataclass__": class_name}
 
-    return data | { "__dataclass__": type(o).__name__}
+    data = {}
+    for field, val in o.__dict__.items():
+        if field in optional:
+            if val is None or (hasattr(val, "__iter__") and len(val) == 0):
+                continue
+        elif field in references:
+            val = f"${class_name}.{val._id}"
+        data[field] = val
+    data["__dataclass__"] = class_name
+    return data
 
 def _asdict(obj: DataclassInstance):
     """Custom asdict that removed optional fields which are null."""
@@ -99,6 +112,72 @@ class CustomDecoder(json.JSONDecoder):
         return o
 
 
+_slow_object_hook = CustomDecoder().object_hook
+
+# Keys which are dropped from serialized objects instead of being passed to the dataclass
+_IGNORED_KEYS = ("__dataclass__", "race")
+
+_CONSTRUCTORS: dict[str, tuple[frozenset[str], Callable[[dict], Any]]] = {}
+
+def _make_constructor(class_: type) -> Callable[[dict], Any]:
+    """Compiles a function which builds an instance of the dataclass straight from a decoded JSON
+    object. It does the same as the dataclass's __init__, but reads each field from the dict instead
+    of having the dict unpacked into keyword arguments."""
+    namespace: dict[str, Any] = {"cls": class_, "new": object.__new__}
+    lines = ["def construct(o):", "    self = new(cls)"]
+    for i, field in enumerate(fields(class_)):
+        if field.default is not MISSING:
+            namespace[f"default_{i}"] = field.default
+            default = f"default_{i}"
+        elif field.default_factory is not MISSING:
+            namespace[f"factory_{i}"] = field.default_factory
+            default = f"factory_{i}()"
+        else:
+            default = None
+
+        if not field.init:
+            if default is None:
+                continue
+            value = default
+        elif default is None:
+            value = f"o[{field.name!r}]"
+        elif field.default is not MISSING:
+            value = f"o.get({field.name!r}, {default})"
+        else:
+            value = f"o[{field.name!r}] if {field.name!r} in o else {default}"
+        lines.append(f"    self.{field.name} = {value}")
+    if hasattr(class_, "__post_init__"):
+        lines.append("    self.__post_init__()")
+    lines.append("    return self")
+    exec("\n".join(lines), namespace)
+    return namespace["construct"]
+
+
+def _get_constructors() -> dict[str, tuple[frozenset[str], Callable[[dict], Any]]]:
+    """Returns a mapping of model names to the keys their objects may have, and their constructor."""
+    if not _CONSTRUCTORS:
+        for name, class_ in _get_models().items():
+            allowed = frozenset(f.name for f in fields(class_) if f.init) | frozenset(_IGNORED_KEYS)
+            _CONSTRUCTORS[name] = (allowed, _make_constructor(class_))
+    return _CONSTRUCTORS
+
+
+def decode_object(o: dict) -> Any:
+    """Fast equivalent of CustomDecoder.object_hook. Anything the fast path can't handle (unknown
+    keys, missing fields, invalid values) goes through CustomDecoder, so errors are reported the
+    same way."""
+    if (class_name := o.get("__dataclass__")) is None:
+        return o
+    if constructor := (_CONSTRUCTORS or _get_constructors()).get(class_name):
+        allowed, construct = constructor
+        if o.keys() <= allowed:
+            try:
+                return construct(o)
+            except Exception:
+                pass
+    return _slow_object_hook(o)
+
+
 def load_json(fp, *, parse_float=None,
         parse_int=None, parse_constant=None, **kw):
     """Deserialize ``fp`` (a ``.read()``-supporting file-like object containing a JSON document) to
@@ -106,7 +185,7 @@ def load_json(fp, *, parse_float=None,
     """
     return json.load(
         fp,
-        cls=CustomDecoder,
+        object_hook=decode_object,
         parse_float=parse_float,
         parse_int=parse_int,
         parse_constant=parse_constant
@@ -168,7 +247,7 @@ def dump_json(obj, fp, *, skipkeys=False, ensure_ascii=True, check_circular=True
 
 
 def load_json_string(*args, **kwargs):
-    return json.loads(*args, **({"cls": CustomDecoder} | kwargs))
+    return json.loads(*args, **({"object_hook": decode_object} | kwargs))
 
 
 def dump_json_string(*args, **kwargs):
@@ -0,0 +1,155 @@
+"""
+Binary snapshot of the compendium data. Parsing the JSON data files (and building every dataclass
+through CustomDecoder) is the slowest part of starting the app, so the `dmk snapshot build` command
+compiles all of them into a single file of pickled objects, which loads much faster.
+
+The snapshot is only used while it is fresh: every source file must still have the same size and
+modification time it had when the snapshot was built, and the dataclasses in dmtoolkit.api.models
+must still have the same fields. Otherwise the data is loaded from JSON like before.
+"""
+from dataclasses import fields
+import hashlib
+from os import environ
+from pathlib import Path
+import pickle
+from typing import Any, BinaryIO
+
+from dmtoolkit.api.serialize import _get_models, load_json
+from dmtoolkit.constants import ROOT_DIR
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+# Bump this whenever the layout of the snapshot file changes
+SNAPSHOT_FORMAT_VERSION = 1
+
+SNAPSHOT_PATH = ROOT_DIR / "api" / "data" / "compendium.snapshot"
+SOURCE_PATHS = (
+    *sorted((ROOT_DIR / "api" / "data").glob("*.json")),
+    ROOT_DIR / "modules" / "kibbles" / "items.json",
+    ROOT_DIR / "modules" / "kibbles" / "ingredients.json",
+    ROOT_DIR / "modules" / "kibbles" / "variants.json",
+    ROOT_DIR / "modules" / "kibbles" / "recipes.json",
+)
+
+# Set DMTOOLKIT_NO_SNAPSHOT to always load from JSON, even if the snapshot is fresh
+SNAPSHOT_ENABLED = "DMTOOLKIT_NO_SNAPSHOT" not in environ
+
+_HEADER: dict[str, Any] | None = None
+
+
+def get_schema_hash() -> str:
+    """Returns a hash of the field names and types of every model. Pickled objects are only
+    compatible with the class definitions they were created with."""
+    schema = []
+    for name, class_ in sorted(_get_models().items()):
+        schema.append(f"{name}({', '.join(f'{f.name}: {f.type}' for f in fields(class_))})")
+    schema.append(f"version: {SNAPSHOT_FORMAT_VERSION}")
+    return hashlib.sha1("\n".join(schema).encode()).hexdigest()
+
+
+def _source_key(path: Path) -> str:
+    path = path.resolve()
+    if path.is_relative_to(ROOT_DIR.resolve()):
+        return path.relative_to(ROOT_DIR.resolve()).as_posix()
+    return path.as_posix()
+
+
+def _source_stamp(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def build_snapshot(outfile: Path = SNAPSHOT_PATH, source_paths: tuple[Path, ...] = SOURCE_PATHS) -> Path:
+    """Loads every source file from JSON and writes them all to a snapshot file.
+
+    The file holds a pickled header, followed by one pickle per source file. The header maps each
+    source file to its size and modification time when the snapshot was built, and to the offset
+    and length of its pickle, so each source can be loaded on its own.
+    """
+    blobs: dict[str, tuple[tuple[int, int], bytes]] = {}
+    for path in source_paths:
+        if not path.exists():
+            continue
+        with path.open("r") as f:
+            data = load_json(f)
+        blobs[_source_key(path)] = (_source_stamp(path), pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    sources: dict[str, tuple[int, int, int, int]] = {}
+    offset = 0
+    for key, ((size, mtime_ns), blob) in blobs.items():
+        sources[key] = (size, mtime_ns, offset, len(blob))
+        offset += len(blob)
+
+    header = {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "schema": get_schema_hash(),
+        "sources": sources,
+    }
+    tmpfile = outfile.with_suffix(outfile.suffix + ".tmp")
+    with tmpfile.open("wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for _, blob in blobs.values():
+            f.write(blob)
+    tmpfile.replace(outfile) # Atomic, so a running app never sees a half-written snapshot
+    return outfile
+
+
+def _read_header(f: BinaryIO) -> dict[str, Any] | None:
+    header = pickle.load(f)
+    if header.get("version") != SNAPSHOT_FORMAT_VERSION:
+        log.info("Ignoring compendium snapshot built with an old snapshot format")
+        return None
+    if header.get("schema") != get_schema_hash():
+        log.info("Ignoring compendium snapshot built for an old version of the models")
+        return None
+    header["start"] = f.tell()
+    return header
+
+
+def _get_header() -> dict[str, Any] | None:
+    """Lazily reads the snapshot header. Returns 'None' if there is no usable snapshot."""
+    global _HEADER
+    if _HEADER is None:
+        _HEADER = {}
+        if SNAPSHOT_ENABLED and SNAPSHOT_PATH.exists():
+            try:
+                with SNAPSHOT_PATH.open("rb") as f:
+                    _HEADER = _read_header(f) or {}
+            except Exception as e:
+                log.warning(f"Unable to read compendium snapshot {SNAPSHOT_PATH}: {e}")
+    return _HEADER or None
+
+
+def is_fresh(path: Path) -> bool:
+    """Returns True if the snapshot has an up-to-date copy of the given source file."""
+    if not (header := _get_header()):
+        return False
+    if not (source := header["sources"].get(_source_key(path))):
+        return False
+    try:
+        return source[:2] == _source_stamp(path)
+    except FileNotFoundError:
+        return False
+
+
+def load_data_file(path: Path) -> Any:
+    """Returns the deserialized contents of a data file. Uses the snapshot if it is fresh, and falls
+    back to parsing the JSON otherwise."""
+    if is_fresh(path):
+        header = _get_header()
+        _, _, offset, length = header["sources"][_source_key(path)]
+        try:
+            with SNAPSHOT_PATH.open("rb") as f:
+                f.seek(header["start"] + offset)
+                return pickle.loads(f.read(length))
+        except Exception as e:
+            log.warning(f"Unable to load {path.name} from the compendium snapshot: {e}")
+    with path.open("r") as f:
+        return load_json(f)
+
+
+def reset():
+    """Forget the cached snapshot header, so it's re-read on the next load."""
+    global _HEADER
+    _HEADER = None
@@ -1,32 +1,35 @@
 from pathlib import Path
 
 from dmtoolkit.util import normalize_name
+from dmtoolkit.api.compendium_pack import get_compendium_store
 from dmtoolkit.api.models import Spell
-from dmtoolkit.api.serialize import load_json
+from dmtoolkit.api.registry import LazyRegistry
+from dmtoolkit.api.snapshot import load_data_file
 
 DATADIR = Path(__file__).parent / "data"
 SPELL_DATA_PATH = DATADIR / "spells.json"
 
-SPELLS: dict[str, Spell] = {}
-SPELLS_2024: dict[str, Spell] = {}
-
-def _load_spells():
-    global SPELLS
-    with SPELL_DATA_PATH.open("r") as f:
-        spells: list[Spell] = load_json(f)
-        for spell in spells:
-            normalized_name = normalize_name(spell.name)
-            if spell.is_2024:
-                SPELLS_2024[normalized_name] = spell
-            elif spell.has_2024:
-                SPELLS[normalized_name] = spell
-            else:
-                SPELLS[normalized_name] = spell
-                SPELLS_2024[normalized_name] = spell
+def _load_spells() -> dict[bool, dict[str, Spell]]:
+    spells_2014: dict[str, Spell] = {}
+    spells_2024: dict[str, Spell] = {}
+    spells: list[Spell] = load_data_file(SPELL_DATA_PATH)
+    for spell in spells:
+        normalized_name = normalize_name(spell.name)
+        if spell.is_2024:
+            spells_2024[normalized_name] = spell
+        elif spell.has_2024:
+            spells_2014[normalized_name] = spell
+        else:
+            spells_2014[normalized_name] = spell
+            spells_2024[normalized_name] = spell
+    return {False: spells_2014, True: spells_2024}
+
+# Maps whether to use 2024 content to the spells, by normalized name
+SPELLS: LazyRegistry[bool, dict[str, Spell]] = LazyRegistry("spells", _load_spells)
 
 
 def _get_spell_list(use_2024_content: bool = False) -> dict[str, Spell]:
-    return SPELLS_2024 if use_2024_content else SPELLS
+    return SPELLS[bool(use_2024_content)]
 
 
 def list_spells(use_2024_content: bool = False) -> list[Spell]:
@@ -35,8 +38,9 @@ def list_spells(use_2024_content: bool = False) -> list[Spell]:
 
 
 def get_spell(name: str, use_2024_content: bool = False) -> Spell:
-    return _get_spell_list(use_2024_content)[normalize_name(name)]
-
-# Make sure we load the spells dict at least once on load
-if not SPELLS:
-    _load_spells()
\ No newline at end of file
+    norm_name = normalize_name(name)
+    if not SPELLS.loaded and (store := get_compendium_store("spell")):
+        if (spell := store.get("spell_2024" if use_2024_content else "spell", norm_name)) is None:
+            raise KeyError(norm_name)
+        return spell
+    return _get_spell_list(use_2024_content)[norm_name]
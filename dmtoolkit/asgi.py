@@ -0,0 +1,300 @@
+"""
+ASGI serving mode. `asgi.py` in the project root is the entry point for an ASGI server:
+
+    uvicorn asgi:app --workers 4
+
+Each worker is a process of its own, so live tracker sessions need TRACKER_STORE=redis when there's
+more than one (see `dmtoolkit/inittracker/sessions.py`). The app works out how many workers there
+are from uvicorn's command line, or WEB_CONCURRENCY (which uvicorn also defaults `--workers` to).
+
+The server's event loop owns the connections, so idle keep-alive connections and slow clients don't
+hold up anything. Requests for async views (`async def`, like the read-only API and tooltip routes)
+are dispatched right on the event loop, and those views hand their CPU-bound work (rendering,
+serializing) to a small thread pool with `run_sync`. Whatever Flask does around the view (like
+loading and saving the session) runs on that pool too. Everything else goes through Flask as usual,
+on a pool of ASGI_THREADS threads; streamed responses (live tracker updates, simulations) are pulled
+from that pool one chunk at a time, and closed as soon as the client goes away.
+
+Under a WSGI server, async views still work: Flask runs each one in an event loop of its own.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import contextvars
+from functools import partial
+import inspect
+import io
+from os import cpu_count
+import sys
+from threading import Lock
+from typing import Any, Optional, TypeVar
+
+from flask import Flask, Response, current_app, request_started
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+T = TypeVar("T")
+
+_RENDER_POOL: Optional[ThreadPoolExecutor] = None
+_RENDER_POOL_LOCK = Lock()
+
+# Returned by `next` once a response has no chunks left
+_END = object()
+
+
+def _get_render_pool(app: Optional[Flask] = None) -> ThreadPoolExecutor:
+    global _RENDER_POOL
+    if _RENDER_POOL is None:
+        with _RENDER_POOL_LOCK:
+            if _RENDER_POOL is None:
+                threads = (app or current_app).config.get("ASGI_RENDER_THREADS") or min(4, cpu_count() or 1)
+                _RENDER_POOL = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="render")
+    return _RENDER_POOL
+
+
+async def run_sync(func: Callable[..., T], *args, **kwargs) -> T:
+    """Runs a (CPU-bound) function on the render thread pool, keeping the current request and app
+    context, so async views don't block the event loop while it runs."""
+    context = contextvars.copy_context()
+    call = partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_render_pool(), call)
+
+
+def build_environ(scope: dict, body: bytes) -> dict[str, Any]:
+    """Turns an ASGI HTTP scope and request body into a WSGI environ."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode().decode("latin-1"),
+        "PATH_INFO": path.encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if client := scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = client[0], str(client[1])
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1")
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiApp:
+    """Serves a Flask app over ASGI."""
+
+    def __init__(self, app: Flask, threads: Optional[int] = None):
+        self.app = app
+        threads = threads or app.config.get("ASGI_THREADS", 256)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            body = b""
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            environ = build_environ(scope, body)
+            if self._is_async_view(environ):
+                await self._dispatch_async(environ, send)
+            else:
+                await self._dispatch_sync(environ, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _is_async_view(self, environ: dict) -> bool:
+        """True if the request is for an async view. Anything Flask needs to handle itself (unknown
+        URLs, redirects, automatic OPTIONS responses) goes the usual way."""
+        if environ["REQUEST_METHOD"] == "OPTIONS":
+            return False
+        try:
+            rule, _ = self.app.url_map.bind_to_environ(environ).match(return_rule=True)
+        except (HTTPException, RequestRedirect):
+            return False
+        return inspect.iscoroutinefunction(self.app.view_functions.get(rule.endpoint))
+
+    async def _dispatch_async(self, environ: dict, send: Callable):
+        """Flask's request handling (see `Flask.wsgi_app` and `Flask.full_dispatch_request`),
+        with the view awaited on the event loop. Everything around the view can block (pushing the
+        context opens the session, finalizing the response saves it), so it runs on the render
+        thread pool, in a context of the request's own which the view then runs in too."""
+        app = self.app
+        ctx = app.request_context(environ)
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        pool = _get_render_pool(app)
+
+        def run(func: Callable[..., T], *args) -> asyncio.Future[T]:
+            return loop.run_in_executor(pool, partial(context.run, func, *args))
+
+        def preprocess() -> Any:
+            request_started.send(app, _async_wrapper=app.ensure_sync)
+            rv = app.preprocess_request()
+            if rv is None and ctx.request.routing_exception is not None:
+                app.raise_routing_exception(ctx.request)
+            return rv
+
+        error: Optional[BaseException] = None
+        try:
+            await run(ctx.push)
+            try:
+                rv = await run(preprocess)
+                if rv is None:
+                    view = app.view_functions[ctx.request.url_rule.endpoint]
+                    rv = await asyncio.create_task(view(**ctx.request.view_args), context=context)
+            except Exception as e:
+                rv = await run(app.handle_user_exception, e)
+            response = await run(app.finalize_request, rv)
+        except Exception as e:
+            error = e
+            response = await run(app.handle_exception, e)
+        finally:
+            await run(ctx.pop, error)
+        await self._send_response(response, environ, send)
+
+    @staticmethod
+    async def _send_response(response: Response, environ: dict, send: Callable):
+        status: list[Any] = []
+
+        def start_response(status_line: str, headers: list[tuple[str, str]], exc_info=None):
+            status[:] = [int(status_line.split(" ", 1)[0]), headers]
+
+        chunks = response(environ, start_response)
+        try:
+            body = b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        await send({"type": "http.response.start", "status": status[0], "headers": _encode_headers(status[1])})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _dispatch_sync(self, environ: dict, receive: Callable, send: Callable):
+        """Runs the request through Flask on the thread pool, and sends the response back. Streamed
+        responses are sent one chunk at a time."""
+        loop = asyncio.get_running_loop()
+        status: list[Any] = []
+
+        def start_response(status_line: str, headers: list[tuple[str, str]], exc_info=None):
+            status[:] = [int(status_line.split(" ", 1)[0]), headers]
+
+        def start() -> tuple[Iterable[bytes], Optional[bytes]]:
+            chunks = self.app(environ, start_response)
+            # Responses which aren't streamed have a length, and are sent in one go
+            if any(name.lower() == "content-length" for name, _ in status[1]):
+                try:
+                    return chunks, b"".join(chunks)
+                finally:
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+            return chunks, None
+
+        chunks, body = await loop.run_in_executor(self.pool, start)
+        await send({"type": "http.response.start", "status": status[0], "headers": _encode_headers(status[1])})
+        if body is not None:
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        iterator = iter(chunks)
+        pending: Optional[Future] = None
+        try:
+            while True:
+                pending = self.pool.submit(next, iterator, _END)
+                await asyncio.wait((asyncio.wrap_future(pending), disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if not pending.done() or (chunk := pending.result()) is _END:
+                    break
+                pending = None
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not disconnected.done():
+                await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            log.debug(f"Client disconnected from {environ['PATH_INFO']}")
+        finally:
+            disconnected.cancel()
+            # A generator can't be closed while it's running, so if the client went away while we
+            # were waiting for a chunk, it's closed once that chunk turns up
+            self.pool.submit(_close, chunks, pending)
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Callable):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+
+def _close(chunks: Iterable[bytes], pending: Optional[Future]):
+    if pending is not None:
+        wait((pending,))
+    if hasattr(chunks, "close"):
+        chunks.close()
+
+
+def _encode_headers(headers: list[tuple[str, str]]) -> list[tuple[bytes, bytes]]:
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+def uvicorn_workers(argv: Optional[list[str]] = None) -> Optional[int]:
+    """The `--workers` uvicorn was started with, if it's what is serving the app and was given one.
+    uvicorn's worker processes keep the command line of the process which started them."""
+    argv = sys.argv if argv is None else argv
+    if not argv or "uvicorn" not in argv[0]:
+        return None
+    try:
+        import click
+        from uvicorn.main import main
+    except ImportError:
+        return None
+    try:
+        return main.make_context("uvicorn", argv[1:], resilient_parsing=True).params.get("workers")
+    except click.ClickException:
+        return None
+
+
+def init_asgi_app(preload: Optional[bool] = None) -> AsgiApp:
+    """Creates the app (see `dmtoolkit.init_app`), wrapped for an ASGI server."""
+    from dmtoolkit import init_app
+
+    app = init_app(preload)
+    if (workers := uvicorn_workers()) is not None:
+        # Live tracker sessions refuse to run on more than one worker unless they're kept in redis
+        app.config["WEB_CONCURRENCY"] = workers
+    return AsgiApp(app)
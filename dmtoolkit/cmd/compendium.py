@@ -0,0 +1,171 @@
+"""Builds the compendium database and pack (see dmtoolkit.api.compendium_db and
+dmtoolkit.api.compendium_pack), searches the database, and measures how much memory the app saves
+by using them instead of the in-memory registries."""
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+import json
+from os import environ
+from pathlib import Path
+import subprocess
+import sys
+import time
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen
+
+import click
+
+from dmtoolkit.api.compendium_db import DB_PATH, build_compendium_db
+from dmtoolkit.api.compendium_pack import PACK_PATH, CompendiumPack, build_compendium_pack
+from dmtoolkit.cmd.server import _free_port, _wait_for_server
+from dmtoolkit.constants import ROOT_DIR
+
+# Where the getters look things up in each mode. Turning off the pack and the database leaves the registries.
+MODES = {
+    "registry": {"DMTOOLKIT_NO_COMPENDIUM_PACK": "1", "DMTOOLKIT_NO_COMPENDIUM_DB": "1"},
+    "database": {"DMTOOLKIT_NO_COMPENDIUM_PACK": "1"},
+    "pack": {"DMTOOLKIT_NO_COMPENDIUM_DB": "1"},
+}
+
+# Looks up a sample of every namespace, like a worker serving tooltips would, then reports the
+#   process's memory (in kB) and how long each lookup took on average
+_BENCH_CODE = """
+import json, os, sqlite3, sys, time
+import flask, flask_wtf, flask_session, dominate.tags
+from dmtoolkit.diagnostics import get_memory_usage
+from dmtoolkit.api.items import get_item
+from dmtoolkit.api.monsters import get_monster
+from dmtoolkit.api.spells import get_spell
+
+db = sqlite3.connect(sys.argv[1])
+keys = db.execute("SELECT namespace, key FROM keys WHERE abs(random()) % 10 = 0 LIMIT ?", (int(sys.argv[2]),)).fetchall()
+db.close()
+getters = {
+    "item": get_item,
+    "spell": get_spell,
+    "spell_2024": lambda key: get_spell(key, True),
+    "monster": get_monster,
+}
+before = get_memory_usage(os.getpid())["uss"]
+start = time.perf_counter()
+for _ in range(3):
+    for namespace, key in keys:
+        getters[namespace](key)
+elapsed = time.perf_counter() - start
+print(json.dumps({"before": before, "after": get_memory_usage(os.getpid())["uss"], "lookup": elapsed / (3 * len(keys))}))
+"""
+
+
+def build(outfile: Path = DB_PATH):
+    start = time.perf_counter()
+    counts = build_compendium_db(outfile)
+    elapsed = time.perf_counter() - start
+    size = outfile.stat().st_size / 1024 / 1024
+    summary = ", ".join(f"{count} {kind}s" for kind, count in counts.items())
+    click.echo(f"Wrote {summary} to {outfile} ({size:.1f} MB) in {elapsed:.2f}s")
+
+
+def search(query: str, limit: int = 10):
+    from dmtoolkit.api.compendium_db import search_text
+
+    results = search_text(query, limit=limit)
+    if results is None:
+        raise click.ClickException(f"There's no up-to-date compendium database at {DB_PATH}")
+    for result in results:
+        click.echo(f"{result.kind:>7}  {result.name} ({result.source})")
+        snippet = result.snippet.replace("<mark>", "\x02").replace("</mark>", "\x03")
+        click.echo("         " + unescape(snippet).replace("\x02", "\033[1m").replace("\x03", "\033[0m"))
+
+
+def pack(outfile: Path = PACK_PATH):
+    start = time.perf_counter()
+    counts = build_compendium_pack(outfile)
+    elapsed = time.perf_counter() - start
+    size = outfile.stat().st_size / 1024 / 1024
+    summary = ", ".join(f"{count} {kind}s" for kind, count in counts.items())
+    click.echo(f"Wrote {summary} to {outfile} ({size:.1f} MB) in {elapsed:.2f}s")
+
+
+def _env(mode: str) -> dict[str, str]:
+    env = {name: value for name, value in environ.items() if not name.startswith("DMTOOLKIT_NO_COMPENDIUM_")}
+    return env | MODES[mode]
+
+
+def _measure(mode: str, lookups: int) -> dict[str, float]:
+    result = subprocess.run([sys.executable, "-c", _BENCH_CODE, str(DB_PATH), str(lookups)],
+                            env=_env(mode), capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _build_missing():
+    if not DB_PATH.exists():
+        build()
+    if not PACK_PATH.exists():
+        pack()
+
+
+def bench(lookups: int = 500):
+    _build_missing()
+    for mode in MODES:
+        usage = _measure(mode, lookups)
+        click.echo(
+            f"{mode:>8}: {(usage['after'] - usage['before']) / 1024:.1f} MB for the data, "
+            + f"{usage['after'] / 1024:.1f} MB in total, {usage['lookup'] * 1e6:.0f} µs per lookup"
+        )
+
+
+def _tooltip_paths(requests: int) -> list[str]:
+    """Tooltips for a spread of the spells and items, like a table's worth of trackers would ask for."""
+    compendium = CompendiumPack(PACK_PATH)
+    paths = [f"/tooltips/spells/{quote(key)}" for key in compendium.keys("spell")]
+    paths += [f"/tooltips/items/{quote(key)}" for key in compendium.keys("item")]
+    step = max(len(paths) // requests, 1)
+    return paths[::step][:requests]
+
+
+def _fetch(url: str) -> bool:
+    try:
+        urlopen(url).read()
+    except HTTPError:
+        return False
+    return True
+
+
+def _measure_workers(mode: str, workers: int, paths: list[str]) -> dict[str, int]:
+    """Serves the app with gunicorn (preloading, like in production), requests the tooltips, and
+    returns the memory (in kB) of the master and every worker, added up."""
+    port = _free_port()
+    env = _env(mode) | {"ENABLE_DIAGNOSTICS": "1"}
+    args = ["-m", "gunicorn", "--config", "gunicorn.conf.py", "--workers", str(workers), "--threads", "4",
+            "--bind", f"127.0.0.1:{port}"]
+    process = subprocess.Popen([sys.executable, *args], env=env, cwd=ROOT_DIR.parent,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_server(port)
+        base = f"http://127.0.0.1:{port}"
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            errors = sum(pool.map(lambda path: not _fetch(base + path), paths))
+        # Every worker has served requests by now; any of them can report on the rest
+        report = json.loads(urlopen(f"{base}/api/diagnostics/memory").read())
+    finally:
+        process.terminate()
+        process.wait()
+    totals = {field: report["master"].get(field, 0) for field in ("rss", "pss", "uss")}
+    for worker in report["workers"]:
+        for field in totals:
+            totals[field] += worker[field]
+    totals["workers"] = len(report["workers"])
+    totals["errors"] = errors
+    return totals
+
+
+def bench_workers(workers: int = 8, requests: int = 2000):
+    _build_missing()
+    paths = _tooltip_paths(requests)
+    for mode in MODES:
+        totals = _measure_workers(mode, workers, paths)
+        click.echo(
+            f"{mode:>8}: RSS {totals['rss'] / 1024:6.1f} MB, PSS {totals['pss'] / 1024:6.1f} MB, "
+            + f"USS {totals['uss'] / 1024:6.1f} MB (master + {totals['workers']} workers, {len(paths)} tooltips, "
+            + f"{totals['errors']} errors)"
+        )
@@ -0,0 +1,35 @@
+"""Measures how long it takes to decode the compendium data files with the fast decoder
+(serialize.decode_object), compared to the original CustomDecoder."""
+import gc
+import json
+from pathlib import Path
+from statistics import median
+import time
+
+import click
+
+from dmtoolkit.api.serialize import CustomDecoder, _get_constructors, decode_object
+from dmtoolkit.constants import ROOT_DIR
+
+DEFAULT_BENCH_FILES = (
+    ROOT_DIR / "api" / "data" / "items.json",
+    ROOT_DIR / "api" / "data" / "spells.json",
+)
+
+
+def _decode_time(text: str, **kwargs) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    json.loads(text, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench(paths: tuple[Path, ...] = DEFAULT_BENCH_FILES, runs: int = 10):
+    _get_constructors() # Compile the constructors up front, so the first run isn't penalized
+    for path in paths:
+        text = path.read_text()
+        if json.loads(text, cls=CustomDecoder) != json.loads(text, object_hook=decode_object):
+            raise click.ClickException(f"The decoders disagree on {path.name}")
+        for label, kwargs in (("CustomDecoder", {"cls": CustomDecoder}), ("Fast", {"object_hook": decode_object})):
+            times = [_decode_time(text, **kwargs) for _ in range(runs)]
+            click.echo(f"{path.name:>12} {label:>13}: median {median(times)*1000:.0f} ms, min {min(times)*1000:.0f} ms over {runs} runs")
@@ -128,6 +128,7 @@ def convert_monster(spec: dict[str, Any]) -> Monster | None:
         reactions = [Entry.from_spec(reaction) for reaction in spec.get("reaction", [])],
         legendary_actions = [Entry.from_spec(legendary) for legendary in spec.get("legendary", [])],
         spellcasting = [SpellCasting.from_spec(s) for s in spec.get("spellcasting", [])],
+        environment = spec.get("environment", []),
         is_2024 = spec["source"] in NEW_2024_SOURCES,
         has_2024 = False, # We will set this later in the `convert` function
         reprinted_as = ["-".join(src.split("|")) for src in spec.get("reprintedAs", [])],
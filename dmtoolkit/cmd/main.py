@@ -9,6 +9,10 @@ import dmtoolkit.cmd.spells as cmd_sp
 import dmtoolkit.cmd.races as cmd_r
 import dmtoolkit.cmd.kcg_gathering as cmd_kcg_g
 import dmtoolkit.cmd.kcg_crafting as cmd_kcg_c
+import dmtoolkit.cmd.snapshot as cmd_snap
+import dmtoolkit.cmd.compendium as cmd_comp
+import dmtoolkit.cmd.decoder as cmd_dec
+import dmtoolkit.cmd.server as cmd_srv
 
 @click.group
 def main():
@@ -104,4 +108,71 @@ def kcg_gathering_convert():
 
 @kibbles.command("craft")
 def kcg_crafting_convert():
-    cmd_kcg_c.convert()
\ No newline at end of file
+    cmd_kcg_c.convert()
+
+@main.group()
+def snapshot():
+    pass
+
+@snapshot.command("build")
+@click.option("--outfile", "-o", default=cmd_snap.SNAPSHOT_PATH, type=click.Path(writable=True, path_type=Path))
+def build_snapshot(outfile: Path):
+    cmd_snap.build(outfile)
+
+@snapshot.command("bench")
+@click.option("--runs", "-n", default=5, type=int)
+def bench_snapshot(runs: int):
+    cmd_snap.bench(runs)
+
+@main.group()
+def compendium():
+    pass
+
+@compendium.command("build")
+@click.option("--outfile", "-o", default=cmd_comp.DB_PATH, type=click.Path(writable=True, path_type=Path))
+def build_compendium(outfile: Path):
+    cmd_comp.build(outfile)
+
+@compendium.command("pack")
+@click.option("--outfile", "-o", default=cmd_comp.PACK_PATH, type=click.Path(writable=True, path_type=Path))
+def pack_compendium(outfile: Path):
+    cmd_comp.pack(outfile)
+
+@compendium.command("search")
+@click.argument("query")
+@click.option("--limit", "-n", default=10, type=int)
+def search_compendium(query: str, limit: int):
+    cmd_comp.search(query, limit)
+
+@compendium.command("bench")
+@click.option("--lookups", "-n", default=500, type=int)
+def bench_compendium(lookups: int):
+    cmd_comp.bench(lookups)
+
+@compendium.command("bench-workers")
+@click.option("--workers", "-w", default=8, type=int)
+@click.option("--requests", "-n", default=2000, type=int)
+def bench_compendium_workers(workers: int, requests: int):
+    cmd_comp.bench_workers(workers, requests)
+
+@main.group()
+def decoder():
+    pass
+
+@decoder.command("bench")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, path_type=Path))
+@click.option("--runs", "-n", default=10, type=int)
+def bench_decoder(paths: tuple[Path, ...], runs: int):
+    cmd_dec.bench(paths or cmd_dec.DEFAULT_BENCH_FILES, runs)
+
+@main.group()
+def server():
+    pass
+
+@server.command("bench")
+@click.option("--clients", "-c", default=200, type=int)
+@click.option("--duration", "-d", default=10.0, type=float)
+@click.option("--workers", "-w", default=1, type=int)
+@click.option("--threads", "-t", default=64, type=int, help="Threads per gunicorn worker")
+def bench_server(clients: int, duration: float, workers: int, threads: int):
+    cmd_srv.bench(clients, duration, workers, threads)
@@ -0,0 +1,102 @@
+"""Measures how many requests a second the app serves under WSGI (gunicorn) and ASGI (uvicorn) when
+lots of clients are connected at once, as happens when a whole table has the tracker open."""
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+
+import click
+
+# Read-only requests the tracker makes constantly: tooltips, searches and monster suggestions
+BENCH_PATHS = (
+    "/tooltips/spells/Fireball",
+    "/tooltips/items/Bag%20of%20Holding",
+    "/tooltips/conditions/prone",
+    "/api/search?q=fire",
+    "/api/monsters/suggest?prefix=gob",
+)
+
+SERVERS = {
+    "gunicorn": ["-m", "gunicorn", "--workers", "{workers}", "--threads", "{threads}", "--bind", "127.0.0.1:{port}",
+                 "wsgi:app"],
+    "uvicorn": ["-m", "uvicorn", "--workers", "{workers}", "--port", "{port}", "--log-level", "warning",
+                "--no-access-log", "asgi:app"],
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_server(port: int, timeout: float = 120):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise click.ClickException(f"Server didn't start listening on port {port}")
+
+
+async def _client(port: int, deadline: float, latencies: list[float]) -> int:
+    """One keep-alive client, sending requests one after another until the deadline. Returns how
+    many failed."""
+    errors = 0
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            path = BENCH_PATHS[i % len(BENCH_PATHS)]
+            i += 1
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) != b"\r\n":
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            errors += status >= 400
+    except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+        errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def _load(port: int, clients: int, duration: float) -> tuple[list[float], int]:
+    latencies: list[float] = []
+    deadline = time.perf_counter() + duration
+    errors = await asyncio.gather(*(_client(port, deadline, latencies) for _ in range(clients)))
+    return latencies, sum(errors)
+
+
+def _run(server: str, clients: int, duration: float, workers: int, threads: int):
+    port = _free_port()
+    args = [arg.format(workers=workers, threads=threads, port=port) for arg in SERVERS[server]]
+    process = subprocess.Popen([sys.executable, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_server(port)
+        # Warm the caches, so both servers are measured on the same footing
+        asyncio.run(_load(port, 4, 1.0))
+        latencies, errors = asyncio.run(_load(port, clients, duration))
+    finally:
+        process.terminate()
+        process.wait()
+    latencies.sort()
+    p50, p99 = (latencies[int(len(latencies) * q)] * 1000 if latencies else 0 for q in (0.5, 0.99))
+    click.echo(
+        f"{server:>8}: {len(latencies) / duration:7.0f} req/s, p50 {p50:.0f} ms, p99 {p99:.0f} ms, "
+        f"{errors} errors ({clients} clients, {workers} workers)"
+    )
+
+
+def bench(clients: int = 200, duration: float = 10.0, workers: int = 1, threads: int = 64):
+    for server in SERVERS:
+        _run(server, clients, duration, workers, threads)
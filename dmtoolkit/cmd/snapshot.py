@@ -0,0 +1,56 @@
+"""Builds the compendium snapshot (see dmtoolkit.api.snapshot), and measures how much it speeds up
+loading the compendium data."""
+from os import environ
+from pathlib import Path
+from statistics import median
+import subprocess
+import sys
+import time
+
+import click
+
+from dmtoolkit.api.snapshot import SNAPSHOT_PATH, SOURCE_PATHS, build_snapshot
+
+# Importing these modules creates the registries for all of the compendium data
+BENCH_IMPORTS = (
+    "dmtoolkit.api.items",
+    "dmtoolkit.api.spells",
+    "dmtoolkit.api.classes",
+    "dmtoolkit.api.races",
+    "dmtoolkit.api.conditions",
+)
+
+
+def build(outfile: Path = SNAPSHOT_PATH):
+    start = time.perf_counter()
+    build_snapshot(outfile)
+    elapsed = time.perf_counter() - start
+    sources = [p for p in SOURCE_PATHS if p.exists()]
+    size = outfile.stat().st_size / 1024 / 1024
+    click.echo(f"Wrote {len(sources)} sources to {outfile} ({size:.1f} MB) in {elapsed:.2f}s")
+
+
+def _cold_import_time(use_snapshot: bool) -> float:
+    """Loads the compendium in a fresh interpreter and returns how long it took, in seconds."""
+    env = environ.copy()
+    env.pop("DMTOOLKIT_NO_SNAPSHOT", None)
+    if not use_snapshot:
+        env["DMTOOLKIT_NO_SNAPSHOT"] = "1"
+    # Third-party packages are imported before the timer starts, so we only measure our own data
+    code = (
+        "import time, flask, flask_wtf, flask_session, dominate.tags; start = time.perf_counter(); "
+        + "; ".join(f"import {module}" for module in BENCH_IMPORTS)
+        + "; from dmtoolkit.api.registry import REGISTRIES"
+        + "; [registry.load() for name, registry in REGISTRIES.items() if name != 'monsters']"
+        + "; print(time.perf_counter() - start)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def bench(runs: int = 5):
+    if not SNAPSHOT_PATH.exists():
+        build()
+    for label, use_snapshot in (("JSON", False), ("Snapshot", True)):
+        times = [_cold_import_time(use_snapshot) for _ in range(runs)]
+        click.echo(f"{label:>8}: median {median(times)*1000:.0f} ms, min {min(times)*1000:.0f} ms over {runs} runs")
@@ -0,0 +1,63 @@
+"""
+The current user's setup (settings, active modules and what they add to the app), worked out at
+most once per request, and only the parts of it the request actually uses. Views get it with
+`get_request_state()`, templates as `state`:
+
+    {% for title, route in state.main_routes.items() %}
+"""
+from __future__ import annotations
+
+from functools import cached_property
+from types import MappingProxyType
+from typing import Any
+
+from flask import Flask, g
+from werkzeug.local import LocalProxy
+
+from dmtoolkit.modules import flatten_modules, get_modules
+from dmtoolkit.modules.models import Module
+from dmtoolkit.settings.api import get_settings
+
+
+class RequestState:
+    @cached_property
+    def settings(self) -> dict[str, Any]:
+        return get_settings()
+
+    @cached_property
+    def use_new_content(self) -> bool:
+        return bool(self.settings.get("use_new_content"))
+
+    @cached_property
+    def active_modules(self) -> list[str]:
+        return [key[7:] for key, val in self.settings.items() if key.startswith("module_") and val]
+
+    @cached_property
+    def module(self) -> Module:
+        """All of the active modules, flattened into one (see `flatten_modules`)."""
+        return flatten_modules(self.active_modules)
+
+    @cached_property
+    def main_routes(self) -> MappingProxyType[str, str]:
+        """Title -> endpoint for the pages the active modules add to the nav bar."""
+        modules = get_modules()
+        main_routes = {}
+        for module_name in self.active_modules:
+            if module := modules.get(module_name):
+                main_routes |= module.main_routes
+        return MappingProxyType(main_routes)
+
+
+def get_request_state() -> RequestState:
+    if "request_state" not in g:
+        g.request_state = RequestState()
+    return g.request_state
+
+
+def reset_request_state():
+    """Drops everything worked out so far, after the settings change."""
+    g.pop("request_state", None)
+
+
+def init_request_state(app: Flask):
+    app.jinja_env.globals["state"] = LocalProxy(get_request_state)
@@ -0,0 +1,67 @@
+"""Memory usage diagnostics, used to check that gunicorn workers share the preloaded compendium
+data with the master process. Only works on Linux, since it reads from /proc."""
+import gc
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+PROC_DIR = Path("/proc")
+
+
+def get_memory_usage(pid: int) -> Optional[dict[str, int]]:
+    """Returns the memory usage of a process, in kB. 'uss' (unique set size) is the memory only
+    this process uses, which is what it would free if it exited; 'pss' splits the shared memory
+    evenly across every process sharing it. Returns 'None' if the process can't be inspected."""
+    try:
+        lines = (PROC_DIR / str(pid) / "smaps_rollup").read_text().splitlines()
+    except OSError:
+        return None
+    fields: dict[str, int] = {}
+    for line in lines[1:]: # The first line is the address range
+        name, _, value = line.partition(":")
+        parts = value.split()
+        if parts and parts[0].isdigit():
+            fields[name] = int(parts[0])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def _parent_pid(pid: int) -> Optional[int]:
+    try:
+        stat = (PROC_DIR / str(pid) / "stat").read_text()
+    except OSError:
+        return None
+    # The process name (2nd field) is in brackets and may contain spaces, so split after it
+    return int(stat.rsplit(")", 1)[1].split()[1])
+
+
+def list_sibling_pids() -> list[int]:
+    """Returns the PIDs of every process with the same parent as this one. Under gunicorn, these
+    are all the workers of the same master."""
+    ppid = os.getppid()
+    pids = []
+    for entry in PROC_DIR.iterdir():
+        if entry.name.isdigit() and _parent_pid(int(entry.name)) == ppid:
+            pids.append(int(entry.name))
+    return sorted(pids)
+
+
+def memory_report() -> dict[str, Any]:
+    """Returns the memory usage of the master process and each of its workers."""
+    from dmtoolkit.preload import is_preloaded
+
+    workers = []
+    for pid in list_sibling_pids():
+        if usage := get_memory_usage(pid):
+            workers.append({"pid": pid, **usage})
+    return {
+        "pid": os.getpid(),
+        "preloaded": is_preloaded(),
+        "gc_frozen_objects": gc.get_freeze_count(),
+        "master": {"pid": os.getppid(), **(get_memory_usage(os.getppid()) or {})},
+        "workers": workers,
+    }
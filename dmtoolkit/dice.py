@@ -0,0 +1,242 @@
+"""
+Dice expressions, like "2d6 + 3" or "4d6kh3".
+
+Expressions are parsed once into a compiled DiceExpression (and cached by their text), which can
+then be rolled any number of times without parsing them again. Compiled expressions can also give
+their exact distribution, mean, minimum and maximum.
+
+Supported: sums and differences of flat numbers and dice terms, where a dice term is "NdS" (or "dS"
+for a single die), optionally followed by "khK"/"kK" (keep the highest K), "klK" (keep the lowest
+K), "dhK" (drop the highest K) or "dlK" (drop the lowest K). Any term can be multiplied by a whole
+number, like "2d6*10".
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import Counter
+from fractions import Fraction
+from itertools import accumulate, combinations_with_replacement
+import math
+from math import factorial, prod
+import random
+import re
+from typing import NamedTuple, Optional
+
+from dmtoolkit.util import LRUCache
+
+# Working out the distribution of a keep/drop term means going through every sorted set of rolls;
+#   terms with more than this many of them can't be asked for their exact distribution
+MAX_ROLL_SETS = 1_000_000
+
+# Batches of rolls are drawn from the exact distribution, as long as it has at most this many values
+MAX_SAMPLED_VALUES = 4096
+
+_TERM = re.compile(r"\s*([+-])?\s*(?:(\d*)d(\d+)(?:(kh|kl|dh|dl|k)(\d+))?|(\d+))\s*(?:\*\s*(\d+)\s*)?", re.IGNORECASE)
+
+
+class DiceTerm(NamedTuple):
+    """'count' dice with 'sides' sides each, of which only 'keep' are added up: the highest ones if
+    'highest' is set, otherwise the lowest. The kept dice's total is multiplied by 'multiplier',
+    which is negative for terms which are subtracted."""
+    count: int
+    sides: int
+    keep: int
+    highest: bool = True
+    multiplier: int = 1
+
+    @property
+    def is_plain(self) -> bool:
+        """True if every die is kept."""
+        return self.keep == self.count
+
+    def roll(self, rand=random.random) -> int:
+        sides = self.sides
+        if self.is_plain:
+            total = self.count
+            for _ in range(self.count):
+                total += int(rand() * sides)
+        else:
+            rolls = sorted((int(rand() * sides) + 1 for _ in range(self.count)), reverse=self.highest)
+            total = sum(rolls[:self.keep])
+        return total * self.multiplier
+
+    def distribution(self) -> Counter[int]:
+        """Returns how many of the 'sides ** count' possible rolls add up to each total. Raises a
+        ValueError for keep/drop terms with too many possible rolls to count."""
+        if self.is_plain:
+            # ways[i] is how many rolls of the dice so far add up to the fewest possible plus i.
+            #   Each new die adds the last 'sides' entries up, which is a difference of prefix sums.
+            counts = [1]
+            for _ in range(self.count):
+                prefix = [0, *accumulate(counts)]
+                length = len(counts) + self.sides - 1
+                counts = [prefix[min(i + 1, len(counts))] - prefix[max(i + 1 - self.sides, 0)] for i in range(length)]
+            ways = Counter({self.count + i: n for i, n in enumerate(counts)})
+        else:
+            # Every sorted set of rolls, along with how many orders it could have been rolled in
+            if math.comb(self.sides + self.count - 1, self.count) > MAX_ROLL_SETS:
+                raise ValueError(f"Too many possible rolls to count for {self.count}d{self.sides}")
+            ways = Counter()
+            count_factorial = factorial(self.count)
+            for rolls in combinations_with_replacement(range(1, self.sides + 1), self.count):
+                orders = count_factorial // prod(factorial(n) for n in Counter(rolls).values())
+                kept = rolls[-self.keep:] if self.highest else rolls[:self.keep]
+                ways[sum(kept) if self.keep else 0] += orders
+        if self.multiplier != 1:
+            scaled = Counter()
+            for total, n in ways.items():
+                scaled[total * self.multiplier] += n
+            ways = scaled
+        return ways
+
+
+class DiceExpression(NamedTuple):
+    text: str
+    terms: tuple[DiceTerm, ...]
+    modifier: int
+
+    def roll(self, rng: Optional[random.Random] = None) -> int:
+        """Rolls the expression once."""
+        rand = (rng or random).random
+        total = self.modifier
+        for term in self.terms:
+            total += term.roll(rand)
+        return total
+
+    def roll_many(self, n: int, rng: Optional[random.Random] = None) -> list[int]:
+        """Rolls the expression 'n' times. Unless it has a lot of possible totals, this draws all 'n'
+        totals straight from the exact distribution in one go, instead of rolling every die."""
+        rng = rng or random
+        if not self.terms:
+            return [self.modifier] * n
+        if (sampler := self._sampler()) is not None:
+            values, cumulative = sampler
+            return rng.choices(values, cum_weights=cumulative, k=n)
+        return [self.roll(rng) for _ in range(n)]
+
+    def _sampler(self) -> Optional[tuple[list[int], list[int]]]:
+        if (sampler := _SAMPLERS.get(self.text)) is None:
+            sampler = False
+            if self.max - self.min < MAX_SAMPLED_VALUES:
+                try:
+                    ways = self.ways()
+                except ValueError:
+                    ways = None
+                if ways is not None:
+                    values = sorted(ways)
+                    sampler = (values, list(accumulate(ways[value] for value in values)))
+            _SAMPLERS[self.text] = sampler
+        return sampler or None
+
+    @property
+    def outcomes(self) -> int:
+        """How many different ways the dice can land."""
+        return prod(term.sides ** term.count for term in self.terms)
+
+    @property
+    def min(self) -> int:
+        return self.modifier + sum(
+            term.keep * (1 if term.multiplier > 0 else term.sides) * term.multiplier for term in self.terms
+        )
+
+    @property
+    def max(self) -> int:
+        return self.modifier + sum(
+            term.keep * (term.sides if term.multiplier > 0 else 1) * term.multiplier for term in self.terms
+        )
+
+    @property
+    def mean(self) -> Fraction:
+        """The exact average total. Raises a ValueError for keep/drop terms with too many possible
+        rolls to count."""
+        total = Fraction(self.modifier)
+        for term in self.terms:
+            if term.is_plain:
+                total += Fraction(term.count * (term.sides + 1), 2) * term.multiplier
+            else:
+                ways = term.distribution()
+                total += Fraction(sum(value * n for value, n in ways.items()), term.sides ** term.count)
+        return total
+
+    def ways(self) -> Counter[int]:
+        """Returns how many of the possible rolls add up to each total. Raises a ValueError if
+        there are too many possible rolls to count."""
+        ways: Counter[int] = Counter({self.modifier: 1})
+        for term in self.terms:
+            term_ways = term.distribution()
+            next_ways: Counter[int] = Counter()
+            for total, n in ways.items():
+                for value, m in term_ways.items():
+                    next_ways[total + value] += n * m
+            ways = next_ways
+        return ways
+
+    def distribution(self) -> dict[int, Fraction]:
+        """Returns the exact chance of rolling each possible total."""
+        ways = self.ways()
+        outcomes = self.outcomes
+        return {total: Fraction(ways[total], outcomes) for total in sorted(ways)}
+
+    def chance_at_least(self, target: int) -> Fraction:
+        """Returns the exact chance of rolling 'target' or higher."""
+        return sum((chance for total, chance in self.distribution().items() if total >= target), Fraction(0))
+
+    def percentile(self, p: float) -> int:
+        """Returns the lowest total which at least 'p' percent of rolls are at or below."""
+        ways = self.ways()
+        values = sorted(ways)
+        cumulative = list(accumulate(ways[value] for value in values))
+        rank = max(math.ceil(Fraction(p) / 100 * cumulative[-1]), 1)
+        return values[min(bisect_left(cumulative, rank), len(values) - 1)]
+
+    def __str__(self) -> str:
+        return self.text
+
+
+_COMPILED = LRUCache(maxsize=4096)
+_SAMPLERS = LRUCache(maxsize=1024)
+
+
+def _parse(text: str) -> DiceExpression:
+    terms: list[DiceTerm] = []
+    modifier = 0
+    position = 0
+    stripped = text.strip()
+    if not stripped:
+        raise ValueError("Empty dice expression")
+    while position < len(stripped):
+        match = _TERM.match(stripped, position)
+        if not match or match.end() == position or (position and not match.group(1)):
+            raise ValueError(f"Invalid dice expression: '{text}'")
+        sign, count, sides, keep_mode, keep, number, times = match.groups()
+        multiplier = (-1 if sign == "-" else 1) * int(times or 1)
+        if number is not None:
+            modifier += multiplier * int(number)
+        else:
+            count, sides = int(count or 1), int(sides)
+            if count < 1 or sides < 1:
+                raise ValueError(f"Invalid dice in '{text}': {match.group().strip()}")
+            keep_mode = (keep_mode or "").lower()
+            keep = int(keep) if keep is not None else count
+            if keep_mode in ("dh", "dl"):
+                keep, keep_mode = count - keep, "kl" if keep_mode == "dh" else "kh"
+            if not 0 <= keep <= count:
+                raise ValueError(f"Can't keep {keep} of {count} dice in '{text}'")
+            terms.append(DiceTerm(count, sides, keep, keep_mode != "kl", multiplier))
+        position = match.end()
+    return DiceExpression(stripped, tuple(terms), modifier)
+
+
+def compile(expression: str) -> DiceExpression:
+    """Parses a dice expression, or returns the cached result of parsing it before. Raises a
+    ValueError for invalid expressions."""
+    if (compiled := _COMPILED.get(expression)) is None:
+        compiled = _COMPILED[expression] = _parse(expression)
+    return compiled
+
+
+def roll(expression: str | int, rng: Optional[random.Random] = None) -> int:
+    """Rolls a dice expression once. Integers are returned as they are."""
+    if isinstance(expression, int):
+        return expression
+    return compile(expression).roll(rng)
@@ -0,0 +1,160 @@
+"""
+Encounter XP and difficulty, for both the 2014 and 2024 rules.
+
+2014 (DMG p. 82): the monsters' XP is multiplied based on how many monsters there are (and how big
+the party is), and the adjusted XP is compared against the party's easy/medium/hard/deadly
+thresholds.
+
+2024 (DMG p. 114): the monsters' XP is compared, as is, against the party's low/moderate/high
+budgets.
+
+Everything is table lookups, so scoring an encounter only costs a few operations per monster, and
+`evaluate_many` can score thousands of candidate encounters for the same party in one go.
+"""
+from bisect import bisect_right
+from collections.abc import Iterable, Iterator, Sequence
+from typing import NamedTuple
+
+from dmtoolkit.api.models import Monster
+
+RULES = ("2014", "2024")
+
+XP_BY_CR = {
+    "0": 10, "1/8": 25, "1/4": 50, "1/2": 100,
+    "1": 200, "2": 450, "3": 700, "4": 1100, "5": 1800,
+    "6": 2300, "7": 2900, "8": 3900, "9": 5000, "10": 5900,
+    "11": 7200, "12": 8400, "13": 10000, "14": 11500, "15": 13000,
+    "16": 15000, "17": 18000, "18": 20000, "19": 22000, "20": 25000,
+    "21": 33000, "22": 41000, "23": 50000, "24": 62000, "25": 75000,
+    "26": 90000, "27": 105000, "28": 120000, "29": 135000, "30": 155000,
+}
+
+# Per character level (index 0 is level 1)
+DIFFICULTIES_2014 = ("easy", "medium", "hard", "deadly")
+THRESHOLDS_2014 = (
+    (25, 50, 75, 100), (50, 100, 150, 200), (75, 150, 225, 400), (125, 250, 375, 500),
+    (250, 500, 750, 1100), (300, 600, 900, 1400), (350, 750, 1100, 1700), (450, 900, 1400, 2100),
+    (550, 1100, 1600, 2400), (600, 1200, 1900, 2800), (800, 1600, 2400, 3600), (1000, 2000, 3000, 4500),
+    (1100, 2200, 3400, 5100), (1250, 2500, 3800, 5700), (1400, 2800, 4300, 6400), (1600, 3200, 4800, 7200),
+    (2000, 3900, 5900, 8800), (2100, 4200, 6300, 9500), (2400, 4900, 7300, 10900), (2800, 5700, 8500, 12700),
+)
+DIFFICULTIES_2024 = ("low", "moderate", "high")
+BUDGETS_2024 = (
+    (50, 75, 100), (100, 150, 200), (150, 225, 400), (250, 375, 500),
+    (500, 750, 1100), (600, 1000, 1400), (750, 1300, 1700), (1000, 1700, 2100),
+    (1300, 2000, 2600), (1600, 2300, 3100), (1900, 2900, 4100), (2200, 3700, 4700),
+    (2600, 4200, 5400), (2900, 4900, 6200), (3300, 5400, 7800), (3800, 6100, 9800),
+    (4500, 7200, 11700), (5000, 8700, 14200), (5500, 10700, 17200), (6400, 13200, 22000),
+)
+
+# 2014 encounter multipliers. The number of monsters picks a step, which moves up one for parties
+#   of fewer than 3 characters and down one for parties of 6 or more.
+_MULTIPLIER_STEPS = (0.5, 1, 1.5, 2, 2.5, 3, 4, 5)
+_MULTIPLIER_STEP_BY_COUNT = (1, 1, 2) + (3,) * 4 + (4,) * 4 + (5,) * 4 + (6,) # Index is the number of monsters, up to 15
+_MAX_COUNT = len(_MULTIPLIER_STEP_BY_COUNT) - 1
+
+
+class EncounterDifficulty(NamedTuple):
+    xp: int
+    adjusted_xp: int
+    multiplier: float
+    difficulty: str
+
+
+def monster_xp(monster: Monster) -> int:
+    """Returns the XP a monster is worth. Falls back to its CR, for monsters without XP."""
+    return monster.xp or XP_BY_CR.get(monster.cr, 0)
+
+
+def _check_levels(party_levels: Sequence[int]):
+    if not party_levels:
+        raise ValueError("The party needs at least one character")
+    for level in party_levels:
+        if not 1 <= level <= 20:
+            raise ValueError(f"Invalid character level: {level}")
+
+
+def party_thresholds(party_levels: Sequence[int], rules: str = "2014") -> dict[str, int]:
+    """Returns the party's XP threshold (2014) or budget (2024) for each difficulty."""
+    _check_levels(party_levels)
+    if rules == "2014":
+        table, names = THRESHOLDS_2014, DIFFICULTIES_2014
+    elif rules == "2024":
+        table, names = BUDGETS_2024, DIFFICULTIES_2024
+    else:
+        raise ValueError(f"Unknown rules: '{rules}'")
+    return {name: sum(table[level - 1][i] for level in party_levels) for i, name in enumerate(names)}
+
+
+def encounter_multiplier(num_monsters: int, party_size: int) -> float:
+    """Returns the 2014 encounter multiplier for a number of monsters fighting a party."""
+    if num_monsters <= 0:
+        return 0
+    step = _MULTIPLIER_STEP_BY_COUNT[min(num_monsters, _MAX_COUNT)]
+    if party_size < 3:
+        step += 1
+    elif party_size >= 6:
+        step -= 1
+    return _MULTIPLIER_STEPS[step]
+
+
+def evaluate_many(
+        party_levels: Sequence[int],
+        encounters: Iterable[Iterable[tuple[int, int]]],
+        rules: str = "2014") -> list[EncounterDifficulty]:
+    """Scores many encounters against the same party. Each encounter is a list of (XP, count)
+    pairs, one for each kind of monster in it."""
+    thresholds = party_thresholds(party_levels, rules)
+    names = ("trivial", *thresholds)
+    cutoffs = list(thresholds.values())
+    party_size = len(party_levels)
+    if rules == "2014":
+        multipliers = [encounter_multiplier(count, party_size) for count in range(_MAX_COUNT + 1)]
+    else:
+        multipliers = [1] * (_MAX_COUNT + 1)
+
+    results = []
+    for encounter in encounters:
+        xp = count = 0
+        for monster_xp_, monster_count in encounter:
+            xp += monster_xp_ * monster_count
+            count += monster_count
+        multiplier = multipliers[min(count, _MAX_COUNT)] if count else 0
+        adjusted_xp = int(xp * multiplier)
+        results.append(EncounterDifficulty(xp, adjusted_xp, multiplier, names[bisect_right(cutoffs, adjusted_xp)]))
+    return results
+
+
+def encounter_entries(encounter: Iterable[str | dict]) -> Iterator[tuple[str, int]]:
+    """Yields the (monster key, count) pairs of an encounter given as a list of monster keys, or of
+    {"key": ..., "count": ...} entries."""
+    for entry in encounter:
+        key, count = (entry, 1) if isinstance(entry, str) else (entry["key"], int(entry.get("count", 1)))
+        if count < 0:
+            raise ValueError(f"Invalid monster count: {count}")
+        yield key, count
+
+
+def resolve_encounters(encounters: Iterable[Iterable[str | dict]]) -> list[list[tuple[int, int]]]:
+    """Turns encounters given as lists of monster keys, or of {"key": ..., "count": ...} entries,
+    into the (XP, count) pairs `evaluate_many` takes. Raises a KeyError for unknown monsters."""
+    from dmtoolkit.api.monsters import get_monsters
+
+    monsters = get_monsters()
+    xp_by_key: dict[str, int] = {}
+    resolved = []
+    for encounter in encounters:
+        pairs = []
+        for key, count in encounter_entries(encounter):
+            if (xp := xp_by_key.get(key)) is None:
+                if (monster := monsters.get(key)) is None:
+                    raise KeyError(key)
+                xp = xp_by_key[key] = monster_xp(monster)
+            pairs.append((xp, count))
+        resolved.append(pairs)
+    return resolved
+
+
+def evaluate(party_levels: Sequence[int], monsters: Iterable[tuple[Monster, int]], rules: str = "2014") -> EncounterDifficulty:
+    """Scores a single encounter, given as (monster, count) pairs."""
+    return evaluate_many(party_levels, [[(monster_xp(monster), count) for monster, count in monsters]], rules)[0]
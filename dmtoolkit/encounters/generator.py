@@ -0,0 +1,239 @@
+"""
+Random encounter generation. Picks groups of monsters whose (adjusted) XP lands in a difficulty's
+range for the party, optionally only monsters of some types, sizes or environments.
+
+Rather than rolling random monsters until something fits, the matching monsters are split into
+buckets by the XP they're worth (which is to say, by CR), and a bounded knapsack over those buckets
+counts every way of filling the XP budget: how many groups, how many monsters, and how much XP each
+bucket adds. An encounter is then sampled by walking that table back from a random valid total, so
+every mix of CRs which fits is (about) equally likely.
+
+The table counts XP in units of a fraction of the budget (see XP_RESOLUTION) rather than single
+points, so it stays the same size however big the party's budget is. A total in units can be a
+little off the real one, so samples whose real XP misses the budget are thrown away.
+"""
+from __future__ import annotations
+
+from bisect import bisect_right
+from collections import defaultdict
+from collections.abc import Sequence
+from itertools import accumulate
+import math
+import random
+from typing import NamedTuple, Optional
+
+from dmtoolkit.api.models import Monster
+from dmtoolkit.api.monsters import MonsterQuery, get_monster_index
+from dmtoolkit.encounters.difficulty import (
+    EncounterDifficulty, encounter_multiplier, evaluate, monster_xp, party_thresholds
+)
+from dmtoolkit.util import LRUCache
+
+# Generated encounters for the hardest difficulty (deadly or high) stay under this many times its threshold
+TOP_DIFFICULTY_MARGIN = 1.5
+
+# How many units of XP the biggest budget is split into. Monsters worth less than half a unit are
+#   left out, as they'd hardly count towards the budget anyway.
+XP_RESOLUTION = 128
+
+# Most characters in a party encounters are generated for
+MAX_PARTY_SIZE = 12
+
+# How many times more samples than requested encounters to draw, while looking for unique ones
+_MAX_ATTEMPTS_FACTOR = 4
+
+# The monsters matching each set of filters, bucketed by XP, and the knapsack tables for each budget
+_BUCKETS = LRUCache(maxsize=256)
+_PLANS = LRUCache(maxsize=64)
+
+
+class GeneratedEncounter(NamedTuple):
+    monsters: list[tuple[Monster, int]]
+    difficulty: EncounterDifficulty
+
+
+def _get_buckets(types: frozenset[str], sizes: frozenset[str], environments: frozenset[str],
+                 prefer_reprinted: Optional[bool]) -> dict[int, list[Monster]]:
+    """Returns the monsters matching the filters, by how much XP they're worth."""
+    index = get_monster_index()
+    # Keyed on the index too, so rebuilding it (with different monsters) doesn't return stale buckets
+    key = (index, types, sizes, environments, prefer_reprinted)
+    if (buckets := _BUCKETS.get(key)) is None:
+        query = MonsterQuery()
+        if types:
+            query.type(*types)
+        if sizes:
+            query.size(*sizes)
+        if environments:
+            query.environment(*environments)
+        if prefer_reprinted is not None:
+            query.prefer_reprinted(prefer_reprinted)
+        grouped = defaultdict(list)
+        for monster in query:
+            if (xp := monster_xp(monster)) > 0:
+                grouped[xp].append(monster)
+        buckets = _BUCKETS[key] = dict(sorted(grouped.items()))
+    return buckets
+
+
+class _Plan:
+    """The knapsack table for one set of buckets and one XP range, in units of `unit` XP.
+
+    `layers[i][groups][monsters]` maps each XP total to how many ways there are of reaching it (with
+    that many groups and monsters) using the first `i` buckets, where a bucket adds either nothing,
+    or one group of 1 or more monsters.
+    """
+
+    def __init__(self, values: tuple[int, ...], windows: tuple[tuple[int, int], ...],
+                 max_monsters: int, max_groups: int, unit: int = 1):
+        windows = tuple((round(low / unit), round(high / unit)) for low, high in windows)
+        values = tuple(round(xp / unit) for xp in values)
+        self.values = values
+        # Adjusted XP depends on the number of monsters, so each number has its own raw XP range.
+        #   Totals only ever grow as monsters are added, so a total with some number of monsters is
+        #   only worth keeping while it's under the highest limit for that many monsters or more.
+        caps = [high - 1 if high > low else -1 for low, high in windows]
+        for monsters in range(max_monsters - 1, -1, -1):
+            caps[monsters] = max(caps[monsters], caps[monsters + 1])
+
+        layer = [[{} for _ in range(max_monsters + 1)] for _ in range(max_groups + 1)]
+        layer[0][0][0] = 1
+        self.layers = [layer]
+        for xp in values:
+            if not 0 < xp <= caps[1]:
+                # Worth nothing, or too much for any encounter
+                self.layers.append(layer)
+                continue
+            next_layer = [[dict(totals) for totals in row] for row in layer]
+            for groups in range(max_groups):
+                for monsters in range(max_monsters):
+                    if not (totals := layer[groups][monsters]):
+                        continue
+                    for count in range(1, max_monsters - monsters + 1):
+                        added, cap = xp * count, caps[monsters + count]
+                        if added > cap:
+                            break
+                        targets = next_layer[groups + 1][monsters + count]
+                        for total, ways in totals.items():
+                            if (new_total := total + added) <= cap:
+                                targets[new_total] = targets.get(new_total, 0) + ways
+            self.layers.append(next_layer)
+            layer = next_layer
+
+        self.finals = [
+            ((groups, monsters, total), ways)
+            for groups, row in enumerate(layer)
+            for monsters, totals in enumerate(row) if monsters
+            for total, ways in totals.items()
+            if windows[monsters][0] <= total < windows[monsters][1]
+        ]
+        self.cumulative = list(accumulate(ways for _, ways in self.finals))
+
+    def sample(self, rng: random.Random) -> list[tuple[int, int]]:
+        """Returns a random (bucket index, count) list which fits the XP range (in units)."""
+        if not self.finals:
+            return []
+        groups, monsters, total = self.finals[bisect_right(self.cumulative, rng.randrange(self.cumulative[-1]))][0]
+        picked = []
+        for i in range(len(self.values), 0, -1):
+            previous, xp = self.layers[i - 1], self.values[i - 1]
+            # Every way of reaching this state either skipped this bucket, or added a group from it
+            options = [(0, previous[groups][monsters].get(total, 0))]
+            if groups and xp:
+                for count in range(1, monsters + 1):
+                    if (remaining := total - xp * count) < 0:
+                        break
+                    if ways := previous[groups - 1][monsters - count].get(remaining, 0):
+                        options.append((count, ways))
+            roll = rng.randrange(sum(ways for _, ways in options))
+            for count, ways in options:
+                if roll < ways:
+                    break
+                roll -= ways
+            if count:
+                picked.append((i - 1, count))
+                groups, monsters, total = groups - 1, monsters - count, total - xp * count
+        return picked
+
+
+def _xp_windows(party_levels: Sequence[int], difficulty: str, rules: str, max_monsters: int) -> tuple[tuple[int, int], ...]:
+    """Returns the range of raw XP (low inclusive, high exclusive) an encounter with each number of
+    monsters must have to be of the given difficulty."""
+    thresholds = party_thresholds(party_levels, rules)
+    names = list(thresholds)
+    if difficulty not in thresholds:
+        raise ValueError(f"Unknown difficulty for the {rules} rules: '{difficulty}'")
+    i = names.index(difficulty)
+    low = thresholds[difficulty]
+    high = thresholds[names[i + 1]] if i + 1 < len(names) else math.ceil(low * TOP_DIFFICULTY_MARGIN)
+
+    windows = [(0, 0)]
+    for num_monsters in range(1, max_monsters + 1):
+        multiplier = encounter_multiplier(num_monsters, len(party_levels)) if rules == "2014" else 1
+        # The smallest raw XP whose adjusted XP (rounded down, like evaluate) reaches each bound
+        windows.append((math.ceil(low / multiplier), math.ceil(high / multiplier)))
+    return tuple(windows)
+
+
+def _xp_unit(windows: tuple[tuple[int, int], ...]) -> int:
+    """How much XP each unit of the knapsack table is worth, for these XP ranges."""
+    return max(max(high for _, high in windows) // XP_RESOLUTION, 1)
+
+
+def generate_encounters(
+        party_levels: Sequence[int],
+        difficulty: str = "medium",
+        rules: str = "2014",
+        count: int = 10,
+        types: Sequence[str] = (),
+        sizes: Sequence[str] = (),
+        environments: Sequence[str] = (),
+        max_monsters: int = 8,
+        max_groups: int = 3,
+        prefer_reprinted: Optional[bool] = None,
+        seed: Optional[int] = None) -> list[GeneratedEncounter]:
+    """Returns up to `count` different random encounters of the given difficulty for the party.
+
+    Each encounter has at most `max_monsters` monsters, in at most `max_groups` groups of the same
+    monster (each with a different CR). `types`, `sizes` and `environments` limit the monsters to
+    those with any of the given values. The same `seed` always generates the same encounters, as long
+    as the monsters don't change. Returns fewer encounters (or none) if not enough of them fit.
+    Raises a ValueError for parties of more than MAX_PARTY_SIZE characters.
+    """
+    if max_monsters < 1 or max_groups < 1:
+        raise ValueError("Encounters need room for at least one monster")
+    if len(party_levels) > MAX_PARTY_SIZE:
+        raise ValueError(f"Encounters can only be generated for parties of up to {MAX_PARTY_SIZE} characters")
+    windows = _xp_windows(party_levels, difficulty, rules, max_monsters)
+    unit = _xp_unit(windows)
+    buckets = _get_buckets(
+        frozenset(t.lower() for t in types),
+        frozenset(s.lower() for s in sizes),
+        frozenset(e.lower() for e in environments),
+        prefer_reprinted,
+    )
+    values = tuple(buckets)
+    plan_key = (values, windows, max_monsters, max_groups)
+    if (plan := _PLANS.get(plan_key)) is None:
+        plan = _PLANS[plan_key] = _Plan(values, windows, max_monsters, max_groups, unit)
+
+    rng = random.Random(seed)
+    encounters: dict[tuple[tuple[str, int], ...], list[tuple[Monster, int]]] = {}
+    for _ in range(count * _MAX_ATTEMPTS_FACTOR):
+        if len(encounters) >= count or not plan.finals:
+            break
+        picked = plan.sample(rng)
+        low, high = windows[sum(n for _, n in picked)]
+        if not low <= sum(values[i] * n for i, n in picked) < high:
+            continue # Only fit the XP range in units
+        monsters = [(rng.choice(buckets[values[i]]), n) for i, n in picked]
+        monsters.sort(key=lambda pair: (-monster_xp(pair[0]), pair[0].name))
+        encounters.setdefault(tuple((monster.key, n) for monster, n in monsters), monsters)
+
+    return [GeneratedEncounter(monsters, evaluate(party_levels, monsters, rules)) for monsters in encounters.values()]
+
+
+def clear_caches():
+    """Forget the cached buckets and knapsack tables."""
+    _BUCKETS.clear()
+    _PLANS.clear()
@@ -0,0 +1,339 @@
+"""
+The encounter library: the encounters each user has saved from the tracker, kept in SQLite
+(ENCOUNTER_LIBRARY_PATH) rather than the browser's localStorage, so they survive clearing the
+browser and can be moved around as JSON files.
+
+Each user's encounters are kept under an owner ID (see `library_owner` in dmtoolkit/api/routes.py).
+Encounters are indexed by name, total XP, party level and last update, and their tags are kept in a
+table of their own, so listing and searching a library of thousands of encounters only reads the
+page that's asked for.
+
+Encounters use the tracker's format, so the tracker can load them as they are:
+
+    {"name": ..., "description": ..., "tags": [...], "party_level": ...,
+     "monsters": [{"id": monster key, "mobsize": ..., "hasXp": ..., "hasLoot": ...}, ...]}
+
+Imports also take the format the tracker kept in localStorage, {title: {"title": ..., "desc": ...,
+"monsters": [...]}, ...}.
+"""
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+import json
+from pathlib import Path
+import sqlite3
+from threading import Lock, local
+import time
+from typing import Any, Optional
+
+from dmtoolkit.api.monsters import get_monster
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+# Most encounters one import can hold
+MAX_IMPORT = 10_000
+
+MAX_PER_PAGE = 200
+
+# Most monsters and tags one encounter can have
+MAX_MONSTERS = 500
+MAX_TAGS = 32
+
+SORTS = {
+    "name": "name, id",
+    "xp": "total_xp, id",
+    "-xp": "total_xp DESC, id DESC",
+    "level": "party_level, id",
+    "-level": "party_level DESC, id DESC",
+    "updated": "updated, id",
+    "-updated": "updated DESC, id DESC",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS encounters (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    description TEXT NOT NULL DEFAULT '',
+    party_level INTEGER,
+    total_xp INTEGER NOT NULL DEFAULT 0,
+    monster_count INTEGER NOT NULL DEFAULT 0,
+    monsters TEXT NOT NULL DEFAULT '[]',
+    tags TEXT NOT NULL DEFAULT '[]',
+    updated REAL NOT NULL,
+    UNIQUE (owner, name)
+);
+CREATE INDEX IF NOT EXISTS encounters_by_xp ON encounters (owner, total_xp);
+CREATE INDEX IF NOT EXISTS encounters_by_level ON encounters (owner, party_level);
+CREATE INDEX IF NOT EXISTS encounters_by_updated ON encounters (owner, updated);
+CREATE TABLE IF NOT EXISTS encounter_tags (
+    owner TEXT NOT NULL,
+    tag TEXT NOT NULL COLLATE NOCASE,
+    encounter_id INTEGER NOT NULL REFERENCES encounters (id) ON DELETE CASCADE,
+    PRIMARY KEY (owner, tag, encounter_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS encounter_tags_by_encounter ON encounter_tags (encounter_id);
+"""
+
+# Columns for summaries, which leave out the monsters
+_SUMMARY_COLUMNS = "id, name, description, party_level, total_xp, monster_count, tags, updated"
+
+
+@dataclass
+class SavedEncounter:
+    name: str
+    description: str = ""
+    monsters: list[dict[str, Any]] = field(default_factory=list)
+    tags: list[str] = field(default_factory=list)
+    party_level: Optional[int] = None
+    id: Optional[int] = None
+    total_xp: int = 0
+    monster_count: int = 0
+    updated: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], legacy: bool = False) -> SavedEncounter:
+        """Reads (and checks) an encounter, in the library's format or (if 'legacy') the tracker's
+        old one. Raises a ValueError if it isn't valid."""
+        if not isinstance(data, dict):
+            raise ValueError("Encounters must be objects")
+        name = str(data.get("name") or data.get("title") or "").strip()
+        if not name:
+            raise ValueError("Encounters need a name")
+        monsters = data.get("monsters") or []
+        if not isinstance(monsters, list) or len(monsters) > MAX_MONSTERS:
+            raise ValueError(f"Encounters can have at most {MAX_MONSTERS} monsters")
+        tags = data.get("tags") or []
+        if not isinstance(tags, list) or len(tags) > MAX_TAGS:
+            raise ValueError(f"Encounters can have at most {MAX_TAGS} tags")
+        party_level = data.get("party_level")
+        if party_level is not None and not (isinstance(party_level, int) and 1 <= party_level <= 20):
+            raise ValueError("Party level must be between 1 and 20")
+
+        entries = []
+        for monster in monsters:
+            if isinstance(monster, str):
+                monster = {"id": monster}
+            if not isinstance(monster, dict) or not isinstance(monster.get("id"), str):
+                raise ValueError("Monsters must have an id")
+            mobsize = monster.get("mobsize", 1)
+            if legacy and mobsize is None:
+                # The tracker saved a mob size it couldn't parse (NaN) as null, and counted it as 1
+                mobsize = 1
+                monster = {**monster, "mobsize": mobsize}
+            if not isinstance(mobsize, int) or mobsize < 1:
+                raise ValueError("Mob size must be a positive integer")
+            entries.append({key: monster[key] for key in ("id", "mobsize", "hasXp", "hasLoot") if key in monster})
+
+        encounter = cls(
+            name=name,
+            description=str(data.get("description") or data.get("desc") or ""),
+            monsters=entries,
+            tags=sorted({str(tag).strip() for tag in tags if str(tag).strip()}),
+            party_level=party_level,
+        )
+        encounter.total_xp, encounter.monster_count = _total_xp(entries)
+        return encounter
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    def summary(self) -> dict[str, Any]:
+        """Everything but the monsters, for listing encounters."""
+        data = asdict(self)
+        del data["monsters"]
+        return data
+
+
+def _total_xp(monsters: list[dict[str, Any]]) -> tuple[int, int]:
+    """Returns the total XP (of monsters which give XP) and the number of monsters in an encounter."""
+    xp = count = 0
+    for entry in monsters:
+        mobsize = entry.get("mobsize", 1)
+        count += mobsize
+        if entry.get("hasXp", True) and (monster := get_monster(entry["id"])):
+            xp += monster.xp * mobsize
+    return xp, count
+
+
+def read_encounters(data: Any) -> list[SavedEncounter]:
+    """Reads the encounters in an import: a list of encounters, {"encounters": [...]} (as exported),
+    or the tracker's old localStorage format. Raises a ValueError if any aren't valid."""
+    legacy = isinstance(data, dict) and not isinstance(data.get("encounters"), list)
+    if isinstance(data, dict):
+        data = list(data.values()) if legacy else data["encounters"]
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of encounters")
+    if len(data) > MAX_IMPORT:
+        raise ValueError(f"Can import at most {MAX_IMPORT} encounters at once")
+    return [SavedEncounter.from_dict(encounter, legacy) for encounter in data]
+
+
+class EncounterLibrary:
+    """Saved encounters in an SQLite database. Each thread gets a connection of its own."""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._local = local()
+        self._init_lock = Lock()
+        self._initialized = False
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if (db := getattr(self._local, "db", None)) is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA foreign_keys = ON")
+            db.execute("PRAGMA synchronous = NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    db.execute("PRAGMA journal_mode = WAL")
+                    db.executescript(_SCHEMA)
+                    self._initialized = True
+        return db
+
+    def save(self, owner: str, encounter: SavedEncounter) -> SavedEncounter:
+        """Saves an encounter, replacing the owner's encounter of the same name if they have one."""
+        with _transaction(self.db) as db:
+            self._save(db, owner, encounter)
+        return encounter
+
+    def import_encounters(self, owner: str, encounters: Iterable[SavedEncounter]) -> int:
+        """Saves a batch of encounters in one transaction. Returns how many were saved."""
+        count = 0
+        with _transaction(self.db) as db:
+            for encounter in encounters:
+                self._save(db, owner, encounter)
+                count += 1
+        log.info(f"Imported {count} encounters")
+        return count
+
+    @staticmethod
+    def _save(db: sqlite3.Connection, owner: str, encounter: SavedEncounter):
+        encounter.updated = time.time()
+        encounter.id = db.execute(
+            "INSERT INTO encounters (owner, name, description, party_level, total_xp, monster_count, monsters, tags, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (owner, name) DO UPDATE SET name = excluded.name, description = excluded.description,"
+            " party_level = excluded.party_level, total_xp = excluded.total_xp, monster_count = excluded.monster_count,"
+            " monsters = excluded.monsters, tags = excluded.tags, updated = excluded.updated"
+            " RETURNING id",
+            (owner, encounter.name, encounter.description, encounter.party_level, encounter.total_xp,
+             encounter.monster_count, json.dumps(encounter.monsters), json.dumps(encounter.tags), encounter.updated),
+        ).fetchone()[0]
+        db.execute("DELETE FROM encounter_tags WHERE encounter_id = ?", (encounter.id,))
+        db.executemany(
+            "INSERT INTO encounter_tags (owner, tag, encounter_id) VALUES (?, ?, ?)",
+            [(owner, tag, encounter.id) for tag in encounter.tags],
+        )
+
+    def get(self, owner: str, encounter_id: int) -> Optional[SavedEncounter]:
+        row = self.db.execute("SELECT * FROM encounters WHERE owner = ? AND id = ?", (owner, encounter_id)).fetchone()
+        return _from_row(row) if row else None
+
+    def delete(self, owner: str, encounter_id: int) -> bool:
+        """Deletes an encounter. Returns False if the owner has no such encounter."""
+        with _transaction(self.db) as db:
+            return db.execute("DELETE FROM encounters WHERE owner = ? AND id = ?", (owner, encounter_id)).rowcount > 0
+
+    def search(self, owner: str, query: str = "", tags: Iterable[str] = (), min_xp: Optional[int] = None,
+               max_xp: Optional[int] = None, party_level: Optional[int] = None, sort: str = "name",
+               page: int = 1, per_page: int = 50) -> tuple[list[SavedEncounter], int]:
+        """Returns a page of the owner's encounters (without their monsters) which match all of the
+        filters, and how many match in total. 'query' matches anywhere in the name."""
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        per_page = min(max(per_page, 1), MAX_PER_PAGE)
+        page = max(page, 1)
+        where, params = ["owner = ?"], [owner]
+        if query:
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append("%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        for tag in dict.fromkeys(tags):
+            where.append("id IN (SELECT encounter_id FROM encounter_tags WHERE owner = ? AND tag = ?)")
+            params += [owner, tag]
+        if min_xp is not None:
+            where.append("total_xp >= ?")
+            params.append(min_xp)
+        if max_xp is not None:
+            where.append("total_xp <= ?")
+            params.append(max_xp)
+        if party_level is not None:
+            where.append("party_level = ?")
+            params.append(party_level)
+        conditions = " AND ".join(where)
+
+        db = self.db
+        total = db.execute(f"SELECT COUNT(*) FROM encounters WHERE {conditions}", params).fetchone()[0]
+        rows = db.execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM encounters WHERE {conditions} ORDER BY {SORTS[sort]} LIMIT ? OFFSET ?",
+            params + [per_page, (page - 1) * per_page],
+        ).fetchall()
+        return [_from_row(row) for row in rows], total
+
+    def export(self, owner: str, batch_size: int = 500) -> Iterator[SavedEncounter]:
+        """Yields all of the owner's encounters, oldest first. They're read in batches, each on the
+        connection of whichever thread asks for it, so the iterator can be handed between threads."""
+        last_id = 0
+        while rows := self.db.execute(
+            "SELECT * FROM encounters WHERE owner = ? AND id > ? ORDER BY id LIMIT ?", (owner, last_id, batch_size)
+        ).fetchall():
+            yield from (_from_row(row) for row in rows)
+            last_id = rows[-1]["id"]
+
+    def tags(self, owner: str) -> list[tuple[str, int]]:
+        """Returns each of the owner's tags, and how many encounters have it."""
+        rows = self.db.execute(
+            "SELECT tag, COUNT(*) FROM encounter_tags WHERE owner = ? GROUP BY tag ORDER BY tag", (owner,)
+        )
+        return [(tag, count) for tag, count in rows]
+
+
+@contextmanager
+def _transaction(db: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+def _from_row(row: sqlite3.Row) -> SavedEncounter:
+    keys = row.keys()
+    return SavedEncounter(
+        id=row["id"],
+        name=row["name"],
+        description=row["description"],
+        monsters=json.loads(row["monsters"]) if "monsters" in keys else [],
+        tags=json.loads(row["tags"]),
+        party_level=row["party_level"],
+        total_xp=row["total_xp"],
+        monster_count=row["monster_count"],
+        updated=row["updated"],
+    )
+
+
+_LIBRARY: Optional[EncounterLibrary] = None
+_LIBRARY_LOCK = Lock()
+
+
+def get_encounter_library(path: Path | str) -> EncounterLibrary:
+    """Returns the library, opening it at 'path' the first time."""
+    global _LIBRARY
+    if _LIBRARY is None:
+        with _LIBRARY_LOCK:
+            if _LIBRARY is None:
+                _LIBRARY = EncounterLibrary(path)
+    return _LIBRARY
+
+
+def set_encounter_library(library: Optional[EncounterLibrary]):
+    """Uses another library from now on ('None' opens the configured one again)."""
+    global _LIBRARY
+    _LIBRARY = library
@@ -0,0 +1,434 @@
+"""
+Monte Carlo combat simulation, to estimate how dangerous an encounter is beyond its XP: how much
+damage the party can expect to take, and how likely the monsters are to take all of them down.
+
+Every combatant is compiled down to a few numbers (HP, AC, attack bonus, initiative bonus, attacks
+per turn) and its damage dice, and each side is kept as parallel lists of those. A monster's attack
+comes from the `{@hit}` and `{@damage}` tags in its actions; it makes its Multiattack's number of
+attacks with whichever one deals the most damage. Player characters are either given as numbers, or
+estimated from their level. Spells, saving throws, recharge abilities and healing aren't simulated,
+so treat the results as rough.
+
+Trials run in batches, each with its own seed derived from the simulation's seed, across a process
+pool. Batch results are folded in order, so the same seed always gives the same results for the
+same number of trials. `simulate` yields a summary after every batch, so callers can stream the
+percentiles as they settle, and it stops once they have converged, all trials have run, or the
+time budget runs out, whichever comes first.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
+import atexit
+import math
+import multiprocessing
+import os
+import random
+import re
+from threading import Lock
+import time
+from typing import NamedTuple, Optional
+
+from dmtoolkit import dice
+from dmtoolkit.api.models import Monster
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Combat is called after this many rounds, with whoever is still standing
+MAX_ROUNDS = 20
+
+# Results are never considered converged before this many trials
+MIN_TRIALS = 1000
+
+# Limits on what one simulation can be asked for, so a single trial (and the request running it)
+#   always stays small
+MAX_PARTY_SIZE = 12
+MAX_MONSTERS = 50
+MAX_ATTACKS = 8
+MAX_HP = 1000
+MAX_DAMAGE_DICE = 40
+MAX_DIE_SIZE = 100
+
+_HIT = re.compile(r"\{@hit ([+-]?\d+)\}")
+_DAMAGE = re.compile(r"\{@damage ([^}]+)\}")
+_NUMBERS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8}
+_MULTIATTACK = re.compile(rf"\b({'|'.join(_NUMBERS)})\b[^.]*?\battacks\b", re.IGNORECASE)
+
+
+class Damage(NamedTuple):
+    """A parsed damage expression, like "2d6 + 3"."""
+    dice: tuple[tuple[int, int], ...] # (count, sides)
+    bonus: int
+
+    @property
+    def average(self) -> float:
+        return sum(count * (sides + 1) / 2 for count, sides in self.dice) + self.bonus
+
+
+class Combatant(NamedTuple):
+    name: str
+    hp: int
+    ac: int
+    to_hit: int
+    damage: Damage
+    attacks: int = 1
+    initiative: int = 0
+
+
+def parse_damage(expression: str) -> Damage:
+    """Parses a damage expression made of dice and flat bonuses, like "2d10 + 8" or "1d6 - 1"."""
+    compiled = dice.compile(expression)
+    # Critical hits double the dice, so they're rolled in the simulation loop rather than as a whole
+    if any(not term.is_plain or term.multiplier != 1 for term in compiled.terms):
+        raise ValueError(f"Unsupported damage expression: '{expression}'")
+    if not compiled.terms and not compiled.modifier:
+        raise ValueError(f"Invalid damage expression: '{expression}'")
+    return Damage(tuple((term.count, term.sides) for term in compiled.terms), compiled.modifier)
+
+
+def _entry_text(entry) -> str:
+    return " ".join(str(part) for part in entry.body)
+
+
+def _parse_attack(text: str) -> Optional[tuple[int, Damage]]:
+    """Returns the attack bonus and damage of an attack action, or 'None' if it isn't one."""
+    if not (hit := _HIT.search(text)) or "{@h}" not in text:
+        return None
+    # "X piercing damage in melee or Y piercing damage at range" only ever deals one of them
+    on_hit = text.split("{@h}", 1)[1].split(" or ", 1)[0]
+    damage_dice: list[tuple[int, int]] = []
+    bonus = 0
+    for expression in _DAMAGE.findall(on_hit):
+        try:
+            damage = parse_damage(expression)
+        except ValueError:
+            log.debug("Skipping damage expression '%s'", expression)
+            continue
+        damage_dice.extend(damage.dice)
+        bonus += damage.bonus
+    if not damage_dice and not bonus:
+        return None
+    return int(hit.group(1)), Damage(tuple(damage_dice), bonus)
+
+
+def monster_combatant(monster: Monster) -> Combatant:
+    """Compiles a monster into a combatant. Monsters without any attacks still take up a spot,
+    but never deal damage."""
+    attacks = []
+    num_attacks = 1
+    for action in monster.actions or []:
+        text = _entry_text(action)
+        if action.title.lower().startswith("multiattack"):
+            if match := _MULTIATTACK.search(text):
+                num_attacks = _NUMBERS[match.group(1).lower()]
+        elif attack := _parse_attack(text):
+            attacks.append(attack)
+    to_hit, damage = max(attacks, key=lambda attack: attack[1].average, default=(0, Damage((), 0)))
+    return Combatant(
+        name=monster.name,
+        hp=max(int(monster.hp.average), 1),
+        ac=int(monster.ac[0].value) if monster.ac else 10,
+        to_hit=to_hit,
+        damage=damage,
+        attacks=num_attacks if attacks else 0,
+        initiative=int(monster.dexterity) // 2 - 5,
+    )
+
+
+def character_combatant(level: int, name: str = "") -> Combatant:
+    """Estimates a player character from their level alone: a martial character with a +3 modifier
+    at level 1 and a +5 one from level 8, proficiency bonus included, and the Extra Attack feature."""
+    if not 1 <= level <= 20:
+        raise ValueError(f"Invalid character level: {level}")
+    modifier = 3 if level < 4 else 4 if level < 8 else 5
+    proficiency = 2 + (level - 1) // 4
+    return Combatant(
+        name=name or f"Level {level} character",
+        hp=10 + modifier - 1 + (6 + modifier - 1) * (level - 1), # d10 hit die, with the next best stat in Constitution
+        ac=15 + (level >= 5) + (level >= 11),
+        to_hit=modifier + proficiency,
+        damage=Damage(((1, 8),), modifier),
+        attacks=1 + (level >= 5) + (level >= 11) + (level >= 20),
+        initiative=2,
+    )
+
+
+def _check_range(name: str, value: int, low: int, high: int):
+    if not low <= value <= high:
+        raise ValueError(f"'{name}' must be between {low} and {high}; got '{value}'.")
+
+
+def parse_character(spec: int | dict) -> Combatant:
+    """Returns a player character from their level, or from a dict with any of the Combatant fields
+    (the damage as an expression, like "1d8 + 3"), where the rest are estimated from "level".
+    Raises a ValueError for values outside of the MAX_* limits."""
+    if not isinstance(spec, dict):
+        return character_combatant(int(spec))
+    character = character_combatant(int(spec.get("level", 1)), str(spec.get("name", "")))
+    overrides = {field: int(spec[field]) for field in ("hp", "ac", "to_hit", "attacks", "initiative") if field in spec}
+    _check_range("hp", overrides.get("hp", character.hp), 1, MAX_HP)
+    _check_range("attacks", overrides.get("attacks", character.attacks), 0, MAX_ATTACKS)
+    if "damage" in spec:
+        damage = overrides["damage"] = parse_damage(str(spec["damage"]))
+        _check_range("damage dice", sum(count for count, _ in damage.dice), 0, MAX_DAMAGE_DICE)
+        _check_range("damage die size", max((sides for _, sides in damage.dice), default=1), 1, MAX_DIE_SIZE)
+    return character._replace(**overrides)
+
+
+class _Side:
+    """One side of the fight, as parallel lists."""
+    __slots__ = ("hp", "ac", "to_hit", "dice", "bonus", "attacks", "initiative")
+
+    def __init__(self, combatants: Sequence[Combatant]):
+        self.hp = [c.hp for c in combatants]
+        self.ac = [c.ac for c in combatants]
+        self.to_hit = [c.to_hit for c in combatants]
+        self.dice = [c.damage.dice for c in combatants]
+        self.bonus = [c.damage.bonus for c in combatants]
+        self.attacks = [c.attacks for c in combatants]
+        self.initiative = [c.initiative for c in combatants]
+
+
+def _run_trial(rng: random.Random, party: _Side, monsters: _Side, max_rounds: int) -> tuple[int, bool, int, int]:
+    """Runs one fight. Returns the damage the party took, whether they were all taken down, how many
+    rounds it lasted, and how many of them went down."""
+    rand = rng.random
+    hp = (list(party.hp), list(monsters.hp))
+    sides = (party, monsters)
+    order = sorted(
+        ((int(rand() * 20) + 1 + side.initiative[i], side_id, i) for side_id, side in enumerate(sides) for i in range(len(side.hp))),
+        reverse=True,
+    )
+    alive = [len(party.hp), len(monsters.hp)]
+    damage_taken = 0
+    rounds = 0
+    while rounds < max_rounds and alive[0] and alive[1]:
+        rounds += 1
+        for _, side_id, i in order:
+            attacker_hp, target_hp = hp[side_id], hp[1 - side_id]
+            if attacker_hp[i] <= 0:
+                continue
+            attacker, target_side = sides[side_id], sides[1 - side_id]
+            for _ in range(attacker.attacks[i]):
+                # The party focuses on the most hurt monster, the monsters pick on anyone standing
+                standing = [t for t, t_hp in enumerate(target_hp) if t_hp > 0]
+                if not standing:
+                    break
+                if side_id == 0:
+                    target = min(standing, key=target_hp.__getitem__)
+                else:
+                    target = standing[int(rand() * len(standing))]
+                d20 = int(rand() * 20) + 1
+                if d20 == 1 or (d20 != 20 and d20 + attacker.to_hit[i] < target_side.ac[target]):
+                    continue
+                multiplier = 2 if d20 == 20 else 1
+                damage = attacker.bonus[i]
+                for count, sides_ in attacker.dice[i]:
+                    for _ in range(count * multiplier):
+                        damage += int(rand() * sides_) + 1
+                if damage <= 0:
+                    continue
+                if side_id == 1:
+                    damage_taken += min(damage, target_hp[target])
+                target_hp[target] -= damage
+                if target_hp[target] <= 0:
+                    alive[1 - side_id] -= 1
+            if not alive[0] or not alive[1]:
+                break
+    return damage_taken, alive[0] == 0, rounds, len(party.hp) - alive[0]
+
+
+def _run_batch(party: Sequence[Combatant], monsters: Sequence[Combatant], trials: int, seed: str,
+               max_rounds: int, deadline: float = math.inf) -> tuple[Counter, int, int, int]:
+    """Runs a batch of trials. Returns how often each amount of damage was taken, the number of
+    TPKs, and the total rounds and characters downed, so batches can be added up.
+
+    Stops early (after at least one trial) once the wall clock passes `deadline`. It's wall clock
+    time, since the batch may run in another process."""
+    rng = random.Random(seed)
+    party_side, monster_side = _Side(party), _Side(monsters)
+    damage: Counter[int] = Counter()
+    tpks = rounds = downed = 0
+    for trial in range(trials):
+        if trial and time.time() >= deadline:
+            break
+        trial_damage, tpk, trial_rounds, trial_downed = _run_trial(rng, party_side, monster_side, max_rounds)
+        damage[trial_damage] += 1
+        tpks += tpk
+        rounds += trial_rounds
+        downed += trial_downed
+    return damage, tpks, rounds, downed
+
+
+class SimulationSummary(NamedTuple):
+    trials: int
+    tpk_chance: float
+    mean_damage: float
+    damage_percentiles: dict[str, int]
+    mean_rounds: float
+    mean_downed: float
+    # Half the width of the 95% confidence intervals of the TPK chance and the mean damage
+    tpk_margin: float
+    damage_margin: float
+    done: bool
+    seed: int
+    elapsed: float
+
+
+class _Totals:
+    def __init__(self):
+        self.damage: Counter[int] = Counter()
+        self.trials = self.tpks = self.rounds = self.downed = 0
+        self.damage_sum = self.damage_sum_sq = 0
+
+    def add(self, damage: Counter, tpks: int, rounds: int, downed: int):
+        self.damage.update(damage)
+        self.trials += sum(damage.values())
+        self.tpks += tpks
+        self.rounds += rounds
+        self.downed += downed
+        self.damage_sum += sum(value * count for value, count in damage.items())
+        self.damage_sum_sq += sum(value * value * count for value, count in damage.items())
+
+    def percentiles(self) -> dict[str, int]:
+        """Reads the percentiles off the damage histogram (nearest rank)."""
+        result = {}
+        ranks = iter((p, max(math.ceil(p / 100 * self.trials), 1)) for p in PERCENTILES)
+        p, rank = next(ranks)
+        seen = 0
+        for value in sorted(self.damage):
+            seen += self.damage[value]
+            while seen >= rank:
+                result[f"p{p}"] = value
+                if (next_rank := next(ranks, None)) is None:
+                    return result
+                p, rank = next_rank
+        return result
+
+    def summary(self, done: bool, seed: int, elapsed: float) -> SimulationSummary:
+        n = self.trials
+        tpk_chance = self.tpks / n
+        mean = self.damage_sum / n
+        variance = max(self.damage_sum_sq / n - mean * mean, 0)
+        return SimulationSummary(
+            trials=n,
+            tpk_chance=round(tpk_chance, 4),
+            mean_damage=round(mean, 2),
+            damage_percentiles=self.percentiles(),
+            mean_rounds=round(self.rounds / n, 2),
+            mean_downed=round(self.downed / n, 2),
+            tpk_margin=round(1.96 * math.sqrt(tpk_chance * (1 - tpk_chance) / n), 4),
+            damage_margin=round(1.96 * math.sqrt(variance / n), 2),
+            done=done,
+            seed=seed,
+            elapsed=round(elapsed, 3),
+        )
+
+    def converged(self, tolerance: float) -> bool:
+        if self.trials < MIN_TRIALS:
+            return False
+        summary = self.summary(False, 0, 0)
+        return (summary.tpk_margin <= tolerance
+                and summary.damage_margin <= tolerance * max(summary.mean_damage, 1))
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_WORKERS = 0
+_POOL_LOCK = Lock()
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Returns the shared process pool, (re)creating it with the given number of workers."""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_WORKERS != workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False, cancel_futures=True)
+            # Never fork the web server's process itself: it runs a pool of threads, and a fork can
+            #   copy a lock another one of them holds, deadlocking the child
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+            _POOL_WORKERS = workers
+    return _POOL
+
+
+@atexit.register
+def shutdown_pool():
+    """Stops the simulation worker processes, if there are any."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+
+def simulate(
+        party: Sequence[Combatant],
+        monsters: Sequence[Combatant],
+        trials: int = 10_000,
+        seed: Optional[int] = None,
+        time_budget: float = 2.0,
+        tolerance: float = 0.01,
+        batch_size: int = 500,
+        workers: Optional[int] = None,
+        max_rounds: int = MAX_ROUNDS) -> Iterator[SimulationSummary]:
+    """Simulates the fight up to `trials` times, yielding a summary of the results so far after each
+    batch. The last summary has `done` set.
+
+    Stops early once the TPK chance, and the mean damage relative to itself, are both known to within
+    `tolerance` (at 95% confidence), or once `time_budget` seconds have passed. `workers` is the
+    number of processes to run batches in, one per CPU by default; with 1, everything runs in this
+    process.
+    """
+    if not party or not monsters:
+        raise ValueError("Both sides need at least one combatant")
+    if trials < 1:
+        raise ValueError(f"'trials' must be 1 or higher; got '{trials}'.")
+    if len(party) > MAX_PARTY_SIZE or len(monsters) > MAX_MONSTERS:
+        raise ValueError(f"At most {MAX_PARTY_SIZE} characters can fight at most {MAX_MONSTERS} monsters")
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    workers = workers if workers is not None else os.cpu_count() or 1
+    party, monsters = tuple(party), tuple(monsters)
+    batches = [min(batch_size, trials - start) for start in range(0, trials, batch_size)]
+    start_time = time.perf_counter()
+    deadline = start_time + time_budget
+    batch_deadline = time.time() + time_budget
+    totals = _Totals()
+
+    def finished(i: int) -> bool:
+        return (i == len(batches) - 1
+                or time.perf_counter() >= deadline
+                or totals.converged(tolerance))
+
+    if workers <= 1:
+        for i, size in enumerate(batches):
+            totals.add(*_run_batch(party, monsters, size, f"{seed}:{i}", max_rounds, batch_deadline))
+            done = finished(i)
+            yield totals.summary(done, seed, time.perf_counter() - start_time)
+            if done:
+                return
+        return
+
+    pool = _get_pool(workers)
+    pending: dict[int, Future] = {}
+    next_batch = 0
+    try:
+        for i in range(len(batches)):
+            # Keep every worker busy, but don't queue up work that might not be needed
+            while next_batch < len(batches) and len(pending) < workers * 2:
+                pending[next_batch] = pool.submit(
+                    _run_batch, party, monsters, batches[next_batch], f"{seed}:{next_batch}", max_rounds,
+                    batch_deadline,
+                )
+                next_batch += 1
+            totals.add(*pending.pop(i).result())
+            done = finished(i)
+            yield totals.summary(done, seed, time.perf_counter() - start_time)
+            if done:
+                return
+    finally:
+        for future in pending.values():
+            future.cancel()
@@ -1,8 +1,10 @@
 import string
 import re
+from typing import Callable
 from urllib.parse import quote
-from flask import url_for
+from flask import url_for, request, has_request_context
 from dmtoolkit.api import items
+from dmtoolkit.util import CacheInfo, LRUCache
 import importlib.metadata
 
 def sanitize_names(name: str) -> str:
@@ -35,10 +37,22 @@ class Macro5e:
     spell = re.compile(r"\{@spell (.*?)}")
     status = re.compile(r"\{@status (\w+)(?:\s*\|\|\s*(\w+))?}")
 
-    @staticmethod
-    def render_macros(text: str) -> str:
-        """Turns the 5etools macros (like {@spell magic missile}) into the appropriate HTML elements."""
-        text = str(text) # Just in case
+    # Matches a single, innermost 5e.tools macro: the tag name, and (if present) everything
+    #   between the first space and the closing brace. Macros nested inside another macro's text
+    #   are matched first; the outer macro is picked up on the next pass.
+    macro = re.compile(r"\{@(\w+)(?: ([^{}]*))?\}")
+
+    _macros: dict[str, tuple[re.Pattern | None, str | Callable[[re.Match], str]]] = {}
+
+    @classmethod
+    def _get_macros(cls) -> dict[str, tuple[re.Pattern | None, str | Callable[[re.Match], str]]]:
+        """Returns a mapping of macro tag names to a compiled pattern for the macro's text, and the
+        renderer to use on a match. Renderers are either a template string (like those used by
+        re.sub), or a function which takes the match object and returns the rendered string. A
+        pattern of 'None' means the macro takes no text at all (like {@h})."""
+        # Lazy-compile the macros
+        if cls._macros:
+            return cls._macros
 
         """
         List of all 5e macros (not all have been implemented yet)
@@ -50,65 +64,116 @@ class Macro5e:
             skill, skillCheck, spell, status, subclassFeature, table, variantrule
         """
         renderers = {
-            r"{@actResponse}": r"<em>Response: </em>",
-            r"{@actSave (\w+)}": Macro5e.render_act_save,
-            r"{@actSaveFail}": r"<em>Failure: </em>",
-            r"{@actSaveFailBy (\d+)}": r"<em>Failure by \1 or More: ",
-            r"{@actSaveSuccess}": r"<em>Success: </em>",
-            r"{@actSaveSuccessOrFail}": r"<em>Failure or Success: </em>",
-            r"{@actTrigger}": r"<em>Trigger: </em>",
-            r"{@action ([\w\s]+)}": r"\1 Action",
-            r"{@adventure (.*?)}": Macro5e.render_adventure,
-            r"{@area (.*?)}": Macro5e.render_area,
-            r"{@atk (.*?)}": Macro5e.render_atk,
-            r"{@atkr (.*?)}": Macro5e.render_atkr,
-            r"{@b (.*?)}": r"<strong>\1</strong>",
-            r"{@book ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@card ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@chance (.*?)}": Macro5e.render_chance,
-            r"{@class (.*?)}": Macro5e.render_class,
-            r"{@classFeature ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@color (.*?)\|(.*?)}": r'<span style="color: \2">\1</span>',
-            r"{@condition (\w+)}": Macro5e.render_condition,
-            r"{@creature (.*?)}": Macro5e.render_creatures,
-            r"{@d20 ([\-\+]\d+)}": Macro5e.render_d20_mod,
-            r"{@damage (.*?)}": r"\1",
-            r"{@dc (\d+)}": r"DC \1",
-            r"{@deck (.*?)}": Macro5e.render_deck,
-            r"{@deity (.*?)}": r"\1",
-            r"{@dice (\d+)?d(\d+)}": Macro5e.render_dice,
-            r"{@disease ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@filter ([^|}]+).*?}": r"\1", # Filters open a page on 5e.tools with a filtered list of spells/items/etc.
-            r"{@h}": r"<em>Hit: </em>",
-            r"{@hazard (.*?)}": Macro5e.render_hazard,
-            r"{@hit (.*?)}": Macro5e.render_hit,
-            r"{@hom}": r"<em>Hit or Miss: </em>",
-            r"{@item (.*?)}": Macro5e.render_item,
-            r"{@language}": Macro5e.render_language,
-            r"{@link (.*?)\|(.*?)}": r"""<a href="\2">\1</a>""",
-            r"{@note (.*?)}": r"""<span class="note">\1</span>""",
-            r"{@object (.*?)}": Macro5e.render_object,
-            r"{@optfeature ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@quickref (.*?)}": Macro5e.render_quickref,
-            r"{@race ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@recharge ([^|}]+).*?}": r"(Recharge \1-6)",
-            r"{@scaledamage \dd\d\|\d-\d\|(\dd\d)}": "\1",
-            r"{@scaledice \dd\d\|\d-\d\|(\dd\d)}": "\1",
-            r"{@sense (.*?)}": "\1",
-            r"{@skill (.*?)}": Macro5e.render_skill,
-            r"{@skillCheck \w+ ([\-\+]?\d+)}": Macro5e.render_skillcheck,
-            r"{@spell (.*?)}": Macro5e.render_spell,
-            r"{@status (\w+)(?:\s*\|\|\s*(\w+))?}": Macro5e.render_status,
-            r"{@subclassFeature ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@table ([^|}]+).*?}": r"\1", # Keep just first part as display text
-            r"{@variantrule ([^|}]+).*?}": r"\1", # Keep just first part as display text
-
-            # Do these last
-            r"{@i(?:talics)? (.*?)}": r"<em>\1</em>",
+            "actResponse": (None, r"<em>Response: </em>"),
+            "actSave": (r"(\w+)", cls.render_act_save),
+            "actSaveFail": (None, r"<em>Failure: </em>"),
+            "actSaveFailBy": (r"(\d+)", r"<em>Failure by \1 or More: "),
+            "actSaveSuccess": (None, r"<em>Success: </em>"),
+            "actSaveSuccessOrFail": (None, r"<em>Failure or Success: </em>"),
+            "actTrigger": (None, r"<em>Trigger: </em>"),
+            "action": (r"([\w\s]+)", r"\1 Action"),
+            "adventure": (r"(.*?)", cls.render_adventure),
+            "area": (r"(.*?)", cls.render_area),
+            "atk": (r"(.*?)", cls.render_atk),
+            "atkr": (r"(.*?)", cls.render_atkr),
+            "b": (r"(.*?)", r"<strong>\1</strong>"),
+            "book": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "card": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "chance": (r"(.*?)", cls.render_chance),
+            "class": (r"(.*?)", cls.render_class),
+            "classFeature": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "color": (r"(.*?)\|(.*?)", r'<span style="color: \2">\1</span>'),
+            "condition": (r"(\w+)", cls.render_condition),
+            "creature": (r"(.*?)", cls.render_creatures),
+            "d20": (r"([\-\+]\d+)", cls.render_d20_mod),
+            "damage": (r"(.*?)", r"\1"),
+            "dc": (r"(\d+)", r"DC \1"),
+            "deck": (r"(.*?)", cls.render_deck),
+            "deity": (r"(.*?)", r"\1"),
+            "dice": (r"(\d+)?d(\d+)", cls.render_dice),
+            "disease": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "filter": (r"([^|}]+).*?", r"\1"), # Filters open a page on 5e.tools with a filtered list of spells/items/etc.
+            "h": (None, r"<em>Hit: </em>"),
+            "hazard": (r"(.*?)", cls.render_hazard),
+            "hit": (r"(.*?)", cls.render_hit),
+            "hom": (None, r"<em>Hit or Miss: </em>"),
+            "i": (r"(.*?)", r"<em>\1</em>"),
+            "italics": (r"(.*?)", r"<em>\1</em>"),
+            "item": (r"(.*?)", cls.render_item),
+            "language": (r"(.*?)", cls.render_language),
+            "link": (r"(.*?)\|(.*?)", r"""<a href="\2">\1</a>"""),
+            "note": (r"(.*?)", r"""<span class="note">\1</span>"""),
+            "object": (r"(.*?)", cls.render_object),
+            "optfeature": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "quickref": (r"(.*?)", cls.render_quickref),
+            "race": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "recharge": (r"([^|}]+).*?", r"(Recharge \1-6)"),
+            "scaledamage": (r"\dd\d\|\d-\d\|(\dd\d)", r"\1"),
+            "scaledice": (r"\dd\d\|\d-\d\|(\dd\d)", r"\1"),
+            "sense": (r"(.*?)", r"\1"),
+            "skill": (r"(.*?)", cls.render_skill),
+            "skillCheck": (r"\w+ ([\-\+]?\d+)", cls.render_skillcheck),
+            "spell": (r"(.*?)", cls.render_spell),
+            "status": (r"(\w+)(?:\s*\|\|\s*(\w+))?", cls.render_status),
+            "subclassFeature": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "table": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
+            "variantrule": (r"([^|}]+).*?", r"\1"), # Keep just first part as display text
         }
+        for tag, (pattern, renderer) in renderers.items():
+            cls._macros[tag] = (re.compile(pattern) if pattern is not None else None, renderer)
+        return cls._macros
+
+    # Rendered macro strings, keyed by the source text and the script root of the request (links
+    #   to tooltips are built with url_for, so they depend on the prefix the app is served under).
+    cache = LRUCache(maxsize=4096)
+
+    @staticmethod
+    def render_macros(text: str) -> str:
+        """Turns the 5etools macros (like {@spell magic missile}) into the appropriate HTML elements."""
+        text = str(text) # Just in case
+        if "{@" not in text:
+            return text
 
-        for pattern, renderer in renderers.items():
-            text = re.sub(pattern, renderer, text)
+        key = (text, request.script_root if has_request_context() else "")
+        if (html := Macro5e.cache.get(key)) is None:
+            html = Macro5e._render_macros(text)
+            Macro5e.cache[key] = html
+        return html
+
+    @staticmethod
+    def cache_info() -> CacheInfo:
+        """Returns the hit, miss, and eviction counts of the rendered macro cache."""
+        return Macro5e.cache.info()
+
+    @staticmethod
+    def _render_macros(text: str) -> str:
+        """Does the actual macro rendering, bypassing the cache."""
+        macros = Macro5e._get_macros()
+        rendered = True
+        # Each pass renders the innermost macros; we only need another pass if something nested
+        #   inside an outer macro got rendered.
+        while rendered:
+            rendered = False
+
+            def render(match: re.Match) -> str:
+                nonlocal rendered
+                tag, body = match.groups()
+                if not (macro := macros.get(tag)):
+                    return match.group(0) # Not implemented yet; leave the macro as-is
+                pattern, renderer = macro
+                if pattern is None:
+                    if body is not None:
+                        return match.group(0)
+                    rendered = True
+                    return renderer
+                if body is None or not (body_match := pattern.fullmatch(body)):
+                    return match.group(0)
+                rendered = True
+                if isinstance(renderer, str):
+                    return body_match.expand(renderer)
+                return renderer(body_match)
+
+            text = Macro5e.macro.sub(render, text)
 
         return text
 
@@ -371,6 +436,7 @@ def ordinal(s: str | int) -> str:
 
 
 def add_filters(app):
+    Macro5e.cache.resize(app.config.get("MACRO_CACHE_SIZE", Macro5e.cache.maxsize))
     app.jinja_env.filters["macro5e"] = Macro5e.render_macros
     app.jinja_env.filters["ordinal"] = ordinal
 
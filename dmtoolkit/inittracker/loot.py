@@ -1,5 +1,7 @@
+from collections.abc import Callable, Iterable
 import random
 import re
+from typing import Optional
 
 from dmtoolkit.api.models import Monster
 from dmtoolkit.api.items import get_item
@@ -15,7 +17,7 @@ def loot(monster: Monster) -> LootResponse:
         for item_id in re.finditer(r"{@item (.*?)}", str(entry.body)):
             item = get_item(item_id.group(1))
             if item:
-                item_set[item.id] = item
+                item_set[item.id()] = item
     
     # Grab weapon
     for entry in monster.actions or []:
@@ -23,7 +25,7 @@ def loot(monster: Monster) -> LootResponse:
         if random.random() > 1/10:
             continue
         if item := get_item(entry.title):
-            item_set[item.id] = item
+            item_set[item.id()] = item
     
     # Grab Armor
     for ac_entry in monster.ac:
@@ -31,6 +33,29 @@ def loot(monster: Monster) -> LootResponse:
             if random.random() > 1/10:
                 continue
             if item := get_item(item_id.group(1)):
-                item_set[item.id] = item
+                item_set[item.id()] = item
     
-    return LootResponse([ItemWrapper(item, 1) for item in item_set], coinage)
\ No newline at end of file
+    return LootResponse([ItemWrapper(item, 1) for item in item_set.values()], coinage)
+
+
+def loot_many(
+        monsters: Iterable[tuple[Monster, int]],
+        generate: Callable[[Monster], LootResponse] = loot,
+        generate_many: Optional[Callable[[Monster, int], list[LootResponse]]] = None) -> LootResponse:
+    """Rolls loot for every monster in an encounter, given as (monster, count) pairs, and merges it
+    all into one response. Each roll's note is moved onto its items first, so it stays with them.
+    If given, 'generate_many' loots all of the same monster at once, instead of one at a time."""
+    total = LootResponse([], 0)
+    for monster, count in monsters:
+        if generate_many:
+            responses = generate_many(monster, count)
+        else:
+            responses = [generate(monster) for _ in range(count)]
+        for response in responses:
+            if response.note:
+                response = LootResponse(
+                    [ItemWrapper(w.item, w.quantity, ". ".join(note for note in (w.note, response.note) if note)) for w in response.items],
+                    response.coinage,
+                )
+            total += response
+    return total
@@ -2,20 +2,26 @@ import json
 import random
 import re
 
-from flask import Blueprint, render_template, request
+from flask import Blueprint, Response, current_app, make_response, render_template, request
 
 from dmtoolkit.api.classes import get_class
 from dmtoolkit.api.conditions import get_condition
 from dmtoolkit.api.items import get_item
 from dmtoolkit.api.models import Item
-from dmtoolkit.api.monsters import get_monster, get_monster_names
+from dmtoolkit.api.monsters import get_monster, record_monster_use
 from dmtoolkit.api.players import list_players, get_player, list_player_tags
 from dmtoolkit.api.races import get_race
 from dmtoolkit.api.spells import get_spell
-from dmtoolkit.inittracker.loot import loot as generate_loot
-from dmtoolkit.modules import flatten_modules
-from dmtoolkit.settings.api import get_active_modules
-from dmtoolkit.settings.api import get_setting
+from dmtoolkit.asgi import run_sync
+from dmtoolkit.context import get_request_state
+from dmtoolkit.encounters.difficulty import encounter_entries
+from dmtoolkit.inittracker import sessions, sync
+from dmtoolkit.inittracker.loot import loot as generate_loot, loot_many
+from dmtoolkit.inittracker.statblocks import build_statblock, get_cached_statblock
+from dmtoolkit.modules.models import LootResponse
+
+# Most monsters a single loot request can roll for
+MAX_LOOT_ROLLS = 1000
 
 tracker_bp = Blueprint(
     "tracker_bp",
@@ -31,22 +37,42 @@ def tracker():
     page = {
         "title": "DMTTools - Init Tracker"
     }
-    monsters = get_monster_names(prefer_reprinted=get_setting("use_new_content"))
     monster = get_monster("Poltergeist-MM")
     return render_template(
         "tracker.jinja2",
         page = page,
-        monsters = monsters,
         players = list_players(),
         monster = monster,
         player_tags = list_player_tags()
     )
 
 @tracker_bp.route("/api/monsters", methods=["GET"])
-def get_monster_page():
+async def get_monster_page():
     name = str(request.args.get("name"))
     monster = get_monster(name)
-    return json.dumps(monster)
+    return await run_sync(json.dumps, monster)
+
+def _loot_spec(loot: LootResponse) -> dict:
+    """Converts loot to the format the tracker keeps on each row."""
+    # Exchange copper pieces for silver and gold
+    gp = loot.coinage // 100
+    sp = (loot.coinage - gp*100) // 10
+    cp = loot.coinage % 10
+
+    item_specs = []
+    for item_wrapper in loot.items:
+        item_specs.append({
+            "id": item_wrapper.item.id(),
+            "quantity": item_wrapper.quantity,
+            "note": ". ".join(note for note in [item_wrapper.note, loot.note] if note)
+        })
+    return {
+        "total": loot.coinage,
+        "cp": cp,
+        "sp": sp,
+        "gp": gp,
+        "items": item_specs
+    }
 
 @tracker_bp.route("/api/monsters-combat-overview", methods=["GET"])
 def get_monster_combat_overview():
@@ -54,8 +80,12 @@ def get_monster_combat_overview():
     monster = get_monster(name)
     if not monster:
         raise ValueError("Cannot find monster with ID '{name}'")
+    record_monster_use(monster.key)
     ac = monster.ac[0].value
-    hp = monster.hp.average
+    if request.args.get("roll_hp", "").lower() in ("1", "true", "yes"):
+        hp = monster.hp.roll()
+    else:
+        hp = monster.hp.average
     init_mod = int(monster.dexterity) // 2 - 5
     pp = monster.passive
     if not pp:
@@ -65,22 +95,9 @@ def get_monster_combat_overview():
             wis_mod = int(monster.wisdom) // 2 - 5
             pp = 10 + wis_mod
         
-    func = flatten_modules(get_active_modules()).generate_loot or generate_loot
+    func = get_request_state().module.generate_loot or generate_loot
     loot = func(monster)
 
-    # Exchange copper pieces for silver and gold
-    gp = loot.coinage // 100
-    sp = (loot.coinage - gp*100) // 10
-    cp = loot.coinage % 10
-
-    item_specs = []
-    for item_wrapper in loot.items:
-        item_specs.append({
-            "id": item_wrapper.item.id(),
-            "quantity": item_wrapper.quantity,
-            "note": ". ".join(note for note in [item_wrapper.note, loot.note] if note)
-        })
-
     return json.dumps({
         "name": monster.name,
         "ac": ac,
@@ -91,17 +108,196 @@ def get_monster_combat_overview():
         "dead": False,
         "flag_xp": True,
         "flag_loot": True,
-        "loot": {
-            "total": loot.coinage,
-            "cp": cp,
-            "sp": sp,
-            "gp": gp,
-            "items": item_specs
-        },
+        "loot": _loot_spec(loot),
         "statuses": [],
         "mobsize": 1 # 1 means single enemy, more means a mob
     })
 
+@tracker_bp.route("/api/encounters/loot", methods=["POST"])
+def get_encounter_loot():
+    """Rolls the loot for a whole encounter (or mob) at once. Takes {"monsters": [monster key or
+    {"key": ..., "count": ...}, ...]}, and returns the combined loot."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    monsters = []
+    try:
+        for key, count in encounter_entries(body.get("monsters", [])):
+            if not (monster := get_monster(key)):
+                return json.dumps({"message": f"Unknown monster: {key}"}), 400
+            monsters.append((monster, count))
+    except KeyError as e:
+        return json.dumps({"message": f"Missing field: {e.args[0]}"}), 400
+    except (TypeError, ValueError, AttributeError) as e:
+        return json.dumps({"message": str(e) or "Invalid encounter"}), 400
+    if sum(count for _, count in monsters) > MAX_LOOT_ROLLS:
+        return json.dumps({"message": f"Encounters can have at most {MAX_LOOT_ROLLS} monsters"}), 400
+
+    module = get_request_state().module
+    if module.generate_loot:
+        loot = loot_many(monsters, module.generate_loot, module.generate_loot_many)
+    else:
+        loot = loot_many(monsters)
+    return json.dumps(_loot_spec(loot))
+
+def _session_response(session_id: str, action):
+    """Runs an action on a tracker session, and returns the changes it made."""
+    try:
+        version, changes = sessions.update_session(session_id, action)
+    except KeyError as e:
+        return json.dumps({"message": f"Unknown session or combatant: {e.args[0]}"}), 404
+    except (TypeError, ValueError) as e:
+        return json.dumps({"message": str(e) or "Invalid request"}), 400
+    return json.dumps({"version": version, "changes": changes})
+
+@tracker_bp.before_request
+def check_tracker_store():
+    """Tracker sessions kept in one worker's memory would be missing from the others, so refuse
+    them unless there's only one worker (or the store is shared)."""
+    if request.path.startswith("/api/tracker") and not sessions.get_tracker_store().shared \
+            and current_app.config["WEB_CONCURRENCY"] > 1:
+        message = "Live tracker sessions need TRACKER_STORE=redis when more than one worker serves the app"
+        return json.dumps({"message": message}), 503
+
+@tracker_bp.route("/api/tracker", methods=["POST"])
+def create_tracker_session():
+    """Starts a new server-side tracker session, and returns its (empty) state."""
+    return json.dumps(sessions.create_session().to_dict())
+
+@tracker_bp.route("/api/tracker/<session_id>", methods=["GET"])
+def get_tracker_session(session_id: str):
+    """Returns the changes made since ?since=<version>, or the whole state if that isn't given (or
+    is too old to catch up from)."""
+    since = request.args.get("since", type=int)
+    store = sessions.get_tracker_store()
+    # Read under the lock, so the version matches the changes or state sent with it
+    with store.lock(session_id):
+        if (session := store.get(session_id)) is None:
+            return json.dumps({"message": f"Unknown session: {session_id}"}), 404
+        version = session.version
+        changes = session.changes_since(since) if since is not None else None
+        state = session.to_dict() if changes is None else None
+    if changes is not None:
+        return json.dumps({"version": version, "changes": changes})
+    return json.dumps({"version": version, "state": state})
+
+@tracker_bp.route("/api/tracker/<session_id>/events", methods=["GET"])
+def tracker_session_events(session_id: str):
+    """Streams a session's changes as Server-Sent Events. Resumes after ?since=<version>, or the
+    Last-Event-ID header browsers send when they reconnect."""
+    if sessions.get_session(session_id) is None:
+        return json.dumps({"message": f"Unknown session: {session_id}"}), 404
+    since = request.args.get("since", type=int)
+    if since is None:
+        since = request.headers.get("Last-Event-ID", type=int)
+    events = sync.subscribe(session_id, since, max_subscribers=current_app.config["TRACKER_MAX_SUBSCRIBERS"])
+    try:
+        # Join now, rather than once the response has started
+        first = next(events)
+    except sync.TooManySubscribers as e:
+        return json.dumps({"message": str(e)}), 503, {"Retry-After": "30"}
+
+    def stream():
+        yield first
+        yield from events
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        # Proxies mustn't hold events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@tracker_bp.route("/api/tracker/<session_id>", methods=["DELETE"])
+def delete_tracker_session(session_id: str):
+    sessions.delete_session(session_id)
+    return json.dumps({})
+
+@tracker_bp.route("/api/tracker/<session_id>/combatants", methods=["POST"])
+def add_tracker_combatant(session_id: str):
+    """Adds {"monster": key, ...} or {"player": name, ...}. Any other fields (like "mobsize" or
+    "initiative") override the monster's or player's own."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    body = dict(body)
+    if key := body.pop("monster", None):
+        if not (monster := get_monster(key)):
+            return json.dumps({"message": f"Unknown monster: {key}"}), 400
+        record_monster_use(monster.key)
+        values = {
+            "name": monster.name,
+            "type": "npc",
+            "key": monster.key,
+            "ac": monster.ac[0].value if monster.ac else 10,
+            "max_hp": monster.hp.average,
+            "init_mod": int(monster.dexterity) // 2 - 5,
+            "xp": monster.xp,
+        }
+    elif name := body.pop("player", None):
+        if not (player := get_player(name)):
+            return json.dumps({"message": f"Unknown player: {name}"}), 400
+        values = {"name": player.name, "type": "player", "key": player.name, "ac": player.ac, "max_hp": player.hp}
+    else:
+        return json.dumps({"message": "Give either a 'monster' or a 'player' to add"}), 400
+    values.update(body)
+    return _session_response(session_id, lambda session: session.add(values))
+
+@tracker_bp.route("/api/tracker/<session_id>/combatants/<combatant_id>", methods=["PATCH"])
+def update_tracker_combatant(session_id: str, combatant_id: str):
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    return _session_response(session_id, lambda session: session.update(combatant_id, body))
+
+@tracker_bp.route("/api/tracker/<session_id>/combatants/<combatant_id>", methods=["DELETE"])
+def remove_tracker_combatant(session_id: str, combatant_id: str):
+    return _session_response(session_id, lambda session: session.remove(combatant_id))
+
+@tracker_bp.route("/api/tracker/<session_id>/combatants/<combatant_id>/damage", methods=["POST"])
+def damage_tracker_combatant(session_id: str, combatant_id: str):
+    """Takes {"amount": damage}; negative amounts heal."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    if isinstance(amount := body.get("amount"), bool) or not isinstance(amount, int):
+        return json.dumps({"message": "'amount' must be a whole number"}), 400
+    return _session_response(session_id, lambda session: session.damage(combatant_id, amount))
+
+@tracker_bp.route("/api/tracker/<session_id>/combatants/<combatant_id>/statuses", methods=["POST"])
+def set_tracker_statuses(session_id: str, combatant_id: str):
+    """Takes {"add": [status, ...], "remove": [status, ...]}."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    add, remove = body.get("add", []), body.get("remove", [])
+    if not isinstance(add, list) or not isinstance(remove, list) or not all(isinstance(status, str) for status in [*add, *remove]):
+        return json.dumps({"message": "Statuses must be strings"}), 400
+    return _session_response(session_id, lambda session: session.set_statuses(combatant_id, add, remove))
+
+@tracker_bp.route("/api/tracker/<session_id>/initiative", methods=["POST"])
+def set_tracker_initiative(session_id: str):
+    """Takes {"values": {combatant ID: initiative, ...}}, or {"roll": true} to roll for every NPC."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    if body.get("roll"):
+        return _session_response(session_id, lambda session: session.roll_initiative())
+    values = body.get("values", {})
+    if not isinstance(values, dict):
+        return json.dumps({"message": "'values' must map combatant IDs to initiatives"}), 400
+    return _session_response(session_id, lambda session: session.set_initiative(values))
+
+@tracker_bp.route("/api/tracker/<session_id>/next-turn", methods=["POST"])
+def next_tracker_turn(session_id: str):
+    """Takes an optional {"step": n}; negative steps go back."""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return json.dumps({"message": "The request body must be a JSON object"}), 400
+    step = body.get("step", 1)
+    if isinstance(step, bool) or not isinstance(step, int) or not step:
+        return json.dumps({"message": "'step' must be a non-zero whole number"}), 400
+    return _session_response(session_id, lambda session: session.next_turn(step))
+
 @tracker_bp.app_template_filter("ordinal")
 def make_ordinal(n):
     '''
@@ -120,7 +316,7 @@ def make_ordinal(n):
     return str(n) + suffix
 
 @tracker_bp.route("/statblock/<id>", methods=["GET"])
-def get_statblock_html(id: str):
+async def get_statblock_html(id: str):
     if id.endswith('.player'):
         name = id[:-7]
         player = get_player(name)
@@ -138,13 +334,18 @@ def get_statblock_html(id: str):
                 subclass = {}
         print(player.subclass_id.__class__)
         
-        return render_template("player-statblock.jinja2", player=player, race=race, class_=class_, subclass=subclass)
+        return await run_sync(render_template, "player-statblock.jinja2", player=player, race=race, class_=class_, subclass=subclass)
     
-    monster = get_monster(id)
-    if not monster:
+    # Cached statblocks are answered right away, and only rendering goes to the thread pool
+    statblock = get_cached_statblock(id) or await run_sync(build_statblock, id)
+    if not statblock:
         return f"Unable to find data for '{id}'"
     
-    return render_template("statblock.jinja2", monster=monster)
+    etag, html = statblock
+    resp = make_response(html)
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True # Always revalidate, so we can answer with a 304
+    return resp.make_conditional(request)
 
 @tracker_bp.route("/lootblock", methods=["POST"])
 def get_loot_statblock():
@@ -174,23 +375,23 @@ def get_loot_statblock():
 
 
 @tracker_bp.route("/tooltips/spells/<spell_name>", methods=["GET"])
-def get_spell_tooltip(spell_name: str):
-    spell = get_spell(spell_name, get_setting("use_new_content"))
-    return render_template("spell-statblock.jinja2", spell=spell)
+async def get_spell_tooltip(spell_name: str):
+    spell = get_spell(spell_name, get_request_state().use_new_content)
+    return await run_sync(render_template, "spell-statblock.jinja2", spell=spell)
 
 
 @tracker_bp.route("/tooltips/items/<item_name>", methods=["GET"])
-def get_item_tooltip(item_name: str):
+async def get_item_tooltip(item_name: str):
     item = get_item(item_name)
-    return render_template("item-statblock.jinja2", item=item)
+    return await run_sync(render_template, "item-statblock.jinja2", item=item)
 
 
 @tracker_bp.route("/tooltips/conditions/<name>")
-def get_condition_tooltip(name: str):
+async def get_condition_tooltip(name: str):
     condition = get_condition(name)
     if not condition:
         condition = {
             "title": name,
             "notes": ["This condition doesn't have a description yet."]
         }
-    return render_template("condition-statblock.jinja2", condition=condition)
\ No newline at end of file
+    return await run_sync(render_template, "condition-statblock.jinja2", condition=condition)
\ No newline at end of file
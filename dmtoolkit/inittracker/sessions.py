@@ -0,0 +1,452 @@
+"""
+Server-side initiative tracker state.
+
+A TrackerSession holds the combatants of one fight, whose turn it is, and the round. Every action
+(adding or removing combatants, damage, statuses, initiative, moving the turn) bumps the session's
+version and returns only what it changed, as a list of small JSON-ready changes:
+
+    {"op": "add", "combatant": {...}}
+    {"op": "remove", "id": "c3"}
+    {"op": "update", "id": "c3", "fields": {"hp": 0, "dead": true, ...}}
+    {"op": "turn", "turn": "c1", "round": 2}
+
+so keeping a client in sync costs what changed, no matter how long the fight has gone on. Each
+session remembers the changes of its last HISTORY_SIZE versions, so a client which fell behind can
+catch up with `changes_since` instead of fetching the whole state again.
+
+Sessions are kept in a TrackerStore, picked with TRACKER_STORE (see `init_tracker_store`). The
+default one keeps them in this process's memory, so it only works while a single worker serves the
+app; RedisTrackerStore keeps them in redis, where every worker shares them, and announces changes
+to every worker over pub/sub. Functions added with `add_listener` are told about every change (see
+dmtoolkit/inittracker/sync.py, which pushes them to subscribed clients).
+"""
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable, Iterable
+from contextlib import AbstractContextManager
+from dataclasses import asdict, dataclass, field, fields
+from datetime import timedelta
+import json
+import math
+import os
+import pickle
+import random
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Optional
+import uuid
+
+from flask import Flask
+
+from dmtoolkit.util import LRUCache, get_logger
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+log = get_logger(__name__)
+
+# How many versions of changes each session remembers for clients catching up
+HISTORY_SIZE = 256
+
+# Most sessions the in-memory store keeps; the least recently used ones are dropped after that
+MAX_SESSIONS = 1024
+
+# Added to (and removed from) combatants when they drop to (or come back from) 0 HP
+DOWNED_STATUS = "incapacitated"
+
+
+@dataclass
+class Combatant:
+    """One row of the tracker. For mobs, 'max_hp' is the HP of a single monster, and 'hp' is the
+    HP of the whole mob."""
+    id: str
+    name: str
+    type: str = "npc" # "npc" or "player"
+    key: str = "" # The monster's key, or the player's name
+    ac: int = 10
+    hp: int = 0
+    max_hp: int = 0
+    initiative: Optional[int] = None
+    init_mod: int = 0
+    xp: int = 0
+    mobsize: int = 1
+    remaining: int = 1
+    statuses: list[str] = field(default_factory=list)
+    dead: bool = False
+    has_xp: bool = True
+    has_loot: bool = True
+
+
+# Fields clients may set directly through `TrackerSession.update`
+EDITABLE_FIELDS = frozenset(("name", "ac", "hp", "max_hp", "initiative", "init_mod", "mobsize", "has_xp", "has_loot"))
+
+_FIELD_TYPES = {f.name: f.type for f in fields(Combatant)}
+
+
+def _coerce(values: dict[str, Any]) -> dict[str, Any]:
+    """Converts field values from JSON to the types Combatant expects. Raises a ValueError for
+    unknown fields, and values which can't be converted."""
+    coerced = {}
+    for name, value in values.items():
+        if (type_ := _FIELD_TYPES.get(name)) is None or name in ("id", "remaining", "dead", "statuses"):
+            raise ValueError(f"Can't set combatant field '{name}'")
+        if type_ == "bool":
+            coerced[name] = bool(value)
+        elif type_ == "str":
+            coerced[name] = str(value)
+        elif value is None and type_.startswith("Optional"):
+            coerced[name] = None
+        else:
+            if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+                raise ValueError(f"Invalid value for '{name}': {value!r}")
+            coerced[name] = int(value)
+    if coerced.get("type", "npc") not in ("npc", "player"):
+        raise ValueError(f"Invalid combatant type: {coerced['type']}")
+    if coerced.get("mobsize", 1) < 1:
+        raise ValueError(f"Invalid mob size: {coerced['mobsize']}")
+    return coerced
+
+
+class TrackerSession:
+    """The state of one fight. Not thread-safe on its own; see `update_session`."""
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.version = 0
+        self.round = 1
+        self.turn: Optional[str] = None
+        self.combatants: dict[str, Combatant] = {}
+        self.history: deque[tuple[int, list[dict]]] = deque(maxlen=HISTORY_SIZE)
+        self._next_id = 1
+
+    def to_dict(self) -> dict:
+        """The whole state, for clients which don't have it yet."""
+        return {
+            "id": self.id,
+            "version": self.version,
+            "round": self.round,
+            "turn": self.turn,
+            "order": self.order(),
+            "combatants": [asdict(combatant) for combatant in self.combatants.values()],
+        }
+
+    def order(self) -> list[str]:
+        """Combatant IDs in turn order: highest initiative (then initiative modifier) first, and in
+        the order they were added for ties. Combatants without an initiative go last."""
+        ranked = sorted(
+            enumerate(self.combatants.values()),
+            key=lambda pair: (pair[1].initiative is None, -(pair[1].initiative or 0), -pair[1].init_mod, pair[0]),
+        )
+        return [combatant.id for _, combatant in ranked]
+
+    def changes_since(self, version: int) -> Optional[list[dict]]:
+        """Returns every change made after 'version', or 'None' if they're no longer remembered
+        (or 'version' is from the future), in which case the client needs the whole state."""
+        if version == self.version:
+            return []
+        if version > self.version or not self.history or self.history[0][0] > version + 1:
+            return None
+        return [change for v, changes in self.history if v > version for change in changes]
+
+    def _commit(self, changes: list[dict]) -> list[dict]:
+        if changes:
+            self.version += 1
+            self.history.append((self.version, changes))
+        return changes
+
+    def get(self, combatant_id: str) -> Combatant:
+        """Raises a KeyError for unknown combatants."""
+        return self.combatants[combatant_id]
+
+    def _set(self, combatant: Combatant, changes: list[dict], **values):
+        """Sets the given fields on the combatant, and adds an update with the ones which changed."""
+        changed = {}
+        for name, value in values.items():
+            if getattr(combatant, name) != value:
+                setattr(combatant, name, value)
+                changed[name] = value
+        if changed:
+            changes.append({"op": "update", "id": combatant.id, "fields": changed})
+
+    def _set_hp(self, combatant: Combatant, hp: int, changes: list[dict]):
+        hp = max(hp, 0)
+        values: dict[str, Any] = {"hp": hp}
+        dead = hp <= 0
+        if dead != combatant.dead:
+            values["dead"] = dead
+            statuses = [status for status in combatant.statuses if status != DOWNED_STATUS]
+            values["statuses"] = [DOWNED_STATUS, *statuses] if dead else statuses
+        if combatant.type == "npc" and combatant.max_hp > 0:
+            values["remaining"] = min(math.ceil(hp / combatant.max_hp), combatant.mobsize)
+        self._set(combatant, changes, **values)
+
+    def add(self, values: dict[str, Any]) -> list[dict]:
+        """Adds a combatant with the given fields (and 'type' and 'key'). Its HP starts out full,
+        unless given."""
+        values = _coerce(values)
+        if "hp" not in values:
+            values["hp"] = values.get("max_hp", 0) * values.get("mobsize", 1)
+        combatant = Combatant(id=f"c{self._next_id}", **values)
+        self._next_id += 1
+        # Marks combatants added at 0 HP as down, and counts how many of a mob are left
+        self._set_hp(combatant, combatant.hp, [])
+        self.combatants[combatant.id] = combatant
+        return self._commit([{"op": "add", "combatant": asdict(combatant)}])
+
+    def remove(self, combatant_id: str) -> list[dict]:
+        self.get(combatant_id)
+        changes = []
+        if self.turn == combatant_id:
+            order = self.order()
+            following = order[order.index(combatant_id) + 1:] + order[:order.index(combatant_id)]
+            self.turn = next(iter(following), None)
+            changes.append({"op": "turn", "turn": self.turn, "round": self.round})
+        del self.combatants[combatant_id]
+        changes.insert(0, {"op": "remove", "id": combatant_id})
+        return self._commit(changes)
+
+    def damage(self, combatant_id: str, amount: int) -> list[dict]:
+        """Deals 'amount' damage to a combatant (or heals them, if it's negative). HP never drops
+        below 0."""
+        combatant = self.get(combatant_id)
+        changes: list[dict] = []
+        self._set_hp(combatant, combatant.hp - amount, changes)
+        return self._commit(changes)
+
+    def update(self, combatant_id: str, values: dict[str, Any]) -> list[dict]:
+        """Sets some of a combatant's EDITABLE_FIELDS directly."""
+        combatant = self.get(combatant_id)
+        if unknown := set(values) - EDITABLE_FIELDS:
+            raise ValueError(f"Can't set combatant fields: {', '.join(sorted(unknown))}")
+        values = _coerce(values)
+        changes: list[dict] = []
+        hp = values.pop("hp", None)
+        if "mobsize" in values and hp is None:
+            # Growing or shrinking a mob keeps the same fraction of its HP (rounded up)
+            hp = -(-combatant.hp * values["mobsize"] // combatant.mobsize)
+        self._set(combatant, changes, **values)
+        self._set_hp(combatant, combatant.hp if hp is None else hp, changes)
+        return self._commit(self._merge_updates(changes))
+
+    def set_statuses(self, combatant_id: str, add: Iterable[str] = (), remove: Iterable[str] = ()) -> list[dict]:
+        """Adds and removes statuses. Statuses the combatant already has aren't added twice."""
+        combatant = self.get(combatant_id)
+        removed = set(remove)
+        statuses = [status for status in combatant.statuses if status not in removed]
+        statuses += [status for status in dict.fromkeys(add) if status not in statuses]
+        changes: list[dict] = []
+        self._set(combatant, changes, statuses=statuses)
+        return self._commit(changes)
+
+    def set_initiative(self, values: dict[str, int]) -> list[dict]:
+        """Sets the initiative of some combatants. Checks every value before changing any of them."""
+        initiatives = {}
+        for combatant_id, initiative in values.items():
+            self.get(combatant_id)
+            initiatives[combatant_id] = _coerce({"initiative": initiative})["initiative"]
+        changes: list[dict] = []
+        for combatant_id, initiative in initiatives.items():
+            self._set(self.combatants[combatant_id], changes, initiative=initiative)
+        return self._commit(changes)
+
+    def roll_initiative(self, rng: Optional[random.Random] = None) -> list[dict]:
+        """Rolls initiative for every NPC."""
+        rng = rng or random
+        return self.set_initiative({
+            combatant.id: rng.randint(1, 20) + combatant.init_mod
+            for combatant in self.combatants.values() if combatant.type == "npc"
+        })
+
+    def next_turn(self, step: int = 1) -> list[dict]:
+        """Moves the turn 'step' combatants on (or back, if negative), skipping downed NPCs.
+        Going past the last combatant starts the next round."""
+        order = self.order()
+        if not order:
+            return []
+        direction = 1 if step > 0 else -1
+        if self.turn is None:
+            # The first step lands on the first (or last) combatant, without changing the round
+            index = -1 if step > 0 else len(order)
+        else:
+            index = order.index(self.turn)
+        round_ = self.round
+        for _ in range(abs(step)):
+            for _ in range(len(order)):
+                index += direction
+                if index == len(order):
+                    index, round_ = 0, round_ + 1
+                elif index < 0:
+                    index, round_ = len(order) - 1, max(round_ - 1, 1)
+                combatant = self.combatants[order[index]]
+                if not (combatant.type == "npc" and combatant.dead):
+                    break
+        if (order[index], round_) == (self.turn, self.round):
+            return []
+        self.turn, self.round = order[index], round_
+        return self._commit([{"op": "turn", "turn": self.turn, "round": self.round}])
+
+    @staticmethod
+    def _merge_updates(changes: list[dict]) -> list[dict]:
+        """Folds several updates to the same combatant into one."""
+        merged: dict[str, dict] = {}
+        for change in changes:
+            if (previous := merged.get(change["id"])) is None:
+                merged[change["id"]] = change
+            else:
+                previous["fields"].update(change["fields"])
+        return list(merged.values())
+
+
+class TrackerStore:
+    """Where tracker sessions are kept. The base class keeps them in memory, in an LRU cache;
+    other backends override `get`, `save` and `delete`, and can override `lock` to lock sessions
+    across processes, and `notify` and `listen` to pass changes between them."""
+
+    # Sessions are locked in stripes, so unrelated sessions rarely wait on each other
+    _STRIPES = 64
+    # Whether every process sees the same sessions
+    shared = False
+
+    def __init__(self, maxsize: int = MAX_SESSIONS):
+        self._sessions = LRUCache(maxsize=maxsize)
+        self._locks = [Lock() for _ in range(self._STRIPES)]
+
+    def get(self, session_id: str) -> Optional[TrackerSession]:
+        return self._sessions.get(session_id)
+
+    def save(self, session: TrackerSession):
+        self._sessions[session.id] = session
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id)
+
+    def lock(self, session_id: str) -> AbstractContextManager:
+        """A lock which is held while a session is being changed."""
+        return self._locks[hash(session_id) % self._STRIPES]
+
+    def notify(self, session_id: str, version: Optional[int]):
+        """Tells the listeners about a change."""
+        _notify(session_id, version)
+
+    def listen(self):
+        """Makes sure this process hears about changes made by the others."""
+
+
+class RedisTrackerStore(TrackerStore):
+    """Keeps sessions in redis, so every worker (and server) shares them. Sessions are dropped
+    'ttl' after their last change. Changes are published to a channel which each process with
+    subscribers listens to, in a thread of its own, and passes on to its listeners."""
+
+    shared = True
+
+    def __init__(self, redis: Redis, ttl: timedelta = timedelta(days=1), prefix: str = "tracker:"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.channel = f"{prefix}changes"
+        self._listening_pid: Optional[int] = None
+        self._listen_lock = Lock()
+
+    def get(self, session_id: str) -> Optional[TrackerSession]:
+        data = self.redis.get(self.prefix + session_id)
+        return pickle.loads(data) if data is not None else None
+
+    def save(self, session: TrackerSession):
+        self.redis.set(self.prefix + session.id, pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+
+    def delete(self, session_id: str):
+        self.redis.delete(self.prefix + session_id)
+
+    def lock(self, session_id: str) -> AbstractContextManager:
+        # Expires on its own if the worker holding it dies
+        return self.redis.lock(f"{self.prefix}lock:{session_id}", timeout=10, blocking_timeout=10)
+
+    def notify(self, session_id: str, version: Optional[int]):
+        # Every process hears about it through `listen`, this one included
+        self.redis.publish(self.channel, json.dumps([session_id, version]))
+
+    def listen(self):
+        # Once per process: threads don't survive a fork
+        if self._listening_pid == os.getpid():
+            return
+        with self._listen_lock:
+            if self._listening_pid != os.getpid():
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._on_message})
+                pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+                self._listening_pid = os.getpid()
+
+    @staticmethod
+    def _on_message(message: dict):
+        session_id, version = json.loads(message["data"])
+        _notify(session_id, version)
+
+
+_STORE = TrackerStore()
+
+# Called with (session ID, new version) after every change, and (session ID, None) once a session
+#   is deleted
+_LISTENERS: list[Callable[[str, Optional[int]], None]] = []
+
+
+def get_tracker_store() -> TrackerStore:
+    return _STORE
+
+
+def set_tracker_store(store: TrackerStore):
+    """Keeps tracker sessions in another store from now on."""
+    global _STORE
+    _STORE = store
+
+
+def init_tracker_store(app: Flask):
+    """Sets up the store TRACKER_STORE names: "memory" (the default) or "redis"."""
+    if app.config.get("TRACKER_STORE") == "redis":
+        from redis import Redis
+        set_tracker_store(RedisTrackerStore(Redis.from_url(app.config["TRACKER_REDIS_URL"])))
+
+
+def add_listener(listener: Callable[[str, Optional[int]], None]):
+    _LISTENERS.append(listener)
+
+
+def _notify(session_id: str, version: Optional[int]):
+    for listener in _LISTENERS:
+        try:
+            listener(session_id, version)
+        except Exception:
+            log.exception(f"Tracker session listener failed for {session_id}")
+
+
+def create_session() -> TrackerSession:
+    session = TrackerSession(uuid.uuid4().hex)
+    get_tracker_store().save(session)
+    log.debug(f"Created tracker session {session.id}")
+    return session
+
+
+def get_session(session_id: str) -> Optional[TrackerSession]:
+    return get_tracker_store().get(session_id)
+
+
+def update_session(session_id: str, action: Callable[[TrackerSession], list[dict]]) -> tuple[int, list[dict]]:
+    """Runs an action on a session while holding its lock, and saves it if anything changed.
+    Returns the session's new version, and the changes. Raises a KeyError for unknown sessions."""
+    store = get_tracker_store()
+    with store.lock(session_id):
+        if (session := store.get(session_id)) is None:
+            raise KeyError(session_id)
+        changes = action(session)
+        if changes:
+            store.save(session)
+        version = session.version
+    if changes:
+        store.notify(session_id, version)
+    return version, changes
+
+
+def delete_session(session_id: str):
+    store = get_tracker_store()
+    with store.lock(session_id):
+        store.delete(session_id)
+    store.notify(session_id, None)
@@ -0,0 +1,74 @@
+"""Server-side cache of rendered monster statblocks. The tracker fetches a statblock every time a
+combatant is clicked, so we only ever want to render each one once."""
+import hashlib
+import importlib.metadata
+
+from flask import Flask, render_template, request
+
+from dmtoolkit.api.monsters import COMMON_MONSTERS, DEFAULT_MONSTERS_FILE, get_monster
+from dmtoolkit.util import LRUCache, get_logger
+
+log = get_logger(__name__)
+
+# Maps (monster key, script root) to the statblock's ETag and rendered HTML
+STATBLOCKS = LRUCache(maxsize=512)
+
+_CONTENT_VERSION = ""
+
+def get_content_version() -> str:
+    """Returns a string which changes whenever the monster data (or the app itself) changes."""
+    global _CONTENT_VERSION
+    if not _CONTENT_VERSION:
+        version = importlib.metadata.version("dmtoolkit")
+        try:
+            stat = DEFAULT_MONSTERS_FILE.stat()
+            version += f"-{stat.st_mtime_ns}-{stat.st_size}"
+        except FileNotFoundError:
+            pass
+        _CONTENT_VERSION = version
+    return _CONTENT_VERSION
+
+
+def get_statblock_etag(monster_key: str) -> str:
+    """Returns the ETag for a monster's statblock. This only depends on the monster and the content
+    version, so every worker hands out the same ETag for the same statblock."""
+    tag = f"{monster_key}|{request.script_root}|{get_content_version()}"
+    return hashlib.sha1(tag.encode()).hexdigest()
+
+
+def get_cached_statblock(monster_key: str) -> tuple[str, str] | None:
+    """Returns the ETag and rendered statblock HTML for a monster, if it's cached."""
+    return STATBLOCKS.get((monster_key, request.script_root))
+
+
+def build_statblock(monster_key: str) -> tuple[str, str] | None:
+    """Renders a monster's statblock and caches it. Returns its ETag and HTML, or 'None' if there is
+    no monster with that key."""
+    monster = get_monster(monster_key)
+    if not monster:
+        return None
+    statblock = (get_statblock_etag(monster_key), render_template("statblock.jinja2", monster=monster))
+    STATBLOCKS[(monster_key, request.script_root)] = statblock
+    return statblock
+
+
+def render_statblock(monster_key: str) -> tuple[str, str] | None:
+    """Returns the ETag and rendered statblock HTML for a monster, rendering it only if it isn't
+    cached yet. Returns 'None' if there is no monster with that key."""
+    return get_cached_statblock(monster_key) or build_statblock(monster_key)
+
+
+def warm_statblock_cache(app: Flask, monster_keys: tuple[str, ...] = COMMON_MONSTERS) -> int:
+    """Pre-renders the statblocks of the given monsters. Returns the number of statblocks rendered."""
+    rendered = 0
+    with app.test_request_context("/"):
+        for monster_key in monster_keys:
+            try:
+                if render_statblock(monster_key):
+                    rendered += 1
+                else:
+                    log.warning(f"Unable to warm statblock for unknown monster '{monster_key}'")
+            except Exception as e:
+                log.warning(f"Unable to warm statblock cache: {e}")
+                break
+    return rendered
@@ -200,6 +200,31 @@ function addMonster(monsterId, params={}) {
     });
 }
 
+var suggestTimer = null;
+var suggestPrefix = '';
+
+function suggestMonsters(prefix) {
+    // Fill the monster picker with the monsters whose names start with the prefix. Waits until the
+    // user stops typing for a moment, so we don't send a request for every keystroke.
+    clearTimeout(suggestTimer);
+    suggestPrefix = prefix;
+    if (!prefix) { $('#monsterlist').empty(); return; }
+    suggestTimer = setTimeout(function() {
+        $.ajax({
+            url: `/api/monsters/suggest?prefix=${encodeURIComponent(prefix)}`,
+            method: 'GET',
+            success: function(response) {
+                // Ignore responses for anything but the latest prefix
+                if (prefix != suggestPrefix) { return; }
+                datalist = $('#monsterlist').empty();
+                $.parseJSON(response).forEach(function(monster) {
+                    datalist.append($('<option></option>').attr('value', monster.key).text(monster.name));
+                });
+            }
+        });
+    }, 150);
+}
+
 function togglePlayer(button, playerName="") {
     playerName = button.prev().text();
     if (button.text() == "Add Player") {
@@ -549,71 +574,142 @@ function updateAddPlayerButtons() {
     })
 }
 
-function listEncounters() {
-    // Fetches the encounter list from localStorage.
+// Shown until anything's been saved to the encounter library
+const DEFAULT_ENCOUNTERS = [
+    {
+        'name': 'Mines of Moria',
+        'description': 'The mines are home to goblins, and something worse...',
+        'monsters': [
+            {'id': 'Balor-MM', 'hasLoot': false},
+            {'id': 'Goblin-MM'},
+            {'id': 'Goblin-MM'},
+            {'id': 'Hobgoblin-MM'}
+        ]
+    },
+    {
+        'name': 'March on Isengard',
+        'description': 'The ents move against Saruman the White',
+        'monsters': [
+            {'id': 'Treant-MM', 'hasLoot': false},
+            {'id': 'Treant-MM', 'hasLoot': false},
+            {'id': 'Twig Blight-MM', 'hasLoot': false},
+            {'id': 'Twig Blight-MM', 'hasLoot': false},
+            {'id': 'Twig Blight-MM', 'hasLoot': false},
+            {'id': 'Archmage-MM'}
+        ]
+    }
+];
+
+// How many encounters the saved encounter list shows at a time
+const ENCOUNTER_PAGE_SIZE = 50;
+
+function migrateEncounters(callback) {
+    // Encounters used to be saved in localStorage; move any that are still there into the library.
     savedEncounters = localStorage.getItem('savedEncounters');
-    if (savedEncounters === null || Object.keys(JSON.parse(savedEncounters)).length == 0) {
-        console.info("No saved encounters found; adding defaults")
-        return {
-            'Mines of Moria': {
-                'monsters': [
-                    {'id': 'Balor-MM', 'hasLoot': false},
-                    {'id': 'Goblin-MM'},
-                    {'id': 'Goblin-MM'},
-                    {'id': 'Hobgoblin-MM'}
-                ],
-                'title': 'Mines of Moria',
-                'desc': 'The mines are home to goblins, and something worse...'
-            },
-            'March on Isengard': {
-                'monsters': [
-                    {'id': 'Treant-MM', 'hasLoot': false},
-                    {'id': 'Treant-MM', 'hasLoot': false},
-                    {'id': 'Twig Blight-MM', 'hasLoot': false},
-                    {'id': 'Twig Blight-MM', 'hasLoot': false},
-                    {'id': 'Twig Blight-MM', 'hasLoot': false},
-                    {'id': 'Archmage-MM'}
-                ],
-                'title': 'March on Isengard',
-                'desc': 'The ents move against Saruman the White'
-            }
-        }
+    if (savedEncounters === null) {
+        callback();
+        return;
     }
-    return JSON.parse(savedEncounters);
+    $.ajax({
+        url: '/api/encounters/library/import',
+        data: savedEncounters,
+        method: 'POST',
+        contentType: 'application/json',
+        success: function(response) {
+            console.log(`Moved ${$.parseJSON(response).imported} saved encounters into the encounter library.`);
+            localStorage.removeItem('savedEncounters');
+        },
+        complete: callback
+    });
 }
 
-function updateEncounters(encounters) {
-    // Updates the encounter list saved in localStorage.
-    localStorage.setItem('savedEncounters', JSON.stringify(encounters));
+function refreshEncounters(page = 1) {
+    // Shows the first page of the encounter library (or of the encounters matching the search),
+    // and adds each page after that to the end of the list. While the library is empty, the
+    // default encounters are shown instead.
+    query = $('input#encounter-search').val() || '';
+    $.ajax({
+        url: query ? '/api/encounters/library/search' : '/api/encounters/library',
+        data: {q: query, page: page, per_page: ENCOUNTER_PAGE_SIZE},
+        method: 'GET',
+        success: function(response) {
+            response = $.parseJSON(response);
+            console.log(`Found ${response.total} saved encounters.`);
+            if (page == 1) {
+                $('.saved-encounter-list').empty();
+            }
+            $('.saved-encounter-list .more-encounters').remove();
+            encounters = response.encounters;
+            if (response.total == 0 && !query) {
+                encounters = DEFAULT_ENCOUNTERS;
+            }
+            $.each(encounters, function(_, enc) {
+                item = $('<div class="saved-encounter-list-item"></div>');
+                item.data("encounter", enc);
+                item.data("id", enc.id);
+                item.dblclick(function() { loadEncounter(this); });
+                item.append($('<div></div>').text(enc.name));
+                item.append($('<div></div>').text(enc.description));
+                if (enc.id !== undefined) {
+                    closeButton = ($(`<div class="w3-button w3-ripple">&times</div>`));
+                    closeButton.click(function(event) {
+                        deleteEncounter(event);
+                    })
+                    item.append(closeButton);
+                }
+                $('.saved-encounter-list').append(item);
+            });
+            if (response.total > page * ENCOUNTER_PAGE_SIZE) {
+                more = $('<div class="more-encounters w3-button w3-block">More...</div>');
+                more.click(function() { refreshEncounters(page + 1); });
+                $('.saved-encounter-list').append(more);
+            }
+        }
+    });
 }
 
-function refreshEncounters() {
-    // Get encounter info
-    encounters = listEncounters();
-
-    numEncounters = Object.keys(encounters).length;
-    console.log(`Found ${numEncounters} saved encounters in localStorage.`);
-    if (numEncounters > 0) {
-        // Remove default encounters
-        $('.saved-encounter-list').empty();
-    } else {
-        console.log('No encounters loaded; using default placeholders.')
-    }
+function importEncounters(input) {
+    // Uploads a JSON file of encounters (an export, or a list of encounters) into the library.
+    data = new FormData();
+    data.append('file', input.files[0]);
+    $.ajax({
+        url: '/api/encounters/library/import',
+        data: data,
+        method: 'POST',
+        processData: false,
+        contentType: false,
+        success: function(response) {
+            console.log(`Imported ${$.parseJSON(response).imported} encounters.`);
+            refreshEncounters();
+        },
+        error: function(xhr) {
+            alert($.parseJSON(xhr.responseText).message);
+        },
+        complete: function() { $(input).val(''); }
+    });
+}
 
-    $.each(encounters, function(eid, enc) {
-        item = $('<div class="saved-encounter-list-item"></div>');
-        item.data("monsters", enc.monsters);
-        item.data("encounter", enc);
-        item.data("id", eid);
-        item.dblclick(function() { loadEncounter(this); });
-        item.append($(`<div>${enc.title}</div>`));
-        item.append($(`<div>${enc.desc}<div>`));
-        closeButton = ($(`<div class="w3-button w3-ripple">&times</div>`));
-        closeButton.click(function(event) {
-            deleteEncounter(event);
-        })
-        item.append(closeButton);
-        $('.saved-encounter-list').append(item);
+function switchLibrary() {
+    // Shows the key to the encounter library, and opens another library if a different key is pasted in
+    $.get('/api/encounters/library/key', function(response) {
+        current = $.parseJSON(response).library_id;
+        key = prompt("Your encounter library's key. Paste it here in another browser to open the same library.", current);
+        if (!key || key.trim() == current) {
+            return;
+        }
+        $.ajax({
+            url: '/api/encounters/library/key',
+            data: JSON.stringify({library_id: key}),
+            method: 'POST',
+            contentType: 'application/json',
+            success: function(response) {
+                console.log(`Opened a library of ${$.parseJSON(response).total} encounters.`);
+                refreshEncounters();
+            },
+            error: function(xhr) {
+                alert($.parseJSON(xhr.responseText).message);
+            }
+        });
     });
 }
 
@@ -624,16 +720,32 @@ function deleteEncounter(event) {
         encounterItem = self.closest(".saved-encounter-list-item");
     }
     encounterId = $(encounterItem).data("id");
-    console.log($(encounterItem).data("encounter"));
     console.log(`Removing encounter '${encounterId}'`);
 
-    savedEncounters = listEncounters();
-    delete savedEncounters[encounterId];
-    updateEncounters(savedEncounters);
-    refreshEncounters();
+    $.ajax({
+        url: `/api/encounters/library/${encounterId}`,
+        method: 'DELETE',
+        success: function() { refreshEncounters(); }
+    });
 }
 
 function loadEncounter(encounterItem) {
+    // The list only has summaries of saved encounters, so fetch the monsters first
+    encounter = $(encounterItem).data("encounter");
+    if (encounter.monsters !== undefined) {
+        showEncounter(encounterItem, encounter.monsters);
+        return;
+    }
+    $.ajax({
+        url: `/api/encounters/library/${encounter.id}`,
+        method: 'GET',
+        success: function(response) {
+            showEncounter(encounterItem, $.parseJSON(response).monsters);
+        }
+    });
+}
+
+function showEncounter(encounterItem, monsters) {
     // Clear current encounter
     tbody = $("#turntracker").children().eq(0);
     tbody.children().each(function() {
@@ -644,7 +756,7 @@ function loadEncounter(encounterItem) {
     });
 
     // Add rows for new creatures
-    $($(encounterItem).data("monsters")).each(function (_, monster) {
+    $(monsters).each(function (_, monster) {
         addMonster(monster.id, monster);
     })
 
@@ -678,27 +790,25 @@ function saveEncounter() {
     })
 
     encounter = {
-        "title": encounterTitle,
-        "desc": encounterDesc,
+        "name": encounterTitle,
+        "description": encounterDesc,
         "monsters": monsters
     }
 
-    // Update Encounter List
-    encounters = listEncounters();
-    numEncounters = Object.keys(encounters).length;
-
-    encounterId = encounterTitle;
-    encounters[encounterId] = encounter;
-    updateEncounters(encounters);
-
-    if (Object.keys(encounters).length == numEncounters) {
-        console.log(`Updated encounter: '${encounterId}'`);
-    } else {
-        console.log(`Saved new encounter: '${encounterId}'`);
-    }
-
-    // Refresh encounter list UI
-    refreshEncounters();
+    // Saving an encounter with the same name as another replaces it
+    $.ajax({
+        url: '/api/encounters/library',
+        data: JSON.stringify(encounter),
+        method: 'POST',
+        contentType: 'application/json',
+        success: function(response) {
+            console.log(`Saved encounter: '${encounterTitle}'`);
+            refreshEncounters();
+        },
+        error: function(xhr) {
+            alert($.parseJSON(xhr.responseText).message);
+        }
+    });
 }
 
 function showTooltip(event) {
@@ -776,6 +886,17 @@ function updateMobSize(tr, size) {
     // TODO: implement a function to SET hp from outside the hpbox input, then use that here
     updateHP(tr, Math.ceil(hp_frac * max_hp * size));
 
+    // Every monster in the mob drops its own loot; roll it all in one request
+    $.ajax({
+        url: '/api/encounters/loot',
+        data: JSON.stringify({monsters: [{key: tr.data('id'), count: size}]}),
+        method: 'POST',
+        contentType: 'application/json',
+        success: function(response) {
+            tr.data('loot', $.parseJSON(response));
+            refreshLoot();
+        }
+    });
 }
 
 function updateMobSizeRemaining(tr) {
@@ -0,0 +1,177 @@
+"""
+Live updates for tracker sessions, pushed to every subscribed client as Server-Sent Events, so (say)
+the DM's laptop and the player view cast to a TV stay in sync without polling.
+
+Each session with subscribers has a channel, which is woken up whenever the session changes.
+Subscribers don't send one event per change: once woken, a subscriber waits BATCH_WINDOW for more
+changes to pile up, then sends everything since the version it last sent as a single event. Events
+are cached on the channel by the version they start from, so however many subscribers are at the
+same version, each event is only built and encoded once.
+
+Events:
+
+    event: state      the whole session (the first event, unless resuming)
+    event: changes    {"version": ..., "changes": [...]}, see dmtoolkit/inittracker/sessions.py
+    event: closed     the session was deleted
+
+plus a comment every HEARTBEAT seconds, so proxies don't close idle connections. Each event's id is
+the session's version, so browsers resume where they left off after reconnecting (EventSource sends
+it back as Last-Event-ID).
+
+Every subscriber holds a thread for as long as it's connected (see `threads` in gunicorn.conf.py),
+so each process only takes so many of them (TRACKER_MAX_SUBSCRIBERS) and turns the rest away.
+Channels live in the process. With the redis session store, every process hears about every change
+(see `TrackerStore.listen`), so a session's clients can be spread across workers.
+"""
+from __future__ import annotations
+
+from collections.abc import Iterator
+import json
+from threading import Condition, Lock
+import time
+from typing import Any, Optional
+
+from dmtoolkit.inittracker import sessions
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+# How long to wait for more changes before sending them, in seconds
+BATCH_WINDOW = 0.05
+
+# How often to send something down idle connections, in seconds
+HEARTBEAT = 15.0
+
+# Most subscribers a process takes at once, across all sessions
+MAX_SUBSCRIBERS = 32
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class _Channel:
+    def __init__(self):
+        self.condition = Condition()
+        self.version = 0
+        self.closed = False
+        self.subscribers = 0
+        # Version the event starts from -> (version it brings the client to, encoded event)
+        self.events: dict[Optional[int], tuple[int, Optional[str]]] = {}
+
+
+_CHANNELS: dict[str, _Channel] = {}
+_CHANNELS_LOCK = Lock()
+_SUBSCRIBERS = 0
+
+
+def _publish(session_id: str, version: Optional[int]):
+    if (channel := _CHANNELS.get(session_id)) is None:
+        return # Nobody's listening
+    with channel.condition:
+        if version is None:
+            channel.closed = True
+        else:
+            channel.version = max(channel.version, version)
+        channel.events.clear()
+        channel.condition.notify_all()
+
+
+sessions.add_listener(_publish)
+
+
+def subscriber_count(session_id: str) -> int:
+    channel = _CHANNELS.get(session_id)
+    return channel.subscribers if channel else 0
+
+
+def _format(event: str, version: Optional[int], data: Any) -> str:
+    lines = [f"event: {event}"]
+    if version is not None:
+        lines.append(f"id: {version}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _join(session_id: str, max_subscribers: int) -> _Channel:
+    global _SUBSCRIBERS
+    sessions.get_tracker_store().listen()
+    with _CHANNELS_LOCK:
+        if _SUBSCRIBERS >= max_subscribers:
+            raise TooManySubscribers(f"This server is already streaming to {_SUBSCRIBERS} clients")
+        if (channel := _CHANNELS.get(session_id)) is None:
+            channel = _CHANNELS[session_id] = _Channel()
+        channel.subscribers += 1
+        _SUBSCRIBERS += 1
+    # Only read the version once the channel exists, so no change can slip by unannounced
+    if (session := sessions.get_session(session_id)) is not None:
+        with channel.condition:
+            channel.version = max(channel.version, session.version)
+    return channel
+
+
+def _leave(session_id: str, channel: _Channel):
+    global _SUBSCRIBERS
+    with _CHANNELS_LOCK:
+        channel.subscribers -= 1
+        _SUBSCRIBERS -= 1
+        if not channel.subscribers and _CHANNELS.get(session_id) is channel:
+            del _CHANNELS[session_id]
+
+
+def _build_event(session_id: str, channel: _Channel, since: Optional[int]) -> Optional[tuple[int, Optional[str]]]:
+    """Returns the version a client at version 'since' catches up to, and the event which gets it
+    there ('None' if it's already there). Returns 'None' if the session is gone."""
+    with channel.condition:
+        cached = channel.events.get(since)
+        if cached is not None and cached[0] == channel.version:
+            return cached
+    store = sessions.get_tracker_store()
+    with store.lock(session_id):
+        if (session := store.get(session_id)) is None:
+            return None
+        version = session.version
+        changes = session.changes_since(since) if since is not None else None
+        if changes is None:
+            event = _format("state", version, session.to_dict())
+        else:
+            event = _format("changes", version, {"version": version, "changes": changes}) if changes else None
+    with channel.condition:
+        channel.events[since] = (version, event)
+    return version, event
+
+
+def subscribe(session_id: str, since: Optional[int] = None, batch_window: float = BATCH_WINDOW,
+              heartbeat: float = HEARTBEAT, max_subscribers: int = MAX_SUBSCRIBERS) -> Iterator[str]:
+    """Yields a session's Server-Sent Events until it's deleted (or the client goes away, and the
+    generator is closed). Starts with the whole state, unless 'since' is a version it can catch
+    up from. Raises TooManySubscribers (when first advanced) if the process already has
+    'max_subscribers'."""
+    channel = _join(session_id, max_subscribers)
+    try:
+        if (built := _build_event(session_id, channel, since)) is None:
+            yield _format("closed", None, {})
+            return
+        last, event = built
+        if event:
+            yield event
+        while True:
+            with channel.condition:
+                woken = channel.condition.wait_for(lambda: channel.closed or channel.version > last, heartbeat)
+                closed = channel.closed
+            if closed:
+                yield _format("closed", None, {})
+                return
+            if not woken:
+                yield ": keep-alive\n\n"
+                continue
+            if batch_window:
+                time.sleep(batch_window)
+            if (built := _build_event(session_id, channel, last)) is None:
+                yield _format("closed", None, {})
+                return
+            last, event = built
+            if event:
+                yield event
+    finally:
+        _leave(session_id, channel)
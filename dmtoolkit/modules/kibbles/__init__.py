@@ -1,7 +1,7 @@
 """Modules for Kibble's Crafting Guide"""
 
 from dmtoolkit.modules.models import Module
-from dmtoolkit.modules.kibbles.loot import loot as generate_loot
+from dmtoolkit.modules.kibbles.loot import loot as generate_loot, loot_many as generate_loot_many
 
 kcg_module = Module(
     module_id = "kcg",
@@ -12,6 +12,6 @@ kcg_module = Module(
     "weapons and armour, to finely cooked meals. Enabling this module will override the default "
     "encounter loot tables to drop crafting materials instead."
 )
-kcg_module.register_loot_generator(generate_loot)
+kcg_module.register_loot_generator(generate_loot, generate_loot_many)
 kcg_module.register_nav_page("Gathering", "kibbles.gathering")
 kcg_module.register_nav_page("Crafting", "kibbles.crafting_view")
\ No newline at end of file
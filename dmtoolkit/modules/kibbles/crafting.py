@@ -3,13 +3,13 @@ from __future__ import annotations
 from collections import defaultdict
 from dataclasses import dataclass
 from enum import StrEnum, auto
-import json
 from pathlib import Path
 from types import MappingProxyType
 from typing import Any
 
 from dmtoolkit.modules.kibbles.loot import ItemWrapper
 from dmtoolkit.api.items import Item, get_item
+from dmtoolkit.api.snapshot import load_data_file
 
 _RECIPES: dict[Item, list[Recipe]] = defaultdict(list)
 
@@ -79,9 +79,8 @@ def list_recipes() -> MappingProxyType[Item, list[Recipe]]:
     """Get a mapping of all recipes to their resulting item."""
     # Lazy-Load all recipes
     if not _RECIPES:
-        with (Path(__file__).parent / "recipes.json").open("r") as f:
-            for recipe in json.load(f):
-                Recipe.from_spec(recipe)
+        for recipe in load_data_file(Path(__file__).parent / "recipes.json"):
+            Recipe.from_spec(recipe)
     return MappingProxyType(_RECIPES)
 
 
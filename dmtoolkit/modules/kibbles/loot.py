@@ -1,16 +1,17 @@
 """Looting logic for Kibble's Crafting Guide."""
 from __future__ import annotations
 
+from bisect import bisect_right
 from collections import defaultdict
+from collections.abc import Iterable
 import csv
 from dataclasses import dataclass
 from enum import StrEnum
 from pathlib import Path
-from random import randint, choice
+from random import randint, choice, choices
 from typing import Any
 
-from d20 import roll
-
+from dmtoolkit import dice
 from dmtoolkit.api.models import Monster, Item, KibblesIngredient
 from dmtoolkit.api.items import get_item, list_items
 from dmtoolkit.util import get_logger
@@ -35,11 +36,15 @@ class Locales(StrEnum):
 class RangeDict:
     """Really quick way to represent non-overlapping ranges."""
     def __init__(self, spec: list[tuple[Any, Any, Any]]):
-        self.spec = spec
+        self.spec = sorted(spec, key=lambda row: row[0])
+        self._lbounds = [lbound for lbound, _, _ in self.spec]
     
     def __getitem__(self, index: Any) -> Any:
-        for lbound, rbound, item in self.spec:
-            if lbound <= index <= rbound:
+        # The only range that can hold the index is the last one starting at or before it
+        i = bisect_right(self._lbounds, index) - 1
+        if i >= 0:
+            _, rbound, item = self.spec[i]
+            if index <= rbound:
                 return item
         raise IndexError
 
@@ -52,7 +57,7 @@ class ItemSlot:
 def _resolve(value: int | str) -> int:
     """If 'value' is a dice expression, resolves it, otherwise returns the integer."""
     if isinstance(value, str):
-        return roll(value).total
+        return dice.roll(value)
     else:
         return value
 
@@ -73,25 +78,30 @@ def gather(locale: Locales) -> LootResponse:
 
 def loot(monster: Monster) -> LootResponse:
     """Top-level looting function. Call this on any arbitrary Monster."""
+    return loot_many(monster, 1)[0]
+
+
+def loot_many(monster: Monster, count: int) -> list[LootResponse]:
+    """Loots 'count' of the same monster (like a mob), rolling its table for all of them at once.
+    Returns the loot of each one."""
     match monster.maintype.lower():
         case "aberration" | "beast" | "dragon" | "giant" | "monstrosity" | "plant":
-            return loot_harvest(monster)
+            return loot_harvest(monster, count)
         case "elemental" | "celestial" | "fiend":
-            return loot_remnants(monster)
+            return loot_remnants(monster, count)
         case "undead":
             # Undead either leave remnants (if they are incorporeal) or regular harvestable items
             if any("incorporeal" in entry.title.lower() for entry in monster.traits or []):
-                return loot_remnants(monster)
+                return loot_remnants(monster, count)
             else:
-                return loot_harvest(monster)
+                return loot_harvest(monster, count)
         case "humanoid":
-            return loot_humanoid(monster)
+            return loot_humanoid(monster, count)
         case _:
-            return LootResponse([], loot_coinage(monster))
+            return [LootResponse([], loot_coinage(monster)) for _ in range(count)]
 
 
-
-def loot_harvest(monster: Monster) -> LootResponse:
+def loot_harvest(monster: Monster, count: int = 1) -> list[LootResponse]:
     table: LootTable = {
         "aberration": aberration_loot_tables,
         "dragon": dragon_giant_monstrosity_loot_tables,
@@ -116,17 +126,17 @@ def loot_harvest(monster: Monster) -> LootResponse:
         "construct": "Intelligence (Arcana)"
     }.get(monster.maintype, "Wisdom (Medicine)")
 
-    # Roll Table
-    results = table.roll()
-
     note = f"requires DC {dc} {skill} check and takes 10 minutes"
-    coinage = sum([item.value for item, _ in results if isinstance(item, Coinage)])
-    items = [ItemWrapper(item, quantity) for item, quantity in results if not isinstance(item, Coinage)]
-
-    return LootResponse(items, coinage, note)
+    responses = []
+    # Roll Table
+    for results in table.roll_many(count):
+        coinage = sum([item.value for item, _ in results if isinstance(item, Coinage)])
+        items = [ItemWrapper(item, quantity) for item, quantity in results if not isinstance(item, Coinage)]
+        responses.append(LootResponse(items, coinage, note))
+    return responses
 
 
-def loot_remnants(monster: Monster):
+def loot_remnants(monster: Monster, count: int = 1) -> list[LootResponse]:
     table: LootTable = {
         "celestial": celestial_loot_tables,
         "fiend": fiend_loot_tables,
@@ -134,18 +144,20 @@ def loot_remnants(monster: Monster):
         "undead": incorporeal_undead_loot_tables
     }[monster.maintype][monster.cr_num]
 
-    results = table.roll()
-
-    return LootResponse([ItemWrapper(item, quantity) for item, quantity in results], 0, "Takes 1 minute")
+    return [
+        LootResponse([ItemWrapper(item, quantity) for item, quantity in results], 0, "Takes 1 minute")
+        for results in table.roll_many(count)
+    ]
 
 
-def loot_humanoid(monster: Monster) -> LootResponse:
+def loot_humanoid(monster: Monster, count: int = 1) -> list[LootResponse]:
     loot_table = humanoid_loot_tables[monster.cr_num]
-    results = loot_table.roll()
-
-    items = [ItemWrapper(item, quantity) for item, quantity in results]
-    coinage = sum([item.value for item, _ in results if isinstance(item, Coinage)])
-    return LootResponse(items, coinage)
+    responses = []
+    for results in loot_table.roll_many(count):
+        items = [ItemWrapper(item, quantity) for item, quantity in results]
+        coinage = sum([item.value for item, _ in results if isinstance(item, Coinage)])
+        responses.append(LootResponse(items, coinage))
+    return responses
 
 
 def loot_coinage(monster: Monster) -> int:
@@ -154,18 +166,24 @@ def loot_coinage(monster: Monster) -> int:
     return monster.xp * 100
 
 
+def load_gathering_variants():
+    """Groups the Kibbles ingredients by the locale they can be found in, their rarity, and their
+    properties."""
+    gathering_variants.clear()
+    for item in list_items():
+        if not isinstance(item, KibblesIngredient):
+            continue
+        for locale_name in item.locales:
+            for property in item.properties:
+                gathering_variants[Locales(locale_name)][item.rarity][property].append(item)
+
+
 def get_gathering_variant(locale: Locales, item: Item) -> Item:
     """Given a generic item (like 'Common Reactive Reagent') and a locale, returns a variant Item
     specific to the locale itself."""
-    global gathering_variants
     # Lazy-load variants
     if not gathering_variants:
-        for item in list_items():
-            if not isinstance(item, KibblesIngredient):
-                continue
-            for locale_name in item.locales:
-                for property in item.properties:
-                    gathering_variants[Locales(locale_name)][item.rarity][property].append(item)
+        load_gathering_variants()
     
     # Fetch random replacement
     if item.properties:
@@ -184,8 +202,8 @@ class LootItem:
         self.item = item
         self.quantity = quantity
     
-    def __call__(self,) -> tuple[Item, int]:
-        quantity = _resolve(self.quantity)
+    def resolve(self) -> Item:
+        """Returns the item, looking it up first if it was given by ID."""
         if isinstance(self.item, str):
             if "|" not in self.item:
                 self.item += "|kcg" # Look for kibbles items by default, over other modules
@@ -194,7 +212,10 @@ class LootItem:
                 raise KeyError(f"Unknown item: {self.item}")
             else:
                 self.item = item
-        return (self.item, quantity)
+        return self.item
+
+    def __call__(self,) -> tuple[Item, int]:
+        return (self.resolve(), _resolve(self.quantity))
 
 
 class Coinage(Item):
@@ -255,15 +276,36 @@ class LootCoins(LootItem):
         ), 1)
 
 
+def _merge_results(results: Iterable[tuple[Item, int]]) -> list[tuple[Item, int]]:
+    """If several rows give the same item, returns it once with their quantities added up. Coins
+    are added up into a single Coinage."""
+    merged: dict[str, tuple[Item, int]] = {}
+    for item, quantity in results:
+        key = item.id()
+        if (previous := merged.get(key)) is None:
+            merged[key] = (item, quantity)
+        elif isinstance(item, Coinage):
+            merged[key] = (previous[0] + item, 1)
+        else:
+            merged[key] = (item, previous[1] + quantity)
+    return list(merged.values())
+
+
 class LootTable:
     """Represents a table which can be rolled from, like the ones found in various D&D source
     books. Each row has a range, and if the value randomly determined from the dice falls within 
     that range, the row is returned. This class supports returning multiple rows, (i.e. allows rows
-    to have overlapping ranges) if you want that for some reason."""
+    to have overlapping ranges) if you want that for some reason.
+
+    Before its first roll, the table is compiled into a lookup of what each number on the die
+    returns (see `compile`), so rolling never has to scan the rows."""
 
     def __init__(self, size: int):
         self.rows: list[tuple[int, int, LootItem]] = []
         self.size = size
+        # For each number on the die (index 0 is 1): the rows it returns, and if none of those are
+        #   random, the results themselves
+        self._faces: list[tuple[tuple[LootItem, ...], list[tuple[Item, int]] | None]] | None = None
     
     def add_row(self, min: int, max: int, row: LootItem):
         """Add a new row to the table."""
@@ -272,21 +314,46 @@ class LootTable:
         if max > self.size:
             raise ValueError(f"'max' cannot exceed '{self.size}' for this table; got '{max}'.")
         self.rows.append((min, max, row))
-    
+        self._faces = None
+
+    def compile(self):
+        """Looks up the items of every row, and works out which rows each number on the die returns.
+        Numbers whose rows only have fixed quantities (and no coins) always return the same thing,
+        so their results are worked out here once. Raises a KeyError if a row's item doesn't exist."""
+        faces = []
+        compiled: dict[tuple[int, ...], tuple[tuple[LootItem, ...], list[tuple[Item, int]] | None]] = {}
+        for x in range(1, self.size + 1):
+            key = tuple(i for i, (xmin, xmax, _) in enumerate(self.rows) if xmin <= x <= xmax)
+            if (face := compiled.get(key)) is None:
+                rows = tuple(self.rows[i][2] for i in key)
+                fixed = None
+                if all(type(row) is LootItem and isinstance(row.quantity, int) for row in rows):
+                    fixed = _merge_results((row.resolve(), row.quantity) for row in rows)
+                else:
+                    for row in rows:
+                        if type(row) is LootItem:
+                            row.resolve()
+                face = compiled[key] = (rows, fixed)
+            faces.append(face)
+        self._faces = faces
+
+    def _roll_face(self, face: tuple[tuple[LootItem, ...], list[tuple[Item, int]] | None]) -> list[tuple[Item, int]]:
+        rows, fixed = face
+        if fixed is not None:
+            return list(fixed)
+        return _merge_results(row() for row in rows)
+
     def roll(self) -> list[tuple[Item, int]]:
         """Return a list of items (and their quantites) chosen randomly from the table."""
-        x = randint(1, self.size)
-        # We collect items in a default dict, so that if two rows have the same items, the output
-        #   is one row for that item with their combined quantities.
-        itemdict: dict[str, int] = defaultdict(lambda: 0)
-        items: dict[str, Item] = {}
-        # We are not doing this efficiently, but it should be fine
-        for xmin, xmax, lootitem in self.rows:
-            if xmin <= x <= xmax:
-                item, quantity = lootitem()
-                itemdict[item.id()] += quantity
-                items[item.id()] = item
-        return [(items[item], quantity) for item, quantity in itemdict.items()]
+        if self._faces is None:
+            self.compile()
+        return self._roll_face(self._faces[randint(1, self.size) - 1])
+
+    def roll_many(self, n: int) -> list[list[tuple[Item, int]]]:
+        """Rolls on the table 'n' times. Returns the results of each roll, like 'roll' does."""
+        if self._faces is None:
+            self.compile()
+        return [self._roll_face(face) for face in choices(self._faces, k=n)]
 
     @staticmethod
     def load_from_csv(fname: Path) -> LootTable:
@@ -385,4 +452,17 @@ incorporeal_undead_loot_tables = RangeDict([
 ])
 
 gathering_tables = {enum: LootTable.load_from_csv(LOOT_TABLE_DIR / f"gathering_{enum}.csv") for enum in Locales}
-gathering_variants: dict[str, dict[str, dict[str, list[Item]]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
\ No newline at end of file
+gathering_variants: dict[str, dict[str, dict[str, list[Item]]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+
+
+def compile_loot_tables():
+    """Compiles every loot table ahead of its first roll."""
+    for tables in (
+        humanoid_loot_tables, dragon_giant_monstrosity_loot_tables, construct_loot_tables,
+        aberration_loot_tables, undead_loot_tables, plant_loot_tables, celestial_loot_tables,
+        fiend_loot_tables, elemental_loot_tables, incorporeal_undead_loot_tables,
+    ):
+        for _, _, table in tables.spec:
+            table.compile()
+    for table in gathering_tables.values():
+        table.compile()
\ No newline at end of file
@@ -20,15 +20,12 @@ class LootResponse:
         for x in (self.items, other.items):
             for item_wrapper in x:
                 key = (item_wrapper.item, item_wrapper.note)
-                if items[key]:
-                    items[key] += item_wrapper.quantity
-                else:
-                    items[key] = item_wrapper.quantity
+                items[key] = items.get(key, 0) + item_wrapper.quantity
         # Turn back into list
         items_list = [ItemWrapper(key[0], val, key[1]) for key, val in items.items()]
 
         # Make new note
-        if self.note and other.note:
+        if self.note and other.note and self.note != other.note:
             note = f"{self.note}\n\n{other.note}"
         else:
             note = self.note or other.note or ""
@@ -57,10 +54,17 @@ class Module:
         self.main_routes: MappingProxyType[str, str] = MappingProxyType(self._main_routes)
         
         self.generate_loot: Optional[Callable[[Monster], LootResponse]] = None
+        self.generate_loot_many: Optional[Callable[[Monster, int], list[LootResponse]]] = None
     
 
-    def register_loot_generator(self, func: Callable[[Monster], LootResponse]) -> None:
+    def register_loot_generator(
+            self,
+            func: Callable[[Monster], LootResponse],
+            many: Optional[Callable[[Monster, int], list[LootResponse]]] = None) -> None:
+        """Registers the function which loots a monster. 'many', if given, loots a number of the
+        same monster at once, and returns the loot of each one."""
         self.generate_loot = func
+        self.generate_loot_many = many
     
     def register_nav_page(self, title: str, flask_route_name: str) -> None:
         """Registers a page that should be visible in the top navbar. The name passed should be
@@ -7,8 +7,6 @@ from flask import current_app as app
 from dmtoolkit.modules.models import Module
 from dmtoolkit.modules.kibbles import kcg_module
 
-from dmtoolkit.settings.api import get_active_modules
-
 _MODULES: dict[str, Module] = {}
 
 def get_modules() -> MappingProxyType[str, Module]:
@@ -16,13 +14,8 @@ def get_modules() -> MappingProxyType[str, Module]:
 
 
 def get_main_routes() -> MappingProxyType[str, str]:
-    main_routes = {}
-    for module_name in get_active_modules():
-        if module := _MODULES.get(module_name):
-            for title, route in module.main_routes.items():
-                main_routes[title] = route
-    
-    return MappingProxyType(main_routes)
+    from dmtoolkit.context import get_request_state
+    return get_request_state().main_routes
 
 
 def flatten_modules(module_names: list[str]) -> Module:
@@ -36,7 +29,7 @@ def flatten_modules(module_names: list[str]) -> Module:
             app.logger.warning("Unable to find module with name %s", module_name)
             continue
         if _module.generate_loot and not module.generate_loot:
-            module.register_loot_generator(_module.generate_loot)
+            module.register_loot_generator(_module.generate_loot, _module.generate_loot_many)
     
     return module
 
@@ -45,10 +38,5 @@ def register_module(module: Module):
     if not _MODULES:
         _MODULES[module.module_id] = module
 
-# Make 'get_main_routes' callable from within jinja template
-if app:
-    app.jinja_env.globals.update(get_main_routes=get_main_routes)
-
-
 # REGISTER MODULES
 register_module(kcg_module)
\ No newline at end of file
@@ -1,7 +1,7 @@
 from dataclasses import asdict
 import json
 
-from flask import Blueprint, render_template, redirect, url_for, make_response
+from flask import Blueprint, render_template, redirect, url_for
 from flask_wtf import FlaskForm
 from wtforms import SelectField, StringField, IntegerField, SubmitField
 from wtforms.validators import InputRequired, NumberRange, ValidationError
@@ -25,13 +25,19 @@ class CreateForm(FlaskForm):
     ac = IntegerField("AC", [InputRequired(), NumberRange(min=0)], render_kw={"class": "w3-input w3-border"})
     hp = IntegerField("Max HP", [InputRequired(), NumberRange(min=1, message="No!")], render_kw={"class": "w3-input w3-border"})
     pp = IntegerField("Passive Perception", [InputRequired(), NumberRange(min=0)], render_kw={"class": "w3-input w3-border"})
-    race = SelectField("Race", choices=list_races(), render_kw={"class": "w3-input"})
-    class_ = SelectField("Class", choices=[(c.name, c.name) for c in list_classes()], render_kw={"class": "w3-input"})
+    race = SelectField("Race", choices=[], render_kw={"class": "w3-input"})
+    class_ = SelectField("Class", choices=[], render_kw={"class": "w3-input"})
     level = IntegerField("Player Level", [InputRequired(), NumberRange(min=1)], render_kw={"class": "w3-input w3-border"})
     subclass = SelectField("Subclass", choices=[], validate_choice=False, render_kw={"class": "w3-input"})
     tags = TagField("Tags", whitelist=["foo", "bar"])
     submit = SubmitField("Create Player Character", render_kw={"class": "w3-button w3-blue w3-ripple"})
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Filled in here rather than on the fields, so the races and classes aren't loaded on import
+        self.race.choices = list_races()
+        self.class_.choices = [(c.name, c.name) for c in list_classes()]
+
     def validate_name(self, field):
         players = api.list_players()
         if any(field.data == p.name for p in players):
@@ -78,9 +84,8 @@ def new_player_page():
             "subclass_id": form.subclass.data or "",
             "tags": [x.get("value") for x in json.loads(form.tags.data or "[]")]
         }
-        resp = make_response(redirect(url_for("players_bp.list_players_page")))
-        api.create_player(resp, player)
-        return resp
+        api.create_player(player)
+        return redirect(url_for("players_bp.list_players_page"))
     
     page = {
         "title": "DMTools - New Player"
@@ -133,9 +138,8 @@ def update_player_page(player_name: str):
         players[idx] = new_player
         print(new_player)
 
-        resp = make_response(redirect(url_for("players_bp.list_players_page")))
-        api._save_players(resp, players)
-        return resp
+        api.save_players(players)
+        return redirect(url_for("players_bp.list_players_page"))
 
     form.class_.data = player.class_id
     form.race.data = player.race_id
@@ -160,6 +164,5 @@ def update_player_page(player_name: str):
 
 @players_bp.route("/delete/<player_name>", methods=["GET"])
 def delete_player(player_name: str):
-    resp = make_response(redirect(url_for("players_bp.list_players_page")))
-    api.delete_player(resp, player_name)
-    return resp
+    api.delete_player(player_name)
+    return redirect(url_for("players_bp.list_players_page"))
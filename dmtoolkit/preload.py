@@ -0,0 +1,77 @@
+"""
+Loads all of the compendium data up front. When gunicorn is run with `preload_app` (see
+gunicorn.conf.py), this happens once in the master process, before any workers are forked. The
+workers then share the loaded data with the master through copy-on-write memory, instead of each
+of them loading (and holding) their own copy.
+
+Python's garbage collector writes to every object it tracks whenever it runs, which would copy those
+shared pages into each worker anyway. To avoid that, the master calls gc.freeze() right before
+forking, which moves everything loaded so far into a generation the collector never scans.
+
+Data which is served from an up-to-date compendium pack or database (see dmtoolkit.api.compendium_pack
+and dmtoolkit.api.compendium_db) isn't preloaded, along with the caches built from it; keeping it out
+of memory is the point of both.
+"""
+import gc
+import time
+
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+_PRELOADED = False
+
+
+def is_preloaded() -> bool:
+    return _PRELOADED
+
+
+def preload_compendium() -> dict[str, float]:
+    """Loads every domain of compendium data, along with the caches built from them on first use.
+    Returns how long each one took to load, in seconds."""
+    global _PRELOADED
+    # Importing these creates their registries
+    from dmtoolkit.api import classes, conditions, items, monsters, races, serialize, spells
+    from dmtoolkit.api.compendium_db import REGISTRY_KINDS
+    from dmtoolkit.api.compendium_pack import get_compendium_store
+    from dmtoolkit.api.registry import REGISTRIES
+    from dmtoolkit import search
+    from dmtoolkit.filters import Macro5e
+    from dmtoolkit.modules.kibbles import crafting, loot
+
+    loaders = {
+        **{name: registry.load for name, registry in REGISTRIES.items()},
+        "recipes": crafting.list_recipes,
+        "gathering_variants": loot.load_gathering_variants,
+        "loot_tables": loot.compile_loot_tables,
+        "models": serialize._get_models,
+        "macros": Macro5e._get_macros,
+        "search": search.get_index,
+        "monster_index": monsters.get_monster_index,
+    }
+    if skipped := {name for name, kind in REGISTRY_KINDS.items() if get_compendium_store(kind)}:
+        # These would load every item, spell or monster again
+        skipped |= {"search", "monster_index", "monster_suggestions", "gathering_variants"}
+        log.info(f"Not preloading {', '.join(sorted(skipped))}, since they're served from the compendium pack or database")
+        loaders = {name: loader for name, loader in loaders.items() if name not in skipped}
+    timings: dict[str, float] = {}
+    for name, loader in loaders.items():
+        start = time.perf_counter()
+        try:
+            loader()
+        except FileNotFoundError as e:
+            log.warning(f"Unable to preload {name}: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+
+    # Clean up any garbage from loading now, so it isn't frozen along with the data
+    gc.collect()
+    _PRELOADED = True
+    log.info(f"Preloaded compendium data in {sum(timings.values()):.2f}s")
+    return timings
+
+
+def freeze():
+    """Moves every object currently tracked by the garbage collector into the permanent generation.
+    Call this in the master process right before forking workers."""
+    gc.freeze()
@@ -0,0 +1,300 @@
+"""
+Full-text search over the compendium (monsters, spells and items).
+
+Everything is indexed in memory, in a single inverted index which maps each token to the documents
+(and the weight) it appears in. Query terms match tokens exactly, by prefix (so results show up
+while the user is still typing), or failing both, by trigram similarity (so typos still find
+something). Terms like "cr:1/2", "school:evocation" or "rarity:very-rare" only match that field
+exactly.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+import heapq
+import re
+from threading import Lock
+import time
+from typing import Iterable, NamedTuple, Optional
+
+from dmtoolkit.util import LRUCache, get_logger
+
+log = get_logger(__name__)
+
+KINDS = ("monster", "spell", "item")
+
+# How much a match in each field counts towards a document's score
+NAME_WEIGHT = 3.0
+TAG_WEIGHT = 1.0
+SOURCE_WEIGHT = 0.5
+
+# How much a term counts when it's only a prefix of a token, or only similar to one. Sources
+#   (like "MM" or "PHB") only ever match whole.
+PREFIX_FACTOR = 0.5
+FUZZY_FACTOR = 0.3
+MIN_FUZZY_SIMILARITY = 0.3
+
+# Prefixes up to this long are looked up in a precomputed table; longer ones expand through the
+#   sorted vocabulary, where they only ever match a handful of tokens
+SHORT_PREFIX_LEN = 3
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:/[a-z0-9]+)?(?::[a-z0-9/-]+)?")
+_APOSTROPHES = re.compile(r"['’]")
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase search tokens. Apostrophes are dropped, so "Tasha's" matches
+    "tashas", and fractions like "1/2" are kept whole."""
+    return _TOKEN.findall(_APOSTROPHES.sub("", text.lower()))
+
+
+def _trigrams(token: str) -> set[str]:
+    padded = f"^{token}$"
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class SearchResult(NamedTuple):
+    kind: str
+    key: str
+    name: str
+    source: str
+    detail: str
+    score: float
+
+
+class _Document(NamedTuple):
+    kind: str
+    key: str
+    name: str
+    source: str
+    detail: str
+    norm_name: str
+
+
+class SearchIndex:
+    def __init__(self):
+        self.docs: list[_Document] = []
+        # Maps each token to the documents it appears in, and the weight it has in them
+        self.postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self.prefixes: dict[str, dict[int, float]] = {}
+        self.vocab: list[str] = []
+        self.trigrams: dict[str, set[str]] = {}
+        # Tiny amounts subtracted from each document's score, so ties go to the shortest name
+        self.tiebreak: list[float] = []
+
+    def add(self, kind: str, key: str, name: str, source: str, detail: str = "",
+            tags: Iterable[str] = (), fields: Optional[dict[str, str]] = None):
+        """Adds a document to the index. `tags` are searchable words like the monster type or spell
+        school, and `fields` can only be searched with "field:value" terms. Call `finalize()` after
+        adding every document."""
+        doc_id = len(self.docs)
+        self.docs.append(_Document(kind, key, name, source, detail, " ".join(tokenize(name))))
+        for weight, tokens in (
+            (SOURCE_WEIGHT, tokenize(source)),
+            (TAG_WEIGHT, (token for tag in tags for token in tokenize(tag))),
+            (NAME_WEIGHT, tokenize(name)),
+        ):
+            for token in tokens:
+                postings = self.postings[token]
+                postings[doc_id] = max(postings.get(doc_id, 0), weight)
+        for field, value in (fields or {}).items():
+            if value:
+                self.postings[f"{field}:{'-'.join(tokenize(value))}"][doc_id] = 0
+
+    def finalize(self):
+        """Builds the prefix and trigram tables from the indexed tokens."""
+        self.postings = dict(self.postings)
+        self.vocab = sorted(token for token in self.postings if ":" not in token)
+        # Maps each short term to every document it matches, exactly or as a prefix, and the score
+        prefixes: dict[str, dict[int, float]] = defaultdict(dict)
+        trigrams: dict[str, set[str]] = defaultdict(set)
+        for token in self.vocab:
+            postings = self.postings[token]
+            for length in range(1, min(len(token), SHORT_PREFIX_LEN) + 1):
+                merged = prefixes[token[:length]]
+                exact = length == len(token)
+                for doc_id, weight in postings.items():
+                    if not exact:
+                        if weight <= SOURCE_WEIGHT:
+                            continue
+                        weight *= PREFIX_FACTOR
+                    if weight > merged.get(doc_id, 0):
+                        merged[doc_id] = weight
+            for trigram in _trigrams(token):
+                trigrams[trigram].add(token)
+        self.prefixes = dict(prefixes)
+        self.trigrams = dict(trigrams)
+        self.tiebreak = [0.0] * len(self.docs)
+        by_name = sorted(range(len(self.docs)), key=lambda doc_id: (len(self.docs[doc_id].name), self.docs[doc_id].name))
+        for position, doc_id in enumerate(by_name):
+            self.tiebreak[doc_id] = position * 1e-9
+
+    def _expand_prefix(self, term: str) -> Iterable[str]:
+        """Returns every token which starts with the term (but isn't the term itself)."""
+        i = bisect_left(self.vocab, term)
+        while i < len(self.vocab) and self.vocab[i].startswith(term):
+            if self.vocab[i] != term:
+                yield self.vocab[i]
+            i += 1
+
+    def _fuzzy_tokens(self, term: str) -> Iterable[tuple[str, float]]:
+        """Returns the tokens most similar to the term, along with how similar they are."""
+        term_trigrams = _trigrams(term)
+        shared: dict[str, int] = defaultdict(int)
+        for trigram in term_trigrams:
+            for token in self.trigrams.get(trigram, ()):
+                shared[token] += 1
+        for token, count in shared.items():
+            # A token has as many trigrams as characters, once padded
+            similarity = count / (len(term_trigrams) + len(token) - count)
+            if similarity >= MIN_FUZZY_SIMILARITY:
+                yield token, similarity
+
+    def _match_term(self, term: str) -> dict[int, float]:
+        """Returns the documents matching a single query term, and how well they match it."""
+        if ":" in term:
+            return self.postings.get(term, {})
+
+        if len(term) <= SHORT_PREFIX_LEN:
+            matches = self.prefixes.get(term, {})
+        else:
+            matches = dict(self.postings.get(term, {}))
+            for token in self._expand_prefix(term):
+                for doc_id, weight in self.postings[token].items():
+                    if weight <= SOURCE_WEIGHT:
+                        continue
+                    score = weight * PREFIX_FACTOR
+                    if score > matches.get(doc_id, 0):
+                        matches[doc_id] = score
+
+        if not matches and len(term) >= 3:
+            for token, similarity in self._fuzzy_tokens(term):
+                for doc_id, weight in self.postings[token].items():
+                    score = weight * FUZZY_FACTOR * similarity
+                    if score > matches.get(doc_id, 0):
+                        matches[doc_id] = score
+        return matches
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None, limit: int = 20) -> list[SearchResult]:
+        """Returns the best matches for the query, best first. Every term in the query has to match."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        term_matches = sorted((self._match_term(term) for term in dict.fromkeys(terms)), key=len)
+        if not term_matches[0]:
+            return []
+
+        kinds = set(kinds) if kinds else None
+        norm_query = " ".join(term for term in terms if ":" not in term)
+        docs, tiebreak = self.docs, self.tiebreak
+        scored: list[tuple[float, int]] = []
+        for doc_id, score in term_matches[0].items():
+            for matches in term_matches[1:]:
+                if (term_score := matches.get(doc_id)) is None:
+                    break
+                score += term_score
+            else:
+                doc = docs[doc_id]
+                if kinds is not None and doc.kind not in kinds:
+                    continue
+                # Only documents whose name matched can start with the query
+                if score >= NAME_WEIGHT * PREFIX_FACTOR and norm_query and doc.norm_name.startswith(norm_query):
+                    score += 2 * NAME_WEIGHT if doc.norm_name == norm_query else NAME_WEIGHT
+                scored.append((score - tiebreak[doc_id], doc_id))
+
+        return [
+            SearchResult(*docs[doc_id][:5], round(score, 3))
+            for score, doc_id in heapq.nlargest(limit, scored)
+        ]
+
+
+def _index_monsters(index: SearchIndex):
+    from dmtoolkit.api.monsters import get_monsters
+
+    for monster in get_monsters().values():
+        tags = [monster.maintype, monster.size_str]
+        if monster.subtype:
+            tags.append(monster.subtype)
+        index.add(
+            "monster", monster.key, monster.name, monster.source,
+            detail=f"{monster.size_str} {monster.maintype}, CR {monster.cr}",
+            tags=tags,
+            fields={"cr": monster.cr, "type": monster.maintype, "size": monster.size_str, "source": monster.source},
+        )
+
+
+def _index_spells(index: SearchIndex):
+    from dmtoolkit.api.spells import list_spells
+
+    seen = set()
+    for spell in list_spells(False) + list_spells(True):
+        if id(spell) in seen:
+            continue
+        seen.add(id(spell))
+        level = "Cantrip" if spell.level == 0 else f"Level {spell.level}"
+        index.add(
+            "spell", spell.name, spell.name, spell.source,
+            detail=f"{level} {spell.school}",
+            tags=[spell.school],
+            fields={"school": spell.school, "level": str(spell.level), "source": spell.source},
+        )
+
+
+def _index_items(index: SearchIndex):
+    from dmtoolkit.api.items import list_items
+
+    for item in list_items():
+        source = item.source[0]
+        tags = [tag for tag in (item.item_type, item.rarity) if tag and tag not in ("none", "unknown")]
+        index.add(
+            "item", item.id(), item.name, source,
+            detail=", ".join(tags),
+            tags=tags,
+            fields={"type": item.item_type, "rarity": item.rarity, "source": source},
+        )
+
+
+_INDEXERS = {
+    "monster": _index_monsters,
+    "spell": _index_spells,
+    "item": _index_items,
+}
+
+_INDEX: Optional[SearchIndex] = None
+_INDEX_LOCK = Lock()
+
+# Search-as-you-type sends the same short (and slowest) queries over and over
+RESULTS = LRUCache(maxsize=1024)
+
+def get_index() -> SearchIndex:
+    """Returns the search index, building it on first use."""
+    global _INDEX
+    if _INDEX is not None:
+        return _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            start = time.perf_counter()
+            index = SearchIndex()
+            for kind, indexer in _INDEXERS.items():
+                try:
+                    indexer(index)
+                except FileNotFoundError as e:
+                    log.warning(f"Unable to index {kind}s for search: {e}")
+            index.finalize()
+            log.info(f"Indexed {len(index.docs)} documents for search in {time.perf_counter() - start:.2f}s")
+            _INDEX = index
+    return _INDEX
+
+
+def reset_index():
+    """Forget the search index, so it's rebuilt (from the current data) on the next search."""
+    global _INDEX
+    with _INDEX_LOCK:
+        _INDEX = None
+        RESULTS.clear()
+
+
+def search(query: str, kinds: Optional[Iterable[str]] = None, limit: int = 20) -> list[SearchResult]:
+    """Searches the compendium. `kinds` limits the results to some of "monster", "spell" and "item"."""
+    key = (" ".join(tokenize(query)), frozenset(kinds or ()), limit)
+    if (results := RESULTS.get(key)) is None:
+        results = RESULTS[key] = get_index().search(query, kinds, limit)
+    return results
@@ -0,0 +1,129 @@
+"""
+Server-side sessions, which hold each browser's players and settings. The browser only keeps a
+session id cookie, so requests stay small however big the party gets, and nothing runs into the
+4 KB cookie limit.
+
+The store is set with SESSION_TYPE: "sqlite" (the default) keeps sessions in an SQLite database at
+SESSION_SQLITE_PATH, which every worker on the machine shares, and "redis" keeps them at
+SESSION_REDIS_URL (don't give that redis an eviction policy). Sessions are the only copy of what they
+hold, so neither store ever drops one to make room: they only expire, PERMANENT_SESSION_LIFETIME after
+they were last written. Sessions which only hold a CSRF token (every visitor gets one, crawlers
+included) expire after ANONYMOUS_SESSION_LIFETIME instead, so they don't pile up for a year.
+
+Players and settings used to be kept in cookies of their own. The first time a browser with those
+cookies shows up, they are moved into its session and the cookies are deleted (see `migrate_cookie`).
+"""
+from datetime import timedelta
+from pathlib import Path
+import sqlite3
+from threading import Lock, local
+import time
+from typing import Optional
+
+from flask import Flask, Response, after_this_request, request
+from flask_session import Session
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+
+from dmtoolkit.util import get_logger
+
+log = get_logger(__name__)
+
+sessions = Session()
+
+# Keys which don't make a session worth keeping around for long
+ANONYMOUS_KEYS = frozenset({"_permanent", "csrf_token"})
+ANONYMOUS_SESSION_LIFETIME = timedelta(days=1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+"""
+
+
+class SQLiteSession(ServerSideSession):
+    pass
+
+
+class SQLiteSessionInterface(ServerSideSessionInterface):
+    """Keeps sessions in an SQLite database. Each thread gets a connection of its own. Expired
+    sessions are deleted every `cleanup_n_requests` requests, on average."""
+
+    session_class = SQLiteSession
+    ttl = False
+
+    def __init__(self, app: Flask, path: Path | str, cleanup_n_requests: int = 1000, **kwargs):
+        self.path = Path(path)
+        self._local = local()
+        self._init_lock = Lock()
+        self._initialized = False
+        super().__init__(app, cleanup_n_requests=cleanup_n_requests, **kwargs)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if (db := getattr(self._local, "db", None)) is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous = NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    db.execute("PRAGMA journal_mode = WAL")
+                    db.executescript(_SCHEMA)
+                    self._initialized = True
+        return db
+
+    def _retrieve_session_data(self, store_id: str) -> Optional[dict]:
+        row = self.db.execute(
+            "SELECT data FROM sessions WHERE id = ? AND expires > ?", (store_id, time.time())
+        ).fetchone()
+        return self.serializer.decode(row[0]) if row else None
+
+    def _delete_session(self, store_id: str):
+        self.db.execute("DELETE FROM sessions WHERE id = ?", (store_id,))
+
+    def _upsert_session(self, session_lifetime: timedelta, session: ServerSideSession, store_id: str):
+        if set(session) <= ANONYMOUS_KEYS:
+            session_lifetime = min(session_lifetime, ANONYMOUS_SESSION_LIFETIME)
+        self.db.execute(
+            "INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?) "
+            + "ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+            (store_id, self.serializer.encode(session), time.time() + session_lifetime.total_seconds()),
+        )
+
+    def _delete_expired_sessions(self):
+        deleted = self.db.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),)).rowcount
+        log.debug(f"Deleted {deleted} expired sessions")
+
+
+def init_session_store(app: Flask):
+    if app.config.get("SESSION_TYPE") == "sqlite":
+        app.session_interface = SQLiteSessionInterface(
+            app,
+            app.config["SESSION_SQLITE_PATH"],
+            key_prefix=app.config.get("SESSION_KEY_PREFIX", "session:"),
+            permanent=app.config.get("SESSION_PERMANENT", True),
+        )
+        return
+    if app.config.get("SESSION_TYPE") == "redis" and app.config.get("SESSION_REDIS") is None:
+        from redis import Redis
+        app.config["SESSION_REDIS"] = Redis.from_url(app.config["SESSION_REDIS_URL"])
+    sessions.init_app(app)
+
+
+def migrate_cookie(name: str) -> Optional[str]:
+    """Returns the value of an old-style cookie (or 'None' if there's no such cookie), which the
+    caller keeps in the session from now on. The cookie is deleted once the response goes out."""
+    value = request.cookies.get(name)
+    if value is None:
+        return None
+
+    @after_this_request
+    def delete_cookie(response: Response) -> Response:
+        response.delete_cookie(name)
+        return response
+
+    log.debug(f"Moving the {name} cookie into the session")
+    return value
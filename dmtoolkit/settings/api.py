@@ -1,7 +1,9 @@
 import json
 from typing import Any, Optional
 
-from flask import request, Response, make_response
+from flask import g, session, Response, make_response
+
+from dmtoolkit.session_store import migrate_cookie
 
 settings_blacklist = [
     "csrf_token",
@@ -13,16 +15,23 @@ def get_setting(key: str) -> Any:
 
 
 def get_settings() -> dict:
-    return sanitize_settings(json.loads(request.cookies.get("settings", "{}")))
+    """Returns the settings in the current session, loaded once per request. Don't change the
+    returned dict; use `set_settings` instead."""
+    if "settings" not in g:
+        settings = session.get("settings")
+        if settings is None and (cookie := migrate_cookie("settings")) is not None:
+            settings = session["settings"] = sanitize_settings(json.loads(cookie))
+        g.settings = sanitize_settings(settings or {})
+    return g.settings
 
 
 def set_settings(new_settings: dict[str, Any], resp: Optional[Response] = None) -> Response:
-    settings = get_settings()
-    settings |= new_settings
-    if not resp:
-        resp = make_response()
-    resp.set_cookie("settings", json.dumps(sanitize_settings(settings)))
-    return resp
+    settings = sanitize_settings(get_settings() | new_settings)
+    session["settings"] = g.settings = settings
+    # Anything worked out from the old settings is out of date
+    from dmtoolkit.context import reset_request_state
+    reset_request_state()
+    return resp or make_response()
 
 
 def sanitize_settings(settings: dict[str, Any]) -> dict[str, Any]:
@@ -32,8 +41,5 @@ def sanitize_settings(settings: dict[str, Any]) -> dict[str, Any]:
 
 def get_active_modules() -> list[str]:
     """Returns the name of all active modules."""
-    active_modules: list[str] = []
-    for key, val in get_settings().items():
-        if key.startswith("module_") and val:
-            active_modules.append(key[7:])
-    return active_modules
\ No newline at end of file
+    from dmtoolkit.context import get_request_state
+    return get_request_state().active_modules
\ No newline at end of file
@@ -1,17 +1,18 @@
 """Random utility stuff."""
 
+from collections import OrderedDict
+from collections.abc import Hashable
 import logging
+import re
+from threading import Lock
+from typing import Any, NamedTuple
+
+# Anything that isn't alphanumeric or one of the separators " \t\n-_.|" (\w covers "_")
+_NON_ID_CHARS = re.compile(r"[^\w \t\n\-.|]")
 
 def normalize_name(name: str) -> str:
     """Normalizes a string for use as an ID."""
-    separatators = {" ", "\t", "\n", "-", "_", ".", "|"}
-    finalstring = ""
-    for char in name:
-        if char in separatators:
-            finalstring += char
-        elif char.isalnum():
-            finalstring += char.lower()
-    return finalstring
+    return _NON_ID_CHARS.sub("", name).lower()
 
 def get_logger(name: str):
     """Standardized logger creation for all modules."""
@@ -25,4 +26,75 @@ def get_logger(name: str):
             log.setLevel("INFO")
     except:
         log.setLevel("DEBUG") # Default to debug logging
-    return log
\ No newline at end of file
+    return log
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+class LRUCache:
+    """A thread-safe mapping which holds at most 'maxsize' entries. Once full, the least recently
+    used entry is evicted to make room for new ones. Keeps count of hits, misses, and evictions."""
+    def __init__(self, maxsize: int = 1024):
+        if maxsize < 1:
+            raise ValueError(f"'maxsize' must be 1 or higher; got '{maxsize}'.")
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value stored for 'key', or 'default' if there is no such entry."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Removes the entry for 'key', returning its value, or 'default' if there is no such entry."""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def resize(self, maxsize: int):
+        """Changes the maximum size of the cache, evicting entries if needed."""
+        if maxsize < 1:
+            raise ValueError(f"'maxsize' must be 1 or higher; got '{maxsize}'.")
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self._hits, self._misses, self._evictions, len(self._data), self.maxsize)
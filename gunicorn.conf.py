@@ -0,0 +1,29 @@
+"""Gunicorn settings. Gunicorn picks this file up automatically when it's run from the project root.
+
+The app is loaded once in the master process (along with all of the compendium data, see
+dmtoolkit/preload.py), and the workers forked from it share that memory copy-on-write.
+"""
+import gc
+from os import environ
+
+wsgi_app = "wsgi:app"
+bind = environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(environ.get("GUNICORN_WORKERS", 4))
+# Each worker serves requests from a pool of threads. Clients subscribed to live tracker updates
+#   (dmtoolkit/inittracker/sync.py) each hold one of them for as long as they're connected, so each
+#   worker only takes TRACKER_MAX_SUBSCRIBERS (32) of them, leaving the other threads for everything else.
+threads = int(environ.get("GUNICORN_THREADS", 64))
+
+preload_app = True
+raw_env = ["PRELOAD_COMPENDIUM=1"]
+
+
+def post_worker_init(worker):
+    # Live tracker sessions refuse to run on more than one worker unless they're kept in redis
+    #   (TRACKER_STORE=redis), so tell the app how many there are
+    worker.wsgi.config["WEB_CONCURRENCY"] = worker.cfg.workers
+
+
+def pre_fork(server, worker):
+    # Keep the garbage collector from touching (and so copying) everything the master loaded
+    gc.freeze()
@@ -0,0 +1,35 @@
+from os import environ
+import tempfile
+
+import pytest
+
+from dmtoolkit import init_app
+import dmtoolkit.api.monsters as monsters_api
+from dmtoolkit.api.serialize import load_json
+
+from tests.constants import FIXTURE_DIR
+
+# Keep the sessions and encounters tests create out of the project's instance folder
+environ.setdefault("SESSION_SQLITE_PATH", tempfile.mktemp(prefix="dmtoolkit-sessions-", suffix=".sqlite3"))
+environ.setdefault("ENCOUNTER_LIBRARY_PATH", tempfile.mktemp(prefix="dmtoolkit-encounters-", suffix=".sqlite3"))
+
+
+@pytest.fixture
+def monsters(monkeypatch):
+    """Replaces the monster data with the handful of monsters in the fixtures directory."""
+    with (FIXTURE_DIR / "monsters.json").open("r") as f:
+        monster_list = load_json(f)
+    monkeypatch.setattr(monsters_api.MONSTERS, "_data", {monster.key: monster for monster in monster_list})
+    return monsters_api.MONSTERS
+
+
+@pytest.fixture
+def app():
+    app = init_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, SECRET_KEY="test")
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+import time
+
+from flask import request
+import pytest
+
+from dmtoolkit import asgi
+from dmtoolkit.asgi import AsgiApp, build_environ
+from dmtoolkit.inittracker import sessions, statblocks, sync
+
+
+@pytest.fixture
+def asgi_app(app):
+    asgi_app = AsgiApp(app, threads=8)
+    yield asgi_app
+    asgi_app.pool.shutdown(wait=False)
+
+
+def call(asgi_app: AsgiApp, method: str, path: str, body: bytes = b"", headers: dict[str, str] = None,
+         disconnect_after: int = None) -> tuple[int, dict[str, str], list[bytes]]:
+    """Sends one request through the ASGI app, and returns the status, headers and body chunks. If
+    'disconnect_after' is set, the client goes away once it has that many chunks."""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query.encode(), "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "server": ("testserver", 80), "client": ("127.0.0.1", 1234), "http_version": "1.1",
+    }
+    started: dict = {}
+    chunks: list[bytes] = []
+
+    async def run():
+        gone = asyncio.Event()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                started.update(message)
+            else:
+                chunks.append(message["body"])
+                if disconnect_after is not None and len(chunks) >= disconnect_after:
+                    gone.set()
+
+        await asyncio.wait_for(asgi_app(scope, receive, send), timeout=10)
+
+    asyncio.run(run())
+    headers = {k.decode(): v.decode() for k, v in started["headers"]}
+    return started["status"], headers, chunks
+
+
+def test_build_environ():
+    scope = {
+        "type": "http", "method": "GET", "path": "/dmk/api/search", "query_string": b"q=goblin",
+        "root_path": "/dmk", "headers": [(b"content-type", b"text/plain"), (b"accept", b"a"), (b"accept", b"b")],
+        "server": ("example.com", 8080),
+    }
+    environ = build_environ(scope, b"body")
+    assert (environ["SCRIPT_NAME"], environ["PATH_INFO"], environ["QUERY_STRING"]) == ("/dmk", "/api/search", "q=goblin")
+    assert (environ["CONTENT_TYPE"], environ["HTTP_ACCEPT"], environ["SERVER_PORT"]) == ("text/plain", "a,b", "8080")
+    assert environ["wsgi.input"].read() == b"body"
+
+
+def test_async_view(asgi_app, monsters):
+    """Async views run on the event loop, cached statblocks never leave it."""
+    statblocks.STATBLOCKS.clear()
+    assert asgi_app._is_async_view(build_environ({"method": "GET", "path": "/statblock/Goblin-MM"}, b""))
+    status, headers, chunks = call(asgi_app, "GET", "/statblock/Goblin-MM")
+    assert status == 200
+    assert b"Goblin" in b"".join(chunks)
+
+    status, _, chunks = call(asgi_app, "GET", "/statblock/Goblin-MM", headers={"If-None-Match": headers["etag"]})
+    assert (status, b"".join(chunks)) == (304, b"")
+    info = statblocks.STATBLOCKS.info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_async_view_error(asgi_app, monsters):
+    status, _, _ = call(asgi_app, "GET", "/api/classes/nope")
+    assert status == 404
+
+
+def test_async_view_session_off_loop(app, asgi_app, monsters, monkeypatch):
+    """Loading and saving the session can block, so neither happens on the event loop."""
+    threads = []
+    interface = app.session_interface
+    for method in ("open_session", "save_session"):
+        def record(*args, _method=getattr(interface, method), **kwargs):
+            threads.append(threading.current_thread().name)
+            return _method(*args, **kwargs)
+        monkeypatch.setattr(interface, method, record)
+
+    status, _, _ = call(asgi_app, "GET", "/statblock/Goblin-MM")
+    assert status == 200
+    assert len(threads) == 2
+    assert all(thread.startswith("render") for thread in threads)
+
+
+def test_run_sync_keeps_context(app):
+    async def run():
+        with app.test_request_context("/statblock/x"):
+            return await asgi.run_sync(lambda: (request.path, threading.current_thread().name))
+
+    path, thread = asyncio.run(run())
+    assert path == "/statblock/x"
+    assert thread.startswith("render")
+
+
+def test_sync_view(asgi_app, monsters):
+    assert not asgi_app._is_async_view(build_environ({"method": "POST", "path": "/api/tracker"}, b""))
+    status, headers, chunks = call(asgi_app, "POST", "/api/tracker")
+    assert status == 200
+    state = json.loads(b"".join(chunks))
+    assert state["version"] == 0
+    sessions.delete_session(state["id"])
+
+    status, _, _ = call(asgi_app, "GET", "/no/such/page")
+    assert status == 404
+
+
+def test_streamed_response(asgi_app):
+    """Streamed responses are sent as they're produced, and closed once the client goes away."""
+    session = sessions.create_session()
+    status, headers, chunks = call(asgi_app, "GET", f"/api/tracker/{session.id}/events", disconnect_after=1)
+    assert status == 200
+    assert headers["content-type"].startswith("text/event-stream")
+    assert chunks[0].startswith(b"event: state")
+    # The subscription is closed as soon as it wakes up
+    assert sync.subscriber_count(session.id) == 1
+    sessions.update_session(session.id, lambda s: s.add({"name": "Goblin", "max_hp": 7}))
+    for _ in range(100):
+        if not sync.subscriber_count(session.id):
+            break
+        time.sleep(0.02)
+    assert sync.subscriber_count(session.id) == 0
+    sessions.delete_session(session.id)
+
+
+def test_lifespan(asgi_app):
+    sent = []
+
+    async def run():
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        await asgi_app({"type": "lifespan"}, receive, send)
+
+    asyncio.run(run())
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+
+@pytest.mark.parametrize("argv, workers", [
+    (["/usr/bin/uvicorn", "asgi:app", "--workers", "4"], 4),
+    (["/venv/lib/python3.11/site-packages/uvicorn/__main__.py", "--workers=2", "asgi:app"], 2),
+    (["/usr/bin/uvicorn", "asgi:app"], None),
+    (["/usr/bin/gunicorn", "--workers", "4", "wsgi:app"], None),
+    ([], None),
+])
+def test_uvicorn_workers(argv, workers):
+    pytest.importorskip("uvicorn")
+    assert asgi.uvicorn_workers(argv) == workers
@@ -0,0 +1,116 @@
+import json
+import os
+
+import pytest
+
+from dmtoolkit.api import compendium_db, compendium_pack, items, monsters, spells
+from dmtoolkit.preload import preload_compendium
+
+from tests.constants import FIXTURE_DIR
+
+
+@pytest.fixture(scope="module")
+def built_db(tmp_path_factory):
+    """A compendium database of the items, spells and fixture monsters."""
+    path = tmp_path_factory.mktemp("compendium") / "compendium.sqlite3"
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(monsters, "DEFAULT_MONSTERS_FILE", FIXTURE_DIR / "monsters.json")
+        compendium_db.build_compendium_db(path)
+    return path
+
+
+@pytest.fixture
+def db_path(built_db, monkeypatch):
+    """Uses the built database (and no pack), and makes sure none of the registries it stands in
+    for are loaded."""
+    monkeypatch.setattr(monsters, "DEFAULT_MONSTERS_FILE", FIXTURE_DIR / "monsters.json")
+    monkeypatch.setattr(compendium_db, "DB_PATH", built_db)
+    monkeypatch.setattr(compendium_db, "DB_ENABLED", True)
+    monkeypatch.setattr(compendium_pack, "PACK_ENABLED", False)
+    for registry in (items.ITEMS, spells.SPELLS, monsters.MONSTERS):
+        monkeypatch.setattr(registry, "_data", None)
+    compendium_db.reset()
+    compendium_pack.reset()
+    yield built_db
+    compendium_db.reset()
+    compendium_pack.reset()
+
+
+def test_getters(db_path):
+    db = compendium_db.get_compendium_db("item")
+    assert db is not None
+    item = items.get_item("Bag of Holding")
+    assert item.name == "Bag of Holding"
+    # Both keys give the same (cached) object
+    assert items.get_item(f"bag of holding|{item.source[0]}") is item
+    assert items.get_item("Bag of Nothing") is None
+
+    assert spells.get_spell("Fear").source == "PHB"
+    assert spells.get_spell("Fear", use_2024_content=True).source == "XPHB"
+    with pytest.raises(KeyError):
+        spells.get_spell("Not a spell")
+    assert monsters.get_monster("Goblin-MM").name == "Goblin"
+    assert monsters.get_monster("Goblin-XX") is None
+
+    assert not any(registry.loaded for registry in (items.ITEMS, spells.SPELLS, monsters.MONSTERS))
+    assert db.objects.info().size == 4
+
+    # Once the registry is loaded, it's used instead
+    fear = spells.SPELLS[False]["fear"]
+    assert spells.get_spell("fear") is fear
+
+
+def test_search_text(db_path):
+    results = compendium_db.search_text("frightened", ["spell"])
+    assert {"Fear", "Cause Fear"} <= {result.name for result in results}
+    assert all(result.kind == "spell" for result in results)
+    assert "<mark>" in results[0].snippet
+    # The last word matches by prefix, and words match in any form
+    assert {"Fear", "Cause Fear"} <= {result.name for result in compendium_db.search_text("frighten")}
+    assert compendium_db.search_text("goblin", ["monster"])[0].key == "Goblin-MM"
+    assert compendium_db.search_text(" \"*") == []
+
+
+def test_stale_source(db_path, monkeypatch, tmp_path):
+    spell_file = tmp_path / "spells.json"
+    spell_file.write_bytes(spells.SPELL_DATA_PATH.read_bytes())
+    monkeypatch.setattr(spells, "SPELL_DATA_PATH", spell_file)
+    monkeypatch.setattr(compendium_db, "DB_PATH", tmp_path / "compendium.sqlite3")
+    compendium_db.build_compendium_db(compendium_db.DB_PATH)
+    compendium_db.reset()
+    assert compendium_db.get_compendium_db("spell")
+    stat = spell_file.stat()
+    os.utime(spell_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    compendium_db.reset()
+    assert compendium_db.get_compendium_db("spell") is None
+    assert compendium_db.get_compendium_db("item")
+    # Stale kinds are left out of searches
+    assert {result.kind for result in compendium_db.search_text("fear")} == {"item"}
+
+
+def test_schema_change(db_path, monkeypatch):
+    monkeypatch.setattr(compendium_db, "get_schema_hash", lambda: "something else")
+    compendium_db.reset()
+    assert compendium_db.get_compendium_db("item") is None
+    assert compendium_db.search_text("frightened") is None
+
+
+def test_preload_skips_database(db_path, monkeypatch):
+    timings = preload_compendium()
+    assert not {"items", "spells", "monsters", "search"} & set(timings)
+    assert "classes" in timings
+    assert not items.ITEMS.loaded
+
+
+def test_search_text_route(client, db_path):
+    results = json.loads(client.get("/api/search/text?q=frightened&kind=spell&limit=3").data)
+    assert len(results) == 3
+    assert {"kind", "key", "name", "source", "snippet", "score"} <= set(results[0])
+    assert client.get("/api/search/text?q=frightened&kind=class").status_code == 400
+
+
+def test_search_text_route_without_database(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(compendium_db, "DB_PATH", tmp_path / "missing.sqlite3")
+    compendium_db.reset()
+    assert client.get("/api/search/text?q=frightened").status_code == 503
+    compendium_db.reset()
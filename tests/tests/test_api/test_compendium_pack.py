@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from dmtoolkit.api import compendium_db, compendium_pack, items, monsters, spells
+
+from tests.constants import FIXTURE_DIR
+
+
+@pytest.fixture(scope="module")
+def built_pack(tmp_path_factory):
+    """A compendium pack of the items, spells and fixture monsters."""
+    path = tmp_path_factory.mktemp("compendium") / "compendium.pack"
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(monsters, "DEFAULT_MONSTERS_FILE", FIXTURE_DIR / "monsters.json")
+        compendium_pack.build_compendium_pack(path)
+    return path
+
+
+@pytest.fixture
+def pack_path(built_pack, monkeypatch, tmp_path):
+    """Uses the built pack (and no database), and makes sure none of the registries it stands in
+    for are loaded."""
+    monkeypatch.setattr(monsters, "DEFAULT_MONSTERS_FILE", FIXTURE_DIR / "monsters.json")
+    monkeypatch.setattr(compendium_pack, "PACK_PATH", built_pack)
+    monkeypatch.setattr(compendium_pack, "PACK_ENABLED", True)
+    monkeypatch.setattr(compendium_db, "DB_PATH", tmp_path / "missing.sqlite3")
+    for registry in (items.ITEMS, spells.SPELLS, monsters.MONSTERS):
+        monkeypatch.setattr(registry, "_data", None)
+    compendium_pack.reset()
+    compendium_db.reset()
+    yield built_pack
+    compendium_pack.reset()
+    compendium_db.reset()
+
+
+def test_getters(pack_path):
+    pack = compendium_pack.get_compendium_pack("item")
+    assert compendium_pack.get_compendium_store("item") is pack
+    item = items.get_item("Bag of Holding")
+    assert item.name == "Bag of Holding"
+    assert items.get_item(f"bag of holding|{item.source[0]}") is item
+    assert items.get_item("Bag of Nothing") is None
+
+    assert spells.get_spell("Fear").source == "PHB"
+    assert spells.get_spell("Fear", use_2024_content=True).source == "XPHB"
+    with pytest.raises(KeyError):
+        spells.get_spell("Not a spell")
+    assert monsters.get_monster("Goblin-MM").name == "Goblin"
+    assert monsters.get_monster("Goblin-XX") is None
+    assert monsters.get_monster("") is None
+
+    assert not any(registry.loaded for registry in (items.ITEMS, spells.SPELLS, monsters.MONSTERS))
+    assert pack.objects.info().size == 4
+
+
+def test_same_as_registries(pack_path):
+    pack = compendium_pack.get_compendium_pack("spell")
+    for use_2024, namespace in ((False, "spell"), (True, "spell_2024")):
+        spell_list = spells.SPELLS[use_2024]
+        keys = list(pack.keys(namespace))
+        assert keys == sorted(spell_list, key=str.encode)
+        for key in keys[::25]:
+            assert pack.get(namespace, key) == spell_list[key]
+    assert sorted(pack.keys("monster")) == sorted(monsters.MONSTERS)
+
+
+def test_stale_source(pack_path, monkeypatch, tmp_path):
+    spell_file = tmp_path / "spells.json"
+    spell_file.write_bytes(spells.SPELL_DATA_PATH.read_bytes())
+    monkeypatch.setattr(spells, "SPELL_DATA_PATH", spell_file)
+    monkeypatch.setattr(compendium_pack, "PACK_PATH", tmp_path / "compendium.pack")
+    compendium_pack.build_compendium_pack(compendium_pack.PACK_PATH, ["spell"])
+    compendium_pack.reset()
+    assert compendium_pack.get_compendium_pack("spell")
+    assert compendium_pack.get_compendium_pack("item") is None
+    stat = spell_file.stat()
+    os.utime(spell_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    compendium_pack.reset()
+    assert compendium_pack.get_compendium_pack("spell") is None
+
+
+def test_unusable_pack(pack_path, monkeypatch, tmp_path):
+    monkeypatch.setattr(compendium_pack, "PACK_FORMAT_VERSION", compendium_pack.PACK_FORMAT_VERSION + 1)
+    compendium_pack.reset()
+    assert compendium_pack.get_compendium_store("item") is None
+
+    not_a_pack = tmp_path / "not.pack"
+    not_a_pack.write_bytes(b"SQLite format 3\0")
+    monkeypatch.setattr(compendium_pack, "PACK_PATH", not_a_pack)
+    compendium_pack.reset()
+    assert compendium_pack.get_compendium_store("item") is None
+    assert items.get_item("Bag of Holding").name == "Bag of Holding"
@@ -0,0 +1,37 @@
+import json
+import os
+import sys
+
+import pytest
+
+from dmtoolkit import diagnostics, preload
+
+
+def test_preload_compendium(monsters):
+    timings = preload.preload_compendium()
+    assert preload.is_preloaded()
+    for domain in ("items", "spells", "classes", "races", "conditions", "monsters", "recipes"):
+        assert domain in timings
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Reads memory usage from /proc")
+def test_memory_usage():
+    usage = diagnostics.get_memory_usage(os.getpid())
+    assert usage is not None
+    assert usage["rss"] >= usage["uss"] > 0
+    assert os.getpid() in diagnostics.list_sibling_pids()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Reads memory usage from /proc")
+def test_memory_diagnostics_route(app, client):
+    app.config["ENABLE_DIAGNOSTICS"] = True
+    resp = client.get("/api/diagnostics/memory")
+    assert resp.status_code == 200
+    report = json.loads(resp.data)
+    assert report["pid"] == os.getpid()
+    assert any(worker["pid"] == os.getpid() for worker in report["workers"])
+
+
+def test_memory_diagnostics_disabled(client):
+    # Off unless ENABLE_DIAGNOSTICS is set
+    assert client.get("/api/diagnostics/memory").status_code == 404
@@ -0,0 +1,68 @@
+from fractions import Fraction
+
+import pytest
+
+import dmtoolkit.api.monsters as monsters_api
+from dmtoolkit.api.monsters import MonsterQuery
+
+
+@pytest.fixture
+def index(monsters):
+    monsters_api.reset_monster_index()
+    yield monsters_api.get_monster_index()
+    monsters_api.reset_monster_index()
+
+
+def brute_force(monsters, low=None, high=None, types=(), sizes=(), environments=()):
+    results = []
+    for monster in monsters.values():
+        if low is not None and not (Fraction(low) <= monster.cr_num <= Fraction(high)):
+            continue
+        if types and monster.maintype not in types:
+            continue
+        if sizes and monster.size_str not in sizes:
+            continue
+        if environments and not set(environments) & set(monster.environment):
+            continue
+        results.append(monster)
+    return sorted(monster.key for monster in results)
+
+
+@pytest.mark.parametrize("query,expected", [
+    (MonsterQuery().cr(1, 5).type("undead"), ["Ghoul-MM", "Wight-MM"]),
+    (MonsterQuery().cr("1/2"), ["Gnoll-MM", "Hobgoblin-MM", "Orc-MM"]),
+    (MonsterQuery().cr(0.25).type("Beast"), ["Wolf-MM"]),
+    (MonsterQuery().type("dragon").size("Huge"), ["Adult Red Dragon-MM"]),
+    (MonsterQuery().environment("underdark").cr(0, 1), ["Goblin-MM", "Ghoul-MM"]),
+    (MonsterQuery().type("undead", "giant").cr(4, 30), ["Troll-MM", "Lich-MM"]),
+    (MonsterQuery().type("undead").type("giant"), []),
+    (MonsterQuery().cr(1, 5).cr(3, 8), ["Owlbear-MM", "Wight-MM", "Fire Elemental-MM", "Troll-MM"]),
+    (MonsterQuery().source("xyz"), []),
+])
+def test_query(index, query, expected):
+    assert query.keys() == expected
+    assert query.count() == len(expected)
+
+
+@pytest.mark.parametrize("low,high,types,sizes,environments", [
+    (None, None, (), (), ()),
+    ("1/8", "1/2", ("humanoid",), (), ()),
+    (0, 30, (), ("Medium", "Large"), ()),
+    (None, None, ("beast", "humanoid"), (), ("forest",)),
+])
+def test_query_matches_brute_force(index, monsters, low, high, types, sizes, environments):
+    query = MonsterQuery()
+    if low is not None:
+        query.cr(low, high)
+    if types:
+        query.type(*types)
+    if sizes:
+        query.size(*sizes)
+    if environments:
+        query.environment(*environments)
+    assert sorted(query.keys()) == brute_force(monsters, low, high, types, sizes, environments)
+
+
+def test_results_sorted_by_cr(index):
+    crs = [monster.cr_num for monster in MonsterQuery()]
+    assert crs == sorted(crs)
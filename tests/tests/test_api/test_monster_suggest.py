@@ -0,0 +1,46 @@
+from collections import Counter
+import json
+
+import pytest
+
+import dmtoolkit.api.monsters as monsters_api
+
+
+@pytest.fixture
+def suggestions(monsters, monkeypatch):
+    """Builds the suggestions from the fixture monsters, with no popularity data."""
+    monkeypatch.setattr(monsters_api, "MONSTER_POPULARITY", Counter())
+    monsters_api.SUGGESTIONS.reset()
+    yield monsters_api.SUGGESTIONS
+    monsters_api.SUGGESTIONS.reset()
+
+
+@pytest.mark.parametrize("prefix,expected", [
+    ("gob", ["Goblin"]),
+    ("Hob", ["Hobgoblin"]),
+    ("g", ["Ghoul", "Gnoll", "Goblin", "Giant Spider", "Young Green Dragon"]),
+    ("dragon", ["Adult Red Dragon", "Young Green Dragon"]),
+    ("red d", ["Adult Red Dragon"]),
+    ("xyz", []),
+    ("", []),
+])
+def test_suggest(suggestions, prefix, expected):
+    assert [name for _, name in monsters_api.suggest_monsters(prefix)] == expected
+
+
+def test_suggest_popularity(suggestions):
+    monsters_api.record_monster_use("Young Green Dragon-MM")
+    assert monsters_api.suggest_monsters("g", limit=2) == [
+        ("Young Green Dragon-MM", "Young Green Dragon"),
+        ("Ghoul-MM", "Ghoul"),
+    ]
+
+
+def test_suggest_route(client, suggestions):
+    resp = client.get("/api/monsters/suggest?prefix=or")
+    assert resp.status_code == 200
+    assert json.loads(resp.data) == [{"key": "Orc-MM", "name": "Orc"}]
+
+    # Adding a monster to the tracker makes it more popular
+    assert client.get("/api/monsters-combat-overview?name=Ogre-MM").status_code == 200
+    assert monsters_api.MONSTER_POPULARITY["Ogre-MM"] == 1
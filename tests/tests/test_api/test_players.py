@@ -0,0 +1,81 @@
+import json
+import time
+
+from dmtoolkit import session_store
+from dmtoolkit.api import players
+from dmtoolkit.api.models import Player
+from dmtoolkit.api.serialize import dump_json_string
+from dmtoolkit.settings import api as settings_api
+
+
+def test_players_in_session(client):
+    assert [p["name"] for p in json.loads(client.get("/api/players/list").data)] == ["(Sample) Aragorn"]
+    legolas = {"name": "Legolas", "ac": 15, "pp": 14, "hp": 11, "race": "Elf", "class_": "Ranger", "level": 1}
+    resp = client.post("/players/new", data=legolas)
+    assert resp.status_code == 302
+    assert "players=" not in resp.headers.get("Set-Cookie", "")
+    assert [p["name"] for p in json.loads(client.get("/api/players/list").data)] == ["(Sample) Aragorn", "Legolas"]
+
+    client.get("/players/delete/Legolas")
+    assert [p["name"] for p in json.loads(client.get("/api/players/list").data)] == ["(Sample) Aragorn"]
+
+
+def test_migrate_player_cookie(client):
+    party = [Player(name=f"Hero {i}", hp=10, ac=12, pp=10) for i in range(12)]
+    client.set_cookie("players", dump_json_string(party))
+    resp = client.get("/api/players/list")
+    assert len(json.loads(resp.data)) == 12
+    # The cookie is gone, but the party stays
+    assert client.get_cookie("players") is None
+    assert len(json.loads(client.get("/api/players/list").data)) == 12
+
+
+def test_migrate_settings_cookie(app, client):
+    client.set_cookie("settings", json.dumps({"use_new_content": True, "csrf_token": "x"}))
+    client.get("/api/players/list")
+    # Only requests which use the settings move them
+    assert client.get_cookie("settings") is not None
+    client.get("/api/monsters/suggest?q=gob")
+    assert client.get_cookie("settings") is None
+    with client.session_transaction() as session:
+        assert session["settings"] == {"use_new_content": True}
+
+
+def counting(monkeypatch, module, name: str) -> list:
+    """Counts the calls to a module's function."""
+    calls, func = [], getattr(module, name)
+    monkeypatch.setattr(module, name, lambda *args: calls.append(args) or func(*args))
+    return calls
+
+
+def test_loaded_once_per_request(app, monkeypatch):
+    loads = counting(monkeypatch, players, "load_json_string")
+    sanitizes = counting(monkeypatch, settings_api, "sanitize_settings")
+    with app.test_request_context():
+        for _ in range(3):
+            players.list_players()
+            players.get_player("(Sample) Aragorn")
+            settings_api.get_setting("use_new_content")
+        assert (len(loads), len(sanitizes)) == (1, 1)
+        settings_api.set_settings({"use_new_content": True})
+        assert settings_api.get_setting("use_new_content") is True
+
+
+def test_sessions_not_evicted(app, client):
+    legolas = {"name": "Legolas", "ac": 15, "pp": 14, "hp": 11, "race": "Elf", "class_": "Ranger", "level": 1}
+    client.post("/players/new", data=legolas)
+    # Plenty of visitors (or crawlers) who only ever get a CSRF token
+    for _ in range(50):
+        visitor = app.test_client()
+        with visitor.session_transaction() as session:
+            session["csrf_token"] = "token"
+    assert "Legolas" in [p["name"] for p in json.loads(client.get("/api/players/list").data)]
+
+    # Their sessions expire within a day; ones with players keep the full lifetime
+    interface = app.session_interface
+    expires = [row[0] for row in interface.db.execute("SELECT expires FROM sessions ORDER BY expires")]
+    assert expires[0] - time.time() <= session_store.ANONYMOUS_SESSION_LIFETIME.total_seconds()
+    assert expires[-1] - time.time() > app.permanent_session_lifetime.total_seconds() - 60
+
+    interface._delete_expired_sessions()
+    assert "Legolas" in [p["name"] for p in json.loads(client.get("/api/players/list").data)]
@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import sys
+import threading
+import time
+
+from dmtoolkit.api.registry import LazyRegistry, load_times
+
+
+def test_loads_on_first_access():
+    calls = []
+    def loader():
+        calls.append(1)
+        return {"a": 1, "b": 2}
+
+    registry = LazyRegistry("test_first_access", loader)
+    assert not registry.loaded
+    assert registry.load_time is None
+    assert registry["a"] == 1
+    assert sorted(registry) == ["a", "b"]
+    assert registry.loaded
+    assert registry.load_time is not None
+    assert load_times()["test_first_access"] == registry.load_time
+    assert len(calls) == 1
+
+    registry.reset()
+    assert not registry.loaded
+    assert registry.get("b") == 2
+    assert len(calls) == 2
+
+
+def test_concurrent_first_access():
+    calls = []
+    barrier = threading.Barrier(8)
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"key": "value"}
+
+    registry = LazyRegistry("test_concurrent", loader)
+    def access(_):
+        barrier.wait()
+        return registry["key"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(access, range(8)))
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_import_does_not_load():
+    """Creating the app shouldn't load any of the compendium data."""
+    code = (
+        "import dmtoolkit, dmtoolkit.filters\n"
+        "dmtoolkit.init_app()\n"
+        "from dmtoolkit.api.registry import REGISTRIES\n"
+        "print(sorted(name for name, registry in REGISTRIES.items() if registry.loaded))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,54 @@
+import copy
+import json
+import re
+
+import pytest
+
+from dmtoolkit.api.models import Modifier, SkillList, SkillMod
+from dmtoolkit.api.serialize import CustomDecoder, decode_object, dump_json_string, load_json_string
+from dmtoolkit.api.snapshot import SOURCE_PATHS
+
+
+@pytest.mark.parametrize("path", [p for p in SOURCE_PATHS if p.exists()], ids=lambda p: p.name)
+def test_matches_custom_decoder(path):
+    text = path.read_text()
+    fast = json.loads(text, object_hook=decode_object)
+    slow = json.loads(text, cls=CustomDecoder)
+    assert fast == slow
+    # Same field order too, since the encoder writes fields in __dict__ order
+    assert dump_json_string(fast) == dump_json_string(slow)
+
+
+def test_defaults_and_post_init():
+    skills = load_json_string("""{
+        "__dataclass__": "SkillList",
+        "skills": [{"__dataclass__": "SkillMod", "target": "stealth", "mod": "+4 (+8 in dim light)"}]
+    }""")
+    assert skills == SkillList([SkillMod("stealth", 4, "(+8 in dim light)")])
+    assert skills.mode == "all"
+
+    modifier = load_json_string('{"__dataclass__": "Modifier", "target": "str", "mod": 2, "race": "Elf"}')
+    assert modifier == Modifier("str", 2)
+
+
+@pytest.mark.parametrize("text", [
+    '{"__dataclass__": "Modifier", "target": "str"}',
+    '{"__dataclass__": "Modifier", "target": "str", "mod": 1, "unknown": 1}',
+    '{"__dataclass__": "SkillMod", "target": "cooking", "mod": 1}',
+    '{"__dataclass__": "NotAModel"}',
+])
+def test_errors_match_custom_decoder(text):
+    with pytest.raises(Exception) as slow:
+        json.loads(text, cls=CustomDecoder)
+    with pytest.raises(type(slow.value), match=re.escape(str(slow.value))):
+        load_json_string(text)
+
+
+def test_encode_does_not_modify_objects(monsters):
+    for monster in monsters.values():
+        before = copy.deepcopy(monster.__dict__)
+        encoded = dump_json_string(monster)
+        assert monster.__dict__ == before
+        # Empty optional fields are left out, but come back as their defaults
+        assert "dmg_vulnerabilities" not in json.loads(encoded) or monster.dmg_vulnerabilities
+        assert load_json_string(encoded) == monster
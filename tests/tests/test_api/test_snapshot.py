@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import pytest
+
+from dmtoolkit.api import snapshot
+from dmtoolkit.api.models import Race
+from dmtoolkit.api.serialize import load_json
+from dmtoolkit.constants import ROOT_DIR
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """Copies a couple of data files somewhere we can modify them, and points the snapshot there."""
+    paths = []
+    for name in ("races.json", "conditions.json"):
+        paths.append(tmp_path / name)
+        shutil.copy(ROOT_DIR / "api" / "data" / name, paths[-1])
+    monkeypatch.setattr(snapshot, "SNAPSHOT_PATH", tmp_path / "compendium.snapshot")
+    monkeypatch.setattr(snapshot, "SNAPSHOT_ENABLED", True)
+    snapshot.reset()
+    yield tuple(paths)
+    snapshot.reset()
+
+
+def test_snapshot_roundtrip(sources):
+    snapshot.build_snapshot(snapshot.SNAPSHOT_PATH, sources)
+    for path in sources:
+        assert snapshot.is_fresh(path)
+        with path.open("r") as f:
+            assert snapshot.load_data_file(path) == load_json(f)
+    races = snapshot.load_data_file(sources[0])
+    assert all(isinstance(race, Race) for race in races)
+
+
+def test_snapshot_stale_source(sources):
+    races_path, conditions_path = sources
+    snapshot.build_snapshot(snapshot.SNAPSHOT_PATH, sources)
+    stat = conditions_path.stat()
+    os.utime(conditions_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert snapshot.is_fresh(races_path)
+    assert not snapshot.is_fresh(conditions_path)
+    # Stale sources are still loaded, just from the JSON instead
+    assert snapshot.load_data_file(conditions_path)
+
+
+def test_snapshot_schema_change(sources, monkeypatch):
+    snapshot.build_snapshot(snapshot.SNAPSHOT_PATH, sources)
+    monkeypatch.setattr(snapshot, "get_schema_hash", lambda: "something else")
+    snapshot.reset()
+    assert not snapshot.is_fresh(sources[0])
+
+
+def test_missing_snapshot(sources):
+    assert not snapshot.is_fresh(sources[0])
+    assert snapshot.load_data_file(sources[0])
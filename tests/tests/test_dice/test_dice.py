@@ -0,0 +1,98 @@
+import json
+from fractions import Fraction
+import random
+
+import pytest
+
+from dmtoolkit import dice
+from dmtoolkit.api.models import HP
+from dmtoolkit.dice import DiceTerm
+
+
+@pytest.mark.parametrize("expression, terms, modifier", [
+    ("2d6 + 3", (DiceTerm(2, 6, 2),), 3),
+    ("d20-1", (DiceTerm(1, 20, 1),), -1),
+    ("4d6kh3", (DiceTerm(4, 6, 3),), 0),
+    ("2d20kl1", (DiceTerm(2, 20, 1, False),), 0),
+    ("4d6dl1", (DiceTerm(4, 6, 3),), 0),
+    ("3d6dh1 - 1d4", (DiceTerm(3, 6, 2, False), DiceTerm(1, 4, 1, True, -1)), 0),
+    ("2d6*10", (DiceTerm(2, 6, 2, True, 10),), 0),
+    ("5", (), 5),
+])
+def test_compile(expression, terms, modifier):
+    compiled = dice.compile(expression)
+    assert (compiled.terms, compiled.modifier) == (terms, modifier)
+    assert dice.compile(expression) is compiled
+
+
+@pytest.mark.parametrize("expression", ["", "d", "2d", "1d6 2", "1d6 +", "0d6", "3d6kh4", "1d6*", "lots"])
+def test_compile_invalid(expression):
+    with pytest.raises(ValueError):
+        dice.compile(expression)
+
+
+@pytest.mark.parametrize("expression, low, high, mean", [
+    ("2d6 + 3", 5, 15, Fraction(10)),
+    ("4d6kh3", 3, 18, Fraction(15869, 1296)),
+    ("2d20kl1", 1, 20, Fraction(2870, 400)),
+    ("1d6*10 - 1d4", 6, 59, Fraction(65, 2)),
+    ("7", 7, 7, Fraction(7)),
+])
+def test_stats(expression, low, high, mean):
+    compiled = dice.compile(expression)
+    assert (compiled.min, compiled.max, compiled.mean) == (low, high, mean)
+    distribution = compiled.distribution()
+    assert sum(distribution.values()) == 1
+    assert (min(distribution), max(distribution)) == (low, high)
+    assert sum(total * chance for total, chance in distribution.items()) == mean
+
+
+def test_distribution():
+    assert dice.compile("2d4").distribution() == {
+        2: Fraction(1, 16), 3: Fraction(2, 16), 4: Fraction(3, 16), 5: Fraction(4, 16),
+        6: Fraction(3, 16), 7: Fraction(2, 16), 8: Fraction(1, 16),
+    }
+    # Advantage
+    assert dice.compile("2d20kh1").chance_at_least(20) == Fraction(39, 400)
+    assert dice.compile("1d20").chance_at_least(11) == Fraction(1, 2)
+    assert dice.compile("2d6").percentile(50) == 7
+    assert dice.compile("1d4").percentile(100) == 4
+    # Plain dice don't need to go through every roll, however many there are
+    assert dice.compile("40d100").mean == 2020
+    with pytest.raises(ValueError):
+        dice.compile("40d100kh39").distribution()
+
+
+@pytest.mark.parametrize("expression", ["2d6 + 3", "4d6kh3", "1d6*10 - 1d4", "40d100"])
+def test_roll(expression):
+    compiled = dice.compile(expression)
+    rng = random.Random(5)
+    rolls = [compiled.roll(rng) for _ in range(500)] + compiled.roll_many(500, rng)
+    assert all(compiled.min <= total <= compiled.max for total in rolls)
+    # The same seed rolls the same totals
+    assert compiled.roll_many(50, random.Random(1)) == compiled.roll_many(50, random.Random(1))
+
+
+def test_roll_many_matches_distribution():
+    compiled = dice.compile("3d6")
+    rolls = compiled.roll_many(20000, random.Random(0))
+    assert sum(rolls) / len(rolls) == pytest.approx(10.5, abs=0.1)
+    assert rolls.count(3) / len(rolls) == pytest.approx(1 / 216, abs=0.003)
+
+
+def test_roll_int():
+    assert dice.roll(4) == 4
+    assert 2 <= dice.roll("2d4") <= 8
+
+
+def test_hp_roll():
+    assert all(3 <= HP(10, "3d6", "").roll() <= 18 for _ in range(50))
+    # No formula, or one which can't be rolled
+    assert HP(10, "", "").roll() == 10
+    assert HP(10, "3d6 plus something", "").roll() == 10
+
+
+def test_combat_overview_roll_hp(client, monsters):
+    resp = client.get("/api/monsters-combat-overview?name=Goblin-MM&roll_hp=true")
+    assert resp.status_code == 200
+    assert 2 <= json.loads(resp.data)["hp"] <= 12
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from dmtoolkit.encounters import difficulty
+
+
+def test_party_thresholds():
+    assert difficulty.party_thresholds([1, 1, 1, 1]) == {"easy": 100, "medium": 200, "hard": 300, "deadly": 400}
+    assert difficulty.party_thresholds([3, 5], "2014") == {"easy": 325, "medium": 650, "hard": 975, "deadly": 1500}
+    assert difficulty.party_thresholds([5, 5, 5, 5], "2024") == {"low": 2000, "moderate": 3000, "high": 4400}
+
+
+@pytest.mark.parametrize("levels, rules", [([], "2014"), ([0], "2014"), ([21], "2024"), ([1], "5e")])
+def test_party_thresholds_invalid(levels, rules):
+    with pytest.raises(ValueError):
+        difficulty.party_thresholds(levels, rules)
+
+
+@pytest.mark.parametrize("num_monsters, party_size, expected", [
+    (1, 4, 1), (2, 4, 1.5), (3, 4, 2), (6, 4, 2), (7, 4, 2.5), (11, 4, 3), (15, 4, 4), (40, 4, 4),
+    (1, 2, 1.5), (15, 1, 5),
+    (1, 6, 0.5), (2, 6, 1), (15, 7, 3),
+])
+def test_encounter_multiplier(num_monsters, party_size, expected):
+    assert difficulty.encounter_multiplier(num_monsters, party_size) == expected
+
+
+def test_evaluate_many_2014():
+    # Four level 1 characters: easy 100, medium 200, hard 300, deadly 400
+    results = difficulty.evaluate_many([1, 1, 1, 1], [
+        [],
+        [(25, 1)],
+        [(50, 2)],
+        [(50, 2), (100, 1)],
+        [(200, 1), (50, 1)],
+        [(1800, 1)],
+    ])
+    assert [(r.xp, r.adjusted_xp, r.multiplier, r.difficulty) for r in results] == [
+        (0, 0, 0, "trivial"),
+        (25, 25, 1, "trivial"),
+        (100, 150, 1.5, "easy"),
+        (200, 400, 2, "deadly"),
+        (250, 375, 1.5, "hard"),
+        (1800, 1800, 1, "deadly"),
+    ]
+
+
+def test_evaluate_many_2024():
+    # Four level 1 characters: low 200, moderate 300, high 400. No multipliers.
+    results = difficulty.evaluate_many([1, 1, 1, 1], [[(50, 2)], [(50, 4)], [(100, 3)], [(50, 20)]], "2024")
+    assert [(r.adjusted_xp, r.difficulty) for r in results] == [
+        (100, "trivial"), (200, "low"), (300, "moderate"), (1000, "high"),
+    ]
+
+
+def test_evaluate(monsters):
+    result = difficulty.evaluate([3, 3, 3, 3], [(monsters["Goblin-MM"], 4), (monsters["Bugbear-MM"], 1)])
+    assert result == difficulty.EncounterDifficulty(400, 800, 2, "medium")
+
+
+def test_resolve_encounters(monsters):
+    assert difficulty.resolve_encounters([
+        ["Goblin-MM", {"key": "Goblin-MM", "count": 3}],
+        [{"key": "Lich-MM"}],
+    ]) == [[(50, 1), (50, 3)], [(33000, 1)]]
+    with pytest.raises(KeyError):
+        difficulty.resolve_encounters([["Tarrasque-MM"]])
+
+
+def test_evaluate_route(client, monsters):
+    resp = client.post("/api/encounters/evaluate", json={
+        "party": [3, 3, 3, 3],
+        "encounters": [
+            [{"key": "Goblin-MM", "count": 4}, "Bugbear-MM"],
+            ["Young Green Dragon-MM"],
+        ],
+    })
+    assert resp.status_code == 200
+    data = json.loads(resp.data)
+    assert data["rules"] == "2014"
+    assert data["thresholds"] == {"easy": 300, "medium": 600, "hard": 900, "deadly": 1600}
+    assert [e["difficulty"] for e in data["encounters"]] == ["medium", "deadly"]
+    assert data["encounters"][0]["adjusted_xp"] == 800
+
+
+@pytest.mark.parametrize("body", [
+    {"party": [3], "encounters": [["Tarrasque-MM"]]},
+    {"party": [], "encounters": [["Goblin-MM"]]},
+    {"party": [3], "rules": "3.5", "encounters": [["Goblin-MM"]]},
+    {"party": ["three"], "encounters": [["Goblin-MM"]]},
+    {"party": [3], "encounters": [[{"key": "Goblin-MM", "count": -1}]]},
+    [{"party": [3]}],
+    "party",
+])
+def test_evaluate_route_invalid(client, monsters, body):
+    resp = client.post("/api/encounters/evaluate", json=body)
+    assert resp.status_code == 400
+    assert "message" in json.loads(resp.data)
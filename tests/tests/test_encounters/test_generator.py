@@ -0,0 +1,121 @@
+import json
+import time
+
+import pytest
+
+from dmtoolkit.encounters import generator
+from dmtoolkit.encounters.difficulty import XP_BY_CR
+
+
+@pytest.fixture(autouse=True)
+def clear_caches(monsters):
+    import dmtoolkit.api.monsters as monsters_api
+
+    monsters_api.reset_monster_index()
+    generator.clear_caches()
+    yield
+    monsters_api.reset_monster_index()
+    generator.clear_caches()
+
+
+@pytest.mark.parametrize("levels, difficulty, rules", [
+    ([3, 3, 3, 3], "easy", "2014"),
+    ([3, 3, 3, 3], "medium", "2014"),
+    ([5, 5, 5, 5], "hard", "2014"),
+    ([1, 1], "deadly", "2014"),
+    ([8] * 6, "medium", "2014"),
+    ([3, 3, 3, 3], "low", "2024"),
+    ([5, 5, 5, 5], "high", "2024"),
+])
+def test_encounters_fit_difficulty(levels, difficulty, rules):
+    encounters = generator.generate_encounters(levels, difficulty, rules, count=20, seed=1)
+    assert encounters
+    for encounter in encounters:
+        assert encounter.difficulty.difficulty == difficulty
+        assert 1 <= sum(count for _, count in encounter.monsters) <= 8
+        assert len(encounter.monsters) <= 3
+        # Each group has its own CR
+        assert len({monster.cr for monster, _ in encounter.monsters}) == len(encounter.monsters)
+
+
+def test_encounters_are_unique():
+    encounters = generator.generate_encounters([3, 3, 3, 3], "medium", count=30, seed=1)
+    keys = [tuple((monster.key, count) for monster, count in encounter.monsters) for encounter in encounters]
+    assert len(keys) == len(set(keys))
+
+
+def test_seed_is_reproducible():
+    def generate(seed):
+        return [
+            [(monster.key, count) for monster, count in encounter.monsters]
+            for encounter in generator.generate_encounters([4, 4, 4, 4], "hard", count=10, seed=seed)
+        ]
+    assert generate(42) == generate(42)
+    assert generate(42) != generate(43)
+
+
+def test_filters():
+    encounters = generator.generate_encounters(
+        [2, 2, 2, 2], "medium", count=10, types=["Humanoid", "undead"], environments=["hill", "swamp"], seed=1
+    )
+    assert encounters
+    for encounter in encounters:
+        for monster, _ in encounter.monsters:
+            assert monster.maintype.lower() in ("humanoid", "undead")
+            assert {"hill", "swamp"} & {env.lower() for env in monster.environment}
+
+
+def test_limits():
+    for encounter in generator.generate_encounters([5, 5, 5, 5], "hard", count=20, max_monsters=2, max_groups=1, seed=1):
+        assert len(encounter.monsters) == 1
+        assert encounter.monsters[0][1] <= 2
+
+
+def test_nothing_fits():
+    # No group of beasts is anywhere near a deadly fight for level 20 characters
+    assert generator.generate_encounters([20] * 4, "deadly", types=["beast"], seed=1) == []
+
+
+def test_party_size_limit():
+    with pytest.raises(ValueError):
+        generator.generate_encounters([20] * (generator.MAX_PARTY_SIZE + 1), "deadly")
+
+
+@pytest.mark.parametrize("difficulty, rules", [("deadly", "2014"), ("hard", "2014"), ("high", "2024"), ("low", "2024")])
+def test_worst_case_plan(difficulty, rules):
+    """Building the knapsack table for the biggest budgets, with a bucket for every CR and the most
+    monsters the API allows, takes tens of milliseconds, not seconds."""
+    values = tuple(sorted(set(XP_BY_CR.values())))
+    for levels in ([20] * generator.MAX_PARTY_SIZE, [20] * 4, [5] * 4):
+        windows = generator._xp_windows(levels, difficulty, rules, 20)
+        start = time.perf_counter()
+        plan = generator._Plan(values, windows, 20, 3, generator._xp_unit(windows))
+        elapsed = time.perf_counter() - start
+        assert plan.finals
+        # Generous, for slow CI machines; this takes 30 ms at most normally
+        assert elapsed < 0.25
+
+
+@pytest.mark.parametrize("difficulty, rules", [("trivial", "2014"), ("deadly", "2024"), ("medium", "4e")])
+def test_invalid_difficulty(difficulty, rules):
+    with pytest.raises(ValueError):
+        generator.generate_encounters([1], difficulty, rules)
+
+
+def test_generate_route(client):
+    resp = client.post("/api/encounters/generate", json={"party": [3, 3, 3, 3], "difficulty": "hard", "count": 5, "seed": 7})
+    assert resp.status_code == 200
+    data = json.loads(resp.data)
+    assert 1 <= len(data) <= 5
+    for encounter in data:
+        assert encounter["difficulty"] == "hard"
+        assert all({"key", "name", "cr", "count"} <= monster.keys() for monster in encounter["monsters"])
+    again = client.post("/api/encounters/generate", json={"party": [3, 3, 3, 3], "difficulty": "hard", "count": 5, "seed": 7})
+    assert json.loads(again.data) == data
+
+    resp = client.post("/api/encounters/generate", json={"party": [3], "difficulty": "impossible"})
+    assert resp.status_code == 400
+    resp = client.post("/api/encounters/generate", json={"party": [20] * 30, "difficulty": "deadly"})
+    assert resp.status_code == 400
+    resp = client.post("/api/encounters/generate", json=[3, 3, 3, 3])
+    assert resp.status_code == 400
@@ -0,0 +1,205 @@
+import io
+import json
+import time
+
+import pytest
+
+from dmtoolkit.encounters import library
+from dmtoolkit.encounters.library import EncounterLibrary, SavedEncounter
+
+
+@pytest.fixture
+def encounter_library(tmp_path):
+    encounter_library = EncounterLibrary(tmp_path / "encounters.sqlite3")
+    library.set_encounter_library(encounter_library)
+    yield encounter_library
+    library.set_encounter_library(None)
+
+
+def encounter(name: str, *monsters, **fields) -> SavedEncounter:
+    return SavedEncounter.from_dict({"name": name, "monsters": list(monsters), **fields})
+
+
+def test_from_dict(monsters):
+    # The tracker's old localStorage format
+    enc = SavedEncounter.from_dict({
+        "title": "Ambush", "desc": "On the road",
+        "monsters": [{"id": "Goblin-MM", "mobsize": 3, "hasLoot": False}, {"id": "Ogre-MM", "hasXp": False}, "Goblin-MM"],
+    })
+    assert (enc.name, enc.description, enc.monster_count) == ("Ambush", "On the road", 5)
+    assert enc.total_xp == 4 * monsters["Goblin-MM"].xp
+    assert enc.monsters[0] == {"id": "Goblin-MM", "mobsize": 3, "hasLoot": False}
+
+
+@pytest.mark.parametrize("data", [
+    [],
+    {"name": ""},
+    {"name": "x", "monsters": [{"mobsize": 2}]},
+    {"name": "x", "monsters": [{"id": "Goblin-MM", "mobsize": 0}]},
+    {"name": "x", "tags": "boss"},
+    {"name": "x", "party_level": 21},
+])
+def test_from_dict_invalid(data):
+    with pytest.raises(ValueError):
+        SavedEncounter.from_dict(data)
+
+
+def test_save(encounter_library, monsters):
+    saved = encounter_library.save("me", encounter("Ambush", "Goblin-MM", tags=["road", "goblins"]))
+    assert saved.id is not None
+    # Names are unique per owner (whatever the case), so saving again replaces the encounter
+    again = encounter_library.save("me", encounter("AMBUSH", "Ogre-MM", tags=["road"]))
+    assert again.id == saved.id
+    loaded = encounter_library.get("me", saved.id)
+    assert (loaded.name, loaded.monsters, loaded.tags) == ("AMBUSH", [{"id": "Ogre-MM"}], ["road"])
+    assert encounter_library.tags("me") == [("road", 1)]
+
+    # Owners only see their own encounters
+    assert encounter_library.get("you", saved.id) is None
+    assert not encounter_library.delete("you", saved.id)
+    assert encounter_library.delete("me", saved.id)
+    assert encounter_library.get("me", saved.id) is None
+    assert encounter_library.tags("me") == []
+
+
+def test_search(encounter_library, monsters):
+    encounter_library.import_encounters("me", [
+        encounter("Goblin Ambush", {"id": "Goblin-MM", "mobsize": 4}, tags=["road"], party_level=2),
+        encounter("Ogre Bridge", "Ogre-MM", tags=["road", "boss"], party_level=3),
+        encounter("Lone Goblin", "Goblin-MM", party_level=1),
+        encounter("100% Ogre", "Ogre-MM"),
+    ])
+    encounter_library.save("you", encounter("Goblin Party", "Goblin-MM"))
+
+    def names(**kwargs):
+        return [enc.name for enc in encounter_library.search("me", **kwargs)[0]]
+
+    assert names() == ["100% Ogre", "Goblin Ambush", "Lone Goblin", "Ogre Bridge"]
+    assert names(query="goblin") == ["Goblin Ambush", "Lone Goblin"]
+    assert names(query="%") == ["100% Ogre"]
+    assert names(tags=["road"]) == ["Goblin Ambush", "Ogre Bridge"]
+    assert names(tags=["road", "BOSS"]) == ["Ogre Bridge"]
+    assert names(min_xp=monsters["Ogre-MM"].xp, sort="-xp")[-1] == "Ogre Bridge"
+    assert names(max_xp=monsters["Goblin-MM"].xp) == ["Lone Goblin"]
+    assert names(party_level=2) == ["Goblin Ambush"]
+    assert names(sort="level") == ["100% Ogre", "Lone Goblin", "Goblin Ambush", "Ogre Bridge"]
+
+    page, total = encounter_library.search("me", per_page=3, page=2)
+    assert ([enc.name for enc in page], total) == (["Ogre Bridge"], 4)
+    # Summaries leave out the monsters
+    assert page[0].monsters == []
+    with pytest.raises(ValueError):
+        encounter_library.search("me", sort="monsters")
+
+
+def test_large_library(encounter_library, monsters):
+    """Browsing stays quick with thousands of encounters."""
+    encounter_library.import_encounters("me", [
+        encounter(f"Encounter {i:05}", {"id": "Goblin-MM", "mobsize": i % 20 + 1}, tags=[f"tag{i % 10}"],
+                  party_level=i % 20 + 1)
+        for i in range(5000)
+    ])
+    encounter_library.import_encounters("you", [encounter(f"Encounter {i}", "Ogre-MM") for i in range(5000)])
+    start = time.perf_counter()
+    for page in range(1, 21):
+        for kwargs in ({}, {"sort": "-xp"}, {"tags": ["tag3"]}, {"party_level": 7}, {"query": "01"}):
+            encounters, total = encounter_library.search("me", page=page, per_page=50, **kwargs)
+            assert len(encounters) == min(max(total - (page - 1) * 50, 0), 50)
+    elapsed = time.perf_counter() - start
+    # 100 page loads; generous, for slow CI machines
+    assert elapsed < 5
+    assert len(list(encounter_library.export("me", batch_size=700))) == 5000
+
+
+def test_routes(client, encounter_library, monsters):
+    assert json.loads(client.get("/api/encounters/library").data)["total"] == 0
+    resp = client.post("/api/encounters/library", json={"name": "Ambush", "monsters": [{"id": "Goblin-MM"}], "tags": ["road"]})
+    saved = json.loads(resp.data)
+    assert (saved["name"], saved["total_xp"]) == ("Ambush", monsters["Goblin-MM"].xp)
+    assert client.post("/api/encounters/library", json={"monsters": []}).status_code == 400
+
+    data = json.loads(client.get("/api/encounters/library/search?q=amb&tag=road").data)
+    assert (data["total"], data["encounters"][0]["id"]) == (1, saved["id"])
+    assert "monsters" not in data["encounters"][0]
+    assert client.get("/api/encounters/library?sort=nope").status_code == 400
+    assert json.loads(client.get(f"/api/encounters/library/{saved['id']}").data)["monsters"] == [{"id": "Goblin-MM"}]
+    assert json.loads(client.get("/api/encounters/library/tags").data) == [{"tag": "road", "count": 1}]
+
+    # Someone else's library is empty
+    other = client.application.test_client()
+    assert json.loads(other.get("/api/encounters/library").data)["total"] == 0
+    assert other.get(f"/api/encounters/library/{saved['id']}").status_code == 404
+
+    assert client.delete(f"/api/encounters/library/{saved['id']}").status_code == 200
+    assert client.delete(f"/api/encounters/library/{saved['id']}").status_code == 404
+
+
+def test_import_export(client, encounter_library, monsters):
+    # What the tracker kept in localStorage
+    old = {
+        "Mines of Moria": {"title": "Mines of Moria", "desc": "Goblins", "monsters": [{"id": "Goblin-MM"}]},
+        "Ogres": {"title": "Ogres", "desc": "", "monsters": [{"id": "Ogre-MM", "mobsize": 2}]},
+    }
+    assert json.loads(client.post("/api/encounters/library/import", json=old).data) == {"imported": 2}
+
+    resp = client.get("/api/encounters/library/export")
+    assert "attachment" in resp.headers["Content-Disposition"]
+    exported = json.loads(resp.data)
+    assert [enc["name"] for enc in exported["encounters"]] == ["Mines of Moria", "Ogres"]
+
+    # An export can be uploaded into another library as it is
+    other = client.application.test_client()
+    file = (io.BytesIO(resp.data), "encounters.json")
+    resp = other.post("/api/encounters/library/import", data={"file": file}, content_type="multipart/form-data")
+    assert json.loads(resp.data) == {"imported": 2}
+    assert json.loads(other.get("/api/encounters/library?sort=-xp").data)["encounters"][0]["name"] == "Ogres"
+
+    bad = (io.BytesIO(b"{not json"), "encounters.json")
+    assert other.post("/api/encounters/library/import", data={"file": bad}).status_code == 400
+    assert client.post("/api/encounters/library/import", json=[{"name": ""}]).status_code == 400
+
+
+def test_import_legacy_mobsize(client, encounter_library, monsters):
+    # The tracker saved mob sizes it couldn't parse (NaN) as null
+    old = {"Ambush": {"title": "Ambush", "desc": "", "monsters": [{"id": "Goblin-MM", "mobsize": None}]}}
+    assert json.loads(client.post("/api/encounters/library/import", json=old).data) == {"imported": 1}
+    encounter = json.loads(client.get("/api/encounters/library").data)["encounters"][0]
+    assert encounter["monster_count"] == 1
+    # Only the old format gets away with it
+    new = [{"name": "Ambush", "monsters": [{"id": "Goblin-MM", "mobsize": None}]}]
+    assert client.post("/api/encounters/library/import", json=new).status_code == 400
+
+
+def test_library_outlives_session(app, client, encounter_library, monsters):
+    client.post("/api/encounters/library", json={"name": "Ambush", "monsters": [{"id": "Goblin-MM"}]})
+    library_id = client.get_cookie(app.config["LIBRARY_COOKIE_NAME"]).value
+    # The session is gone (it expired, or the store lost it), but the library isn't
+    client.delete_cookie(app.config["SESSION_COOKIE_NAME"])
+    app.session_interface.db.execute("DELETE FROM sessions")
+    assert json.loads(client.get("/api/encounters/library").data)["total"] == 1
+    assert json.loads(client.get("/api/encounters/library/key").data) == {"library_id": library_id}
+
+
+def test_library_key(app, client, encounter_library, monsters):
+    client.post("/api/encounters/library", json={"name": "Ambush", "monsters": [{"id": "Goblin-MM"}]})
+    library_id = json.loads(client.get("/api/encounters/library/key").data)["library_id"]
+
+    # Another browser (or this one, once the cookie's gone) opens the library with its key
+    other = app.test_client()
+    assert json.loads(other.get("/api/encounters/library").data)["total"] == 0
+    resp = other.post("/api/encounters/library/key", json={"library_id": f" {library_id.upper()} "})
+    assert json.loads(resp.data) == {"library_id": library_id, "total": 1}
+    assert json.loads(other.get("/api/encounters/library").data)["encounters"][0]["name"] == "Ambush"
+
+    for body in ({"library_id": "../etc"}, {"library_id": 12}, {}, ["nope"]):
+        assert other.post("/api/encounters/library/key", json=body).status_code == 400
+
+
+def test_library_id_moves_out_of_session(app, client, encounter_library, monsters):
+    with client.session_transaction() as session:
+        session["library_id"] = "ab" * 16
+    encounter_library.save("ab" * 16, encounter("Ambush", {"id": "Goblin-MM"}))
+    assert json.loads(client.get("/api/encounters/library").data)["total"] == 1
+    assert client.get_cookie(app.config["LIBRARY_COOKIE_NAME"]).value == "ab" * 16
+    with client.session_transaction() as session:
+        assert "library_id" not in session
@@ -0,0 +1,141 @@
+import json
+
+import pytest
+
+from dmtoolkit.encounters import simulator
+from dmtoolkit.encounters.simulator import Combatant, Damage
+
+
+def last(summaries):
+    return list(summaries)[-1]
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("1d6", Damage(((1, 6),), 0)),
+    ("2d10 + 8", Damage(((2, 10),), 8)),
+    ("1d4 - 1", Damage(((1, 4),), -1)),
+    ("2d6+1d8+3", Damage(((2, 6), (1, 8)), 3)),
+    ("5", Damage((), 5)),
+])
+def test_parse_damage(expression, expected):
+    assert simulator.parse_damage(expression) == expected
+
+
+def test_monster_combatant(monsters):
+    dragon = simulator.monster_combatant(monsters["Adult Red Dragon-MM"])
+    # Multiattack with its bite, which adds fire damage on top
+    assert (dragon.hp, dragon.ac, dragon.to_hit, dragon.attacks) == (256, 19, 14, 3)
+    assert dragon.damage == Damage(((2, 10), (2, 6)), 8)
+
+    # Only the melee damage of an attack which can also be thrown
+    bugbear = simulator.monster_combatant(monsters["Bugbear-MM"])
+    assert (bugbear.to_hit, bugbear.attacks, bugbear.damage) == (4, 1, Damage(((2, 8),), 2))
+
+
+def test_parse_character():
+    assert simulator.parse_character(5) == simulator.character_combatant(5)
+    character = simulator.parse_character({"level": 3, "name": "Ser Bob", "ac": 18, "damage": "2d6 + 3"})
+    assert (character.name, character.ac, character.damage) == ("Ser Bob", 18, Damage(((2, 6),), 3))
+    assert character.hp == simulator.character_combatant(3).hp
+    with pytest.raises(ValueError):
+        simulator.parse_character(0)
+
+
+def test_hopeless_fight():
+    party = [Combatant("Commoner", 4, 10, 2, Damage(((1, 4),), 0))]
+    monsters = [Combatant("Dragon", 500, 22, 15, Damage(((4, 10),), 10), attacks=3)]
+    result = last(simulator.simulate(party, monsters, trials=200, seed=1, workers=1))
+    assert result.done
+    assert result.tpk_chance == 1
+    assert result.mean_downed == 1
+    # The party never takes more damage than they have HP
+    assert result.damage_percentiles == {"p10": 4, "p25": 4, "p50": 4, "p75": 4, "p90": 4}
+
+
+def test_harmless_fight():
+    party = [simulator.character_combatant(10) for _ in range(4)]
+    monsters = [Combatant("Rat", 1, 10, 0, Damage((), 0), attacks=0)]
+    result = last(simulator.simulate(party, monsters, trials=100, seed=1, workers=1))
+    assert (result.tpk_chance, result.mean_damage, result.mean_rounds) == (0, 0, 1)
+
+
+def test_streams_until_converged():
+    party = [simulator.character_combatant(3) for _ in range(4)]
+    monsters = [simulator.character_combatant(3) for _ in range(3)]
+    summaries = list(simulator.simulate(party, monsters, trials=50_000, seed=1, batch_size=250, tolerance=0.05, workers=1))
+    assert [s.trials for s in summaries] == [250 * (i + 1) for i in range(len(summaries))]
+    assert [s.done for s in summaries] == [False] * (len(summaries) - 1) + [True]
+    assert summaries[-1].trials < 50_000
+    assert summaries[-1].tpk_margin <= 0.05
+    percentiles = summaries[-1].damage_percentiles
+    assert list(percentiles.values()) == sorted(percentiles.values())
+
+
+def test_time_budget():
+    party = [simulator.character_combatant(3) for _ in range(4)]
+    monsters = [simulator.character_combatant(3) for _ in range(3)]
+    summaries = list(simulator.simulate(party, monsters, trials=50_000, seed=1, time_budget=0, tolerance=0, workers=1))
+    assert len(summaries) == 1 and summaries[0].done
+
+
+def test_deadline_within_batch():
+    party = [simulator.character_combatant(3) for _ in range(4)]
+    monsters = [simulator.character_combatant(3) for _ in range(3)]
+    # A deadline that has already passed still runs one trial, so there's something to report
+    damage, _, _, _ = simulator._run_batch(party, monsters, 500, "1", simulator.MAX_ROUNDS, deadline=0)
+    assert sum(damage.values()) == 1
+
+
+def test_seed_is_deterministic_across_workers():
+    party = [simulator.character_combatant(4) for _ in range(4)]
+    monsters = [simulator.character_combatant(5) for _ in range(3)]
+    def run(workers):
+        result = last(simulator.simulate(party, monsters, trials=1200, seed=7, batch_size=300, tolerance=0, workers=workers))
+        return result._replace(elapsed=0)
+    try:
+        assert run(1) == run(2)
+    finally:
+        simulator.shutdown_pool()
+    assert run(1) != last(simulator.simulate(party, monsters, trials=1200, seed=8, batch_size=300, tolerance=0, workers=1))._replace(elapsed=0)
+
+
+def test_simulate_route(app, client, monsters):
+    app.config["SIMULATION_WORKERS"] = 1
+    resp = client.post("/api/encounters/simulate", json={
+        "party": [3, 3, {"level": 3, "ac": 20}],
+        "monsters": [{"key": "Goblin-MM", "count": 3}, "Bugbear-MM"],
+        "trials": 2000,
+        "seed": 3,
+    })
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    summaries = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert summaries[-1]["done"] and summaries[-1]["seed"] == 3
+    assert 0 <= summaries[-1]["tpk_chance"] <= 1
+    assert set(summaries[-1]["damage_percentiles"]) == {"p10", "p25", "p50", "p75", "p90"}
+
+
+@pytest.mark.parametrize("body", [
+    {"party": [3], "monsters": ["Tarrasque-MM"]},
+    {"party": [], "monsters": ["Goblin-MM"]},
+    {"party": [3], "monsters": []},
+    {"party": [{"level": 3, "damage": "lots"}], "monsters": ["Goblin-MM"]},
+    # Too much work for one request
+    {"party": [3], "monsters": [{"key": "Goblin-MM", "count": 300_000}]},
+    {"party": [3] * 13, "monsters": ["Goblin-MM"]},
+    {"party": [{"level": 3, "damage": "3000000d1"}], "monsters": ["Goblin-MM"]},
+    {"party": [{"level": 3, "damage": "1d1000000"}], "monsters": ["Goblin-MM"]},
+    {"party": [{"level": 3, "attacks": 1000}], "monsters": ["Goblin-MM"]},
+    {"party": [{"level": 3, "hp": 10**9}], "monsters": ["Goblin-MM"]},
+    # NaN and Infinity parse as JSON but would never hit the deadline
+    {"party": [3], "monsters": ["Goblin-MM"], "time_budget": float("nan")},
+    {"party": [3], "monsters": ["Goblin-MM"], "trials": float("inf")},
+    {"party": [3], "monsters": ["Goblin-MM"], "seed": float("nan")},
+    [{"party": [3], "monsters": ["Goblin-MM"]}],
+    42,
+])
+def test_simulate_route_invalid(app, client, monsters, body):
+    app.config["SIMULATION_WORKERS"] = 1
+    resp = client.post("/api/encounters/simulate", json=body)
+    assert resp.status_code == 400
+    assert "message" in json.loads(resp.data)
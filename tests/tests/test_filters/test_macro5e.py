@@ -0,0 +1,179 @@
+import json
+import re
+
+import pytest
+
+from dmtoolkit import init_app
+from dmtoolkit.constants import ROOT_DIR
+from dmtoolkit.filters import Macro5e
+
+CORPUS_PATHS = (
+    ROOT_DIR / "api/data/items.json",
+    ROOT_DIR / "api/data/srd_items.json",
+    ROOT_DIR / "api/data/spells.json",
+    *sorted((ROOT_DIR / "inittracker/data/monsters").glob("*.json")),
+    ROOT_DIR / "modules/kibbles/items.json",
+    ROOT_DIR / "modules/kibbles/ingredients.json",
+    ROOT_DIR / "modules/kibbles/variants.json",
+)
+
+# The original renderer ran every pattern below over the whole text, one after the other. It's
+#   kept here as a reference so we can prove the single-pass renderer gives the same results. The
+#   only intentional difference is the 'sense', 'scaledamage', and 'scaledice' macros, which used
+#   to be replaced with a '\x01' character, and 'language', which used to never match.
+LEGACY_RENDERERS = {
+    r"{@actResponse}": r"<em>Response: </em>",
+    r"{@actSave (\w+)}": Macro5e.render_act_save,
+    r"{@actSaveFail}": r"<em>Failure: </em>",
+    r"{@actSaveFailBy (\d+)}": r"<em>Failure by \1 or More: ",
+    r"{@actSaveSuccess}": r"<em>Success: </em>",
+    r"{@actSaveSuccessOrFail}": r"<em>Failure or Success: </em>",
+    r"{@actTrigger}": r"<em>Trigger: </em>",
+    r"{@action ([\w\s]+)}": r"\1 Action",
+    r"{@adventure (.*?)}": Macro5e.render_adventure,
+    r"{@area (.*?)}": Macro5e.render_area,
+    r"{@atk (.*?)}": Macro5e.render_atk,
+    r"{@atkr (.*?)}": Macro5e.render_atkr,
+    r"{@b (.*?)}": r"<strong>\1</strong>",
+    r"{@book ([^|}]+).*?}": r"\1",
+    r"{@card ([^|}]+).*?}": r"\1",
+    r"{@chance (.*?)}": Macro5e.render_chance,
+    r"{@class (.*?)}": Macro5e.render_class,
+    r"{@classFeature ([^|}]+).*?}": r"\1",
+    r"{@color (.*?)\|(.*?)}": r'<span style="color: \2">\1</span>',
+    r"{@condition (\w+)}": Macro5e.render_condition,
+    r"{@creature (.*?)}": Macro5e.render_creatures,
+    r"{@d20 ([\-\+]\d+)}": Macro5e.render_d20_mod,
+    r"{@damage (.*?)}": r"\1",
+    r"{@dc (\d+)}": r"DC \1",
+    r"{@deck (.*?)}": Macro5e.render_deck,
+    r"{@deity (.*?)}": r"\1",
+    r"{@dice (\d+)?d(\d+)}": Macro5e.render_dice,
+    r"{@disease ([^|}]+).*?}": r"\1",
+    r"{@filter ([^|}]+).*?}": r"\1",
+    r"{@h}": r"<em>Hit: </em>",
+    r"{@hazard (.*?)}": Macro5e.render_hazard,
+    r"{@hit (.*?)}": Macro5e.render_hit,
+    r"{@hom}": r"<em>Hit or Miss: </em>",
+    r"{@item (.*?)}": Macro5e.render_item,
+    r"{@language (.*?)}": Macro5e.render_language,
+    r"{@link (.*?)\|(.*?)}": r"""<a href="\2">\1</a>""",
+    r"{@note (.*?)}": r"""<span class="note">\1</span>""",
+    r"{@object (.*?)}": Macro5e.render_object,
+    r"{@optfeature ([^|}]+).*?}": r"\1",
+    r"{@quickref (.*?)}": Macro5e.render_quickref,
+    r"{@race ([^|}]+).*?}": r"\1",
+    r"{@recharge ([^|}]+).*?}": r"(Recharge \1-6)",
+    r"{@scaledamage \dd\d\|\d-\d\|(\dd\d)}": r"\1",
+    r"{@scaledice \dd\d\|\d-\d\|(\dd\d)}": r"\1",
+    r"{@sense (.*?)}": r"\1",
+    r"{@skill (.*?)}": Macro5e.render_skill,
+    r"{@skillCheck \w+ ([\-\+]?\d+)}": Macro5e.render_skillcheck,
+    r"{@spell (.*?)}": Macro5e.render_spell,
+    r"{@status (\w+)(?:\s*\|\|\s*(\w+))?}": Macro5e.render_status,
+    r"{@subclassFeature ([^|}]+).*?}": r"\1",
+    r"{@table ([^|}]+).*?}": r"\1",
+    r"{@variantrule ([^|}]+).*?}": r"\1",
+    r"{@i(?:talics)? (.*?)}": r"<em>\1</em>",
+}
+
+
+def legacy_render_macros(text: str) -> str:
+    for pattern, renderer in LEGACY_RENDERERS.items():
+        text = re.sub(pattern, renderer, text)
+    return text
+
+
+def _collect_strings(obj, strings: set[str]):
+    if isinstance(obj, str):
+        if "{@" in obj:
+            strings.add(obj)
+    elif isinstance(obj, list):
+        for item in obj:
+            _collect_strings(item, strings)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            _collect_strings(item, strings)
+
+
+def _build_corpus() -> list[str]:
+    strings: set[str] = set()
+    for path in CORPUS_PATHS:
+        with path.open("r") as f:
+            _collect_strings(json.load(f), strings)
+    # Braces nested inside a macro (other macros, or 5e.tools template variables) were rendered
+    #   outer-first (and often mangled) by the old renderer, so they're tested separately below.
+    return sorted(s for s in strings if not re.search(r"{@[^{}]*{", s))
+
+
+@pytest.fixture(scope="module")
+def app_context():
+    app = init_app()
+    with app.test_request_context():
+        yield
+
+
+def test_render_macros_corpus(app_context):
+    """Every macro string in the monster, spell, and item data must render exactly as before."""
+    corpus = _build_corpus()
+    assert corpus
+    mismatches = [text for text in corpus if Macro5e.render_macros(text) != legacy_render_macros(text)]
+    assert not mismatches, f"{len(mismatches)} strings rendered differently, e.g. {mismatches[:3]}"
+
+
+@pytest.mark.parametrize(("text", "expected"), (
+    ("No macros here", "No macros here"),
+    ("{@h}{@damage 5 (1d6 + 2)}", "<em>Hit: </em>5 (1d6 + 2)"),
+    ("{@dc 15} and {@dc x}", "DC 15 and {@dc x}"),
+    ("{@recharge}", "{@recharge}"),
+    ("{@unknown thing} {@b bold}", "{@unknown thing} <strong>bold</strong>"),
+    ("{@i 3rd-level {@variantrule optional class features|tce|optional feature}}", "<em>3rd-level optional class features</em>"),
+    ("{@b {@i nested {@dice d8}}}", "<strong><em>nested 1d8</em></strong>"),
+    ("{@sense blindsight|XPHB}", "blindsight|XPHB"),
+))
+def test_render_macros(app_context, text: str, expected: str):
+    assert Macro5e.render_macros(text) == expected
+
+
+def test_render_macros_cache(app_context):
+    """Rendering the same text twice should be served from the cache the second time."""
+    Macro5e.cache.clear()
+    text = "{@atk mw} {@hit 5} to hit"
+    first = Macro5e.render_macros(text)
+    assert Macro5e.cache_info().misses == 1
+    assert Macro5e.render_macros(text) == first
+    info = Macro5e.cache_info()
+    assert (info.hits, info.misses, info.size) == (1, 1, 1)
+
+
+def test_render_macros_cache_ignores_plain_text(app_context):
+    Macro5e.cache.clear()
+    Macro5e.render_macros("Multiattack. The lich makes two attacks.")
+    assert Macro5e.cache_info().size == 0
+
+
+def test_render_macros_cache_keyed_by_script_root():
+    """Item and spell links depend on the URL the app is served under, so a different prefix must
+    not reuse cached HTML."""
+    Macro5e.cache.clear()
+    app = init_app()
+    text = "{@spell fireball}"
+    with app.test_request_context("/"):
+        html = Macro5e.render_macros(text)
+    with app.test_request_context("/", base_url="http://localhost/dmtools/"):
+        prefixed_html = Macro5e.render_macros(text)
+    assert "/dmtools/tooltips/spells/" in prefixed_html
+    assert html != prefixed_html
+    assert Macro5e.cache_info().size == 2
+
+
+def test_render_macros_cache_eviction(app_context):
+    Macro5e.cache.clear()
+    Macro5e.cache.resize(2)
+    try:
+        for dc in (10, 12, 14):
+            Macro5e.render_macros(f"{{@dc {dc}}}")
+        info = Macro5e.cache_info()
+        assert (info.size, info.evictions) == (2, 1)
+    finally:
+        Macro5e.cache.resize(4096)
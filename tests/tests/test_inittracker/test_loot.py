@@ -0,0 +1,63 @@
+import json
+import random
+
+from dmtoolkit.api.items import get_item
+from dmtoolkit.inittracker.loot import loot, loot_many
+from dmtoolkit.modules.models import ItemWrapper, LootResponse
+
+
+def test_loot_drops_items(monsters, monkeypatch):
+    # Always drop the monster's weapons and armor
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    response = loot(monsters["Ogre-MM"])
+    assert sorted(wrapper.item.id() for wrapper in response.items) == ["greatclub|phb", "hide armor|phb", "javelin|phb"]
+    assert all(wrapper.quantity == 1 for wrapper in response.items)
+
+
+def test_loot_response_add():
+    club, javelin = get_item("greatclub|phb"), get_item("javelin|phb")
+    total = LootResponse([ItemWrapper(club, 1)], 10, "Takes 1 minute") + LootResponse(
+        [ItemWrapper(club, 2), ItemWrapper(javelin, 3), ItemWrapper(club, 1, "Broken")], 5, "Takes 1 minute"
+    )
+    assert total.coinage == 15
+    assert total.note == "Takes 1 minute"
+    assert sorted((w.item.id(), w.quantity, w.note) for w in total.items) == [
+        ("greatclub|phb", 1, "Broken"), ("greatclub|phb", 3, ""), ("javelin|phb", 3, ""),
+    ]
+
+
+def test_loot_many(monsters):
+    club = get_item("greatclub|phb")
+    def generate(monster):
+        return LootResponse([ItemWrapper(club, 1)], monster.xp, note=f"From {monster.name}")
+
+    total = loot_many([(monsters["Ogre-MM"], 3), (monsters["Goblin-MM"], 2)], generate)
+    assert total.coinage == 3 * 450 + 2 * 50
+    assert total.note == ""
+    assert sorted((w.quantity, w.note) for w in total.items) == [(2, "From Goblin"), (3, "From Ogre")]
+
+    # Monsters of the same kind are looted all at once, when the generator can
+    calls = []
+    def generate_many(monster, count):
+        calls.append((monster.name, count))
+        return [generate(monster) for _ in range(count)]
+
+    total = loot_many([(monsters["Ogre-MM"], 3), (monsters["Goblin-MM"], 2)], generate, generate_many)
+    assert calls == [("Ogre", 3), ("Goblin", 2)]
+    assert total.coinage == 3 * 450 + 2 * 50
+
+
+def test_encounter_loot_route(client, monsters):
+    resp = client.post("/api/encounters/loot", json={"monsters": [{"key": "Goblin-MM", "count": 20}, "Ogre-MM"]})
+    assert resp.status_code == 200
+    loot = json.loads(resp.data)
+    assert loot["total"] == loot["gp"] * 100 + loot["sp"] * 10 + loot["cp"]
+    assert loot["total"] > 0
+    assert all({"id", "quantity", "note"} <= item.keys() for item in loot["items"])
+
+    resp = client.post("/api/encounters/loot", json={"monsters": ["Tarrasque-MM"]})
+    assert resp.status_code == 400
+    resp = client.post("/api/encounters/loot", json={"monsters": [{"key": "Goblin-MM", "count": 5000}]})
+    assert resp.status_code == 400
+    resp = client.post("/api/encounters/loot", json=["Goblin-MM"])
+    assert resp.status_code == 400
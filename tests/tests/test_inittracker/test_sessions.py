@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+
+import pytest
+
+from dmtoolkit.inittracker import sessions
+from dmtoolkit.inittracker.sessions import RedisTrackerStore, TrackerSession, TrackerStore
+
+
+@pytest.fixture
+def session():
+    session = TrackerSession("test")
+    session.add({"name": "Goblin", "key": "Goblin-MM", "max_hp": 7, "init_mod": 2, "initiative": 12})
+    session.add({"name": "Aragorn", "type": "player", "max_hp": 12, "initiative": 15})
+    session.add({"name": "Orc", "key": "Orc-MM", "max_hp": 15, "mobsize": 3, "initiative": 12})
+    return session
+
+
+def test_add(session):
+    assert session.version == 3
+    assert session.order() == ["c2", "c1", "c3"]
+    orcs = session.get("c3")
+    assert (orcs.hp, orcs.remaining, orcs.dead) == (45, 3, False)
+
+    changes = session.add({"name": "Zombie", "max_hp": 22, "hp": 0})
+    assert changes == [{"op": "add", "combatant": {
+        "id": "c4", "name": "Zombie", "type": "npc", "key": "", "ac": 10, "hp": 0, "max_hp": 22,
+        "initiative": None, "init_mod": 0, "xp": 0, "mobsize": 1, "remaining": 0,
+        "statuses": ["incapacitated"], "dead": True, "has_xp": True, "has_loot": True,
+    }}]
+
+
+@pytest.mark.parametrize("values", [
+    {"name": "Goblin", "mobsize": 0},
+    {"name": "Goblin", "type": "dragon"},
+    {"name": "Goblin", "hp": "lots"},
+    {"name": "Goblin", "dead": True},
+    {"name": "Goblin", "speed": 30},
+])
+def test_add_invalid(values):
+    with pytest.raises(ValueError):
+        TrackerSession("test").add(values)
+
+
+def test_damage(session):
+    assert session.damage("c1", 3) == [{"op": "update", "id": "c1", "fields": {"hp": 4}}]
+    assert session.damage("c1", 10) == [{"op": "update", "id": "c1", "fields": {
+        "hp": 0, "dead": True, "statuses": ["incapacitated"], "remaining": 0,
+    }}]
+    assert session.damage("c1", -2) == [{"op": "update", "id": "c1", "fields": {
+        "hp": 2, "dead": False, "statuses": [], "remaining": 1,
+    }}]
+    # A mob loses its members as it takes damage
+    assert session.damage("c3", 16) == [{"op": "update", "id": "c3", "fields": {"hp": 29, "remaining": 2}}]
+    with pytest.raises(KeyError):
+        session.damage("c9", 1)
+
+
+def test_update(session):
+    # Doubling a mob at 2/3 HP keeps it at 2/3 HP
+    session.damage("c3", 15)
+    assert session.update("c3", {"mobsize": 6}) == [{"op": "update", "id": "c3", "fields": {
+        "mobsize": 6, "hp": 60, "remaining": 4,
+    }}]
+    assert session.update("c1", {"name": "Goblin Boss", "has_loot": False}) == [
+        {"op": "update", "id": "c1", "fields": {"name": "Goblin Boss", "has_loot": False}}
+    ]
+    # Nothing changes, so the version doesn't either
+    version = session.version
+    assert session.update("c1", {"ac": 10}) == []
+    assert session.version == version
+    with pytest.raises(ValueError):
+        session.update("c1", {"statuses": []})
+
+
+def test_statuses(session):
+    assert session.set_statuses("c1", add=["prone", "poisoned", "prone"]) == [
+        {"op": "update", "id": "c1", "fields": {"statuses": ["prone", "poisoned"]}}
+    ]
+    assert session.set_statuses("c1", add=["prone"]) == []
+    assert session.set_statuses("c1", add=["blinded"], remove=["prone"]) == [
+        {"op": "update", "id": "c1", "fields": {"statuses": ["poisoned", "blinded"]}}
+    ]
+
+
+def test_turns(session):
+    assert session.next_turn() == [{"op": "turn", "turn": "c2", "round": 1}]
+    session.next_turn()
+    session.next_turn()
+    assert (session.turn, session.round) == ("c3", 1)
+    assert session.next_turn() == [{"op": "turn", "turn": "c2", "round": 2}]
+    assert session.next_turn(-1) == [{"op": "turn", "turn": "c3", "round": 1}]
+
+    # Downed monsters are skipped, but downed players aren't
+    session.damage("c1", 7)
+    session.damage("c2", 12)
+    session.next_turn()
+    assert session.next_turn() == [{"op": "turn", "turn": "c3", "round": 2}]
+
+    # Removing whoever's turn it is passes the turn on
+    assert session.remove("c3") == [{"op": "remove", "id": "c3"}, {"op": "turn", "turn": "c2", "round": 2}]
+
+
+def test_initiative(session):
+    assert session.set_initiative({"c1": 20}) == [{"op": "update", "id": "c1", "fields": {"initiative": 20}}]
+    assert session.order() == ["c1", "c2", "c3"]
+    changes = session.roll_initiative()
+    assert {change["id"] for change in changes} <= {"c1", "c3"}
+    assert 3 <= session.get("c1").initiative <= 22
+
+
+@pytest.mark.parametrize("values", [
+    {"c1": 15, "c2": "abc"},
+    {"c1": 15, "c9": 3},
+    {"c1": 15, "c2": 2.5},
+])
+def test_initiative_invalid(session, values):
+    with pytest.raises((KeyError, ValueError)):
+        session.set_initiative(values)
+    # Nothing changes unless every value is valid
+    assert session.get("c1").initiative == 12
+    assert session.version == 3
+    assert session.changes_since(3) == []
+
+
+def test_changes_since(session):
+    assert session.changes_since(3) == []
+    session.damage("c1", 1)
+    session.damage("c1", 1)
+    assert session.changes_since(3) == [
+        {"op": "update", "id": "c1", "fields": {"hp": 6}},
+        {"op": "update", "id": "c1", "fields": {"hp": 5}},
+    ]
+    assert session.changes_since(9) is None
+    for _ in range(sessions.HISTORY_SIZE):
+        session.next_turn()
+    assert session.changes_since(4) is None
+    assert len(session.changes_since(5)) == sessions.HISTORY_SIZE
+    assert len(session.changes_since(session.version - 10)) == 10
+
+
+def test_store():
+    store = TrackerStore(maxsize=2)
+    for name in ("a", "b", "c"):
+        store.save(TrackerSession(name))
+    assert store.get("a") is None
+    assert store.get("c").id == "c"
+    store.delete("c")
+    assert store.get("c") is None
+
+
+def test_redis_store(session, monkeypatch):
+    """Every process sees the same sessions, and hears about every change."""
+    redis = pytest.importorskip("redis")
+    url = os.environ.get("TEST_REDIS_URL", "redis://localhost:6379")
+    try:
+        redis.Redis.from_url(url).ping()
+    except redis.ConnectionError:
+        pytest.skip("Needs a redis server (set TEST_REDIS_URL)")
+    heard = threading.Event()
+    monkeypatch.setattr(sessions, "_LISTENERS", [lambda session_id, version: heard.set()])
+    store = RedisTrackerStore(redis.Redis.from_url(url), prefix="test-tracker:")
+    store.listen()
+    monkeypatch.setattr(sessions, "_STORE", store)
+
+    store.save(session)
+    version, _ = sessions.update_session(session.id, lambda s: s.damage("c1", 2))
+    # Another worker's copy of the store
+    other = RedisTrackerStore(redis.Redis.from_url(url), prefix="test-tracker:")
+    assert other.get(session.id).version == version
+    assert heard.wait(5)
+    sessions.delete_session(session.id)
+    assert other.get(session.id) is None
+
+
+def test_routes(client, monsters):
+    state = json.loads(client.post("/api/tracker").data)
+    assert (state["version"], state["combatants"]) == (0, [])
+    url = f"/api/tracker/{state['id']}"
+
+    resp = client.post(f"{url}/combatants", json={"monster": "Ogre-MM", "mobsize": 2})
+    assert resp.status_code == 200
+    data = json.loads(resp.data)
+    ogres = data["changes"][0]["combatant"]
+    assert (data["version"], ogres["name"], ogres["hp"], ogres["max_hp"], ogres["ac"]) == (1, "Ogre", 118, 59, 11)
+
+    data = json.loads(client.post(f"{url}/combatants/{ogres['id']}/damage", json={"amount": 60}).data)
+    assert data == {"version": 2, "changes": [{"op": "update", "id": ogres["id"], "fields": {"hp": 58, "remaining": 1}}]}
+    data = json.loads(client.post(f"{url}/combatants/{ogres['id']}/statuses", json={"add": ["prone"]}).data)
+    assert data["changes"][0]["fields"] == {"statuses": ["prone"]}
+    data = json.loads(client.patch(f"{url}/combatants/{ogres['id']}", json={"initiative": 9}).data)
+    assert data["changes"][0]["fields"] == {"initiative": 9}
+    data = json.loads(client.post(f"{url}/next-turn").data)
+    assert data["changes"] == [{"op": "turn", "turn": ogres["id"], "round": 1}]
+
+    # Catching up
+    data = json.loads(client.get(f"{url}?since=2").data)
+    assert (data["version"], len(data["changes"])) == (5, 3)
+    data = json.loads(client.get(url).data)
+    assert data["state"]["combatants"][0]["hp"] == 58
+
+    assert client.delete(f"{url}/combatants/{ogres['id']}").status_code == 200
+    assert client.delete(url).status_code == 200
+    assert client.get(url).status_code == 404
+
+
+@pytest.mark.parametrize("method, path, body, status", [
+    ("post", "/combatants", {"monster": "Tarrasque-MM"}, 400),
+    ("post", "/combatants", {}, 400),
+    ("post", "/combatants", {"monster": "Goblin-MM", "mobsize": -1}, 400),
+    ("post", "/combatants/c9/damage", {"amount": 1}, 404),
+    ("post", "/combatants/c1/damage", {"amount": "1"}, 400),
+    ("post", "/combatants/c1/statuses", {"add": "prone"}, 400),
+    ("patch", "/combatants/c1", {"xp": 1000}, 400),
+    ("post", "/next-turn", {"step": 0}, 400),
+    # Bodies which aren't JSON objects
+    ("post", "/combatants", ["Goblin-MM"], 400),
+    ("patch", "/combatants/c1", [["hp", 1]], 400),
+    ("post", "/combatants/c1/damage", 5, 400),
+    ("post", "/combatants/c1/statuses", ["prone"], 400),
+    ("post", "/initiative", [12], 400),
+    ("post", "/next-turn", "1", 400),
+])
+def test_routes_invalid(client, monsters, method, path, body, status):
+    session_id = json.loads(client.post("/api/tracker").data)["id"]
+    client.post(f"/api/tracker/{session_id}/combatants", json={"monster": "Goblin-MM"})
+    resp = getattr(client, method)(f"/api/tracker/{session_id}{path}", json=body)
+    assert resp.status_code == status
+    assert "message" in json.loads(resp.data)
+    assert client.post("/api/tracker/nope/next-turn").status_code == 404
+
+
+def test_change_size(client, monsters):
+    """Actions cost the same however big the fight gets."""
+    session_id = json.loads(client.post("/api/tracker").data)["id"]
+    url = f"/api/tracker/{session_id}"
+    sizes = []
+    for _ in range(40):
+        client.post(f"{url}/combatants", json={"monster": "Goblin-MM"})
+        sizes.append(len(client.post(f"{url}/combatants/c1/damage", json={"amount": (-1) ** len(sizes)}).data))
+    assert len(json.loads(client.get(url).data)["state"]["combatants"]) == 40
+    assert max(sizes) < 100
+    assert max(sizes) - min(sizes) <= 2
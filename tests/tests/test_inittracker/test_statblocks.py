@@ -0,0 +1,38 @@
+from dmtoolkit.inittracker import statblocks
+
+
+def test_statblock_etag(client, monsters):
+    """The statblock route should send an ETag, and answer with a 304 if the client already has it."""
+    statblocks.STATBLOCKS.clear()
+    resp = client.get("/statblock/Goblin-MM")
+    assert resp.status_code == 200
+    assert b"Goblin" in resp.data
+    assert resp.headers["ETag"]
+
+    resp = client.get("/statblock/Goblin-MM", headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+    assert resp.data == b""
+
+
+def test_statblock_cache(client, monsters):
+    """Each statblock should only be rendered once."""
+    statblocks.STATBLOCKS.clear()
+    first = client.get("/statblock/Orc-MM").data
+    second = client.get("/statblock/Orc-MM").data
+    assert first == second
+    info = statblocks.STATBLOCKS.info()
+    assert (info.hits, info.misses, info.size) == (1, 1, 1)
+
+
+def test_statblock_unknown_monster(client, monsters):
+    statblocks.STATBLOCKS.clear()
+    resp = client.get("/statblock/Tarrasque-XYZ")
+    assert "Unable to find data" in resp.text
+    assert "ETag" not in resp.headers
+    assert len(statblocks.STATBLOCKS) == 0
+
+
+def test_warm_statblock_cache(app, monsters):
+    statblocks.STATBLOCKS.clear()
+    assert statblocks.warm_statblock_cache(app, ("Goblin-MM", "Lich-MM", "Tarrasque-XYZ")) == 2
+    assert len(statblocks.STATBLOCKS) == 2
@@ -0,0 +1,179 @@
+import json
+import logging
+import selectors
+import socket
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+from dmtoolkit.inittracker import sessions, sync
+
+
+def parse(event: str) -> tuple[str, dict]:
+    fields = dict(line.split(": ", 1) for line in event.strip().splitlines())
+    return fields["event"], json.loads(fields["data"])
+
+
+def dechunk(response: bytes) -> str:
+    """Returns the body of a response with chunked transfer encoding."""
+    body, rest = b"", response.split(b"\r\n\r\n", 1)[1]
+    while rest:
+        size, rest = rest.split(b"\r\n", 1)
+        body, rest = body + rest[:int(size, 16)], rest[int(size, 16) + 2:]
+    return body.decode()
+
+
+@pytest.fixture
+def session():
+    session = sessions.create_session()
+    yield session
+    sessions.delete_session(session.id)
+
+
+def add_goblin(session_id: str):
+    return sessions.update_session(session_id, lambda s: s.add({"name": "Goblin", "max_hp": 7}))
+
+
+def test_subscribe(session):
+    add_goblin(session.id)
+    events = sync.subscribe(session.id, batch_window=0)
+    event, data = parse(next(events))
+    assert (event, data["version"], len(data["combatants"])) == ("state", 1, 1)
+    assert sync.subscriber_count(session.id) == 1
+
+    sessions.update_session(session.id, lambda s: s.damage("c1", 2))
+    event, data = parse(next(events))
+    assert (event, data) == ("changes", {"version": 2, "changes": [{"op": "update", "id": "c1", "fields": {"hp": 5}}]})
+
+    sessions.delete_session(session.id)
+    assert parse(next(events))[0] == "closed"
+    with pytest.raises(StopIteration):
+        next(events)
+    assert sync.subscriber_count(session.id) == 0
+
+
+def test_subscribe_resume(session):
+    add_goblin(session.id)
+    sessions.update_session(session.id, lambda s: s.damage("c1", 2))
+    events = sync.subscribe(session.id, since=1, batch_window=0)
+    event, data = parse(next(events))
+    assert (event, data["version"], len(data["changes"])) == ("changes", 2, 1)
+    events.close()
+    assert sync.subscriber_count(session.id) == 0
+
+
+def test_subscribe_batches(session):
+    add_goblin(session.id)
+    events = sync.subscribe(session.id, since=1, batch_window=0.2)
+
+    def damage():
+        for _ in range(5):
+            sessions.update_session(session.id, lambda s: s.damage("c1", 1))
+
+    threading.Timer(0.05, damage).start()
+    # Every change within the batch window arrives as one event
+    event, data = parse(next(events))
+    assert (event, data["version"]) == ("changes", 6)
+    assert [change["fields"]["hp"] for change in data["changes"]] == [6, 5, 4, 3, 2]
+    events.close()
+
+
+def test_subscribe_heartbeat(session):
+    events = sync.subscribe(session.id, batch_window=0, heartbeat=0.01)
+    assert parse(next(events))[0] == "state"
+    assert next(events) == ": keep-alive\n\n"
+    events.close()
+
+
+def test_events_route(client, session):
+    assert client.get("/api/tracker/nope/events").status_code == 404
+    add_goblin(session.id)
+    resp = client.get(f"/api/tracker/{session.id}/events", headers={"Last-Event-ID": "0"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    event, data = parse(next(resp.response).decode())
+    assert (event, data["version"]) == ("changes", 1)
+    resp.close()
+
+
+def test_subscriber_limit(app, client, session):
+    events = sync.subscribe(session.id, batch_window=0, max_subscribers=1)
+    next(events)
+    with pytest.raises(sync.TooManySubscribers):
+        next(sync.subscribe(session.id, max_subscribers=1))
+    assert sync.subscriber_count(session.id) == 1
+
+    app.config["TRACKER_MAX_SUBSCRIBERS"] = 1
+    resp = client.get(f"/api/tracker/{session.id}/events")
+    assert (resp.status_code, resp.headers["Retry-After"]) == (503, "30")
+    events.close()
+    resp = client.get(f"/api/tracker/{session.id}/events")
+    assert resp.status_code == 200
+    resp.close()
+
+
+def test_multiple_workers(app, client, session):
+    """Sessions kept in one worker's memory can't be shared with the others."""
+    app.config["WEB_CONCURRENCY"] = 4
+    resp = client.get(f"/api/tracker/{session.id}")
+    assert resp.status_code == 503
+    assert "TRACKER_STORE" in json.loads(resp.data)["message"]
+    # The rest of the tracker works as usual
+    assert client.get("/api/tracker/nope").status_code == 503
+    assert client.get("/tooltips/conditions/prone").status_code != 503
+
+
+def test_fan_out(app, session, caplog):
+    """Load test: one worker pushing a burst of changes to hundreds of subscribers over HTTP."""
+    num_subscribers, num_changes = 300, 50
+    app.config["TRACKER_MAX_SUBSCRIBERS"] = num_subscribers
+    caplog.set_level(logging.WARNING, logger="werkzeug")
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    add_goblin(session.id)
+
+    # One thread reads from every subscriber, the way a browser would, until they've all caught up
+    selector = selectors.DefaultSelector()
+    received: dict[socket.socket, bytes] = {}
+    for _ in range(num_subscribers):
+        sock = socket.create_connection(server.server_address)
+        sock.sendall(f"GET /api/tracker/{session.id}/events HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        received[sock] = b""
+
+    def read(until: bytes, timeout: float):
+        waiting = {sock for sock, data in received.items() if until not in data}
+        deadline = time.perf_counter() + timeout
+        while waiting and time.perf_counter() < deadline:
+            for key, _ in selector.select(0.1):
+                received[key.fileobj] += key.fileobj.recv(65536)
+                if until in received[key.fileobj]:
+                    waiting.discard(key.fileobj)
+        return waiting
+
+    try:
+        # Everyone gets the state first
+        assert not read(b"id: 1\n", timeout=30)
+        start = time.perf_counter()
+        for i in range(num_changes):
+            sessions.update_session(session.id, lambda s: s.damage("c1", 1 if i % 2 else -1))
+        assert not read(f"id: {num_changes + 1}\n".encode(), timeout=30)
+        elapsed = time.perf_counter() - start
+        assert sync.subscriber_count(session.id) == num_subscribers
+
+        for data in received.values():
+            events = [parse(event) for event in dechunk(data).split("\n\n") if event]
+            changes = [change for event, data in events[1:] for change in data["changes"]]
+            # Nothing got lost, but the burst was coalesced into a handful of events
+            assert len(changes) == num_changes
+            assert len(events) - 1 < num_changes / 5
+        # Generous, for slow CI machines; this takes well under a second normally
+        assert elapsed < 15
+    finally:
+        for sock in received:
+            selector.unregister(sock)
+            sock.close()
+        server.shutdown()
@@ -0,0 +1,37 @@
+from flask import render_template_string
+
+from dmtoolkit import context
+from dmtoolkit.context import get_request_state
+from dmtoolkit.modules import get_modules
+from dmtoolkit.settings.api import get_active_modules, set_settings
+
+
+def test_request_state(app, monkeypatch):
+    calls = []
+    flatten = context.flatten_modules
+    monkeypatch.setattr(context, "flatten_modules", lambda names: calls.append(names) or flatten(names))
+    with app.test_request_context():
+        set_settings({"module_kcg": True, "use_new_content": True})
+        state = get_request_state()
+        assert state is get_request_state()
+        assert (state.active_modules, state.use_new_content) == (["kcg"], True)
+        assert state.module.generate_loot is get_modules()["kcg"].generate_loot
+        assert state.module.generate_loot_many is get_modules()["kcg"].generate_loot_many
+        assert state.module is get_request_state().module
+        assert calls == [["kcg"]]
+        assert state.main_routes == get_modules()["kcg"].main_routes
+
+        # Changing the settings starts over
+        set_settings({"module_kcg": False})
+        assert get_request_state() is not state
+        assert get_active_modules() == []
+        assert dict(get_request_state().main_routes) == {}
+
+
+def test_request_state_template(app):
+    template = "{% for title in state.main_routes %}{{ title }};{% endfor %}{{ state.use_new_content }}"
+    with app.test_request_context():
+        assert render_template_string(template) == "False"
+        set_settings({"module_kcg": True})
+        titles = "".join(f"{title};" for title in get_modules()["kcg"].main_routes)
+        assert render_template_string(template) == f"{titles}False"
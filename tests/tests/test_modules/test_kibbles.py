@@ -1,3 +1,4 @@
+from fractions import Fraction
 from pathlib import Path
 
 import pytest
@@ -133,4 +134,63 @@ def test_loot_table_contents(fname: Path):
 
 def test_load_recipes():
     # Make sure this doesn't raise an error
-    crafting.list_recipes()
\ No newline at end of file
+    crafting.list_recipes()
+
+
+def test_range_dict():
+    ranges = loot.RangeDict([(5, 10, "b"), (0, 4, "a"), (17, 99, "d")])
+    assert [ranges[x] for x in (0, Fraction(1, 8), 4, 5, 10, 17, 99)] == ["a", "a", "a", "b", "b", "d", "d"]
+    for x in (-1, 11, 16, 100):
+        with pytest.raises(IndexError):
+            ranges[x]
+
+
+def test_loot_table_compile():
+    """Numbers with only fixed quantities are worked out once; the rest are still rolled."""
+    table = loot.LootTable(4)
+    table.add_row(1, 2, loot.LootItem("fancy parts", 2))
+    table.add_row(2, 3, loot.LootItem("fancy parts", 3))
+    table.add_row(4, 4, loot.LootCoins(gp="1d4"))
+    table.compile()
+    fancy_parts = get_item("fancy parts|kcg")
+    assert [fixed for _, fixed in table._faces[:3]] == [[(fancy_parts, 2)], [(fancy_parts, 5)], [(fancy_parts, 3)]]
+    rows, fixed = table._faces[3]
+    assert fixed is None and len(rows) == 1
+
+    # Adding a row means compiling again
+    table.add_row(1, 4, loot.LootItem("fancy parts", 1))
+    assert table._faces is None
+    assert table.roll()[0][1] >= 1
+
+
+def test_loot_table_merges_coins():
+    table = loot.LootTable(1)
+    table.add_row(1, 1, loot.LootCoins(gp=1))
+    table.add_row(1, 1, loot.LootCoins(sp=2))
+    [(coinage, quantity)] = table.roll()
+    assert (coinage.value, quantity) == (120, 1)
+
+
+def test_loot_table_roll_many():
+    loot_table = loot.LootTable.load_from_csv(loot.LOOT_TABLE_DIR / "humanoid_cr_0_4.csv")
+    results = loot_table.roll_many(500)
+    assert len(results) == 500
+    for result in results:
+        assert result
+        assert all(isinstance(item, Item) and isinstance(quantity, int) for item, quantity in result)
+    # Every result comes from the table, and they aren't all the same one
+    assert len({tuple(sorted(item.id() for item, _ in result)) for result in results}) > 1
+
+
+def test_loot_many(monsters):
+    responses = loot.loot_many(monsters["Goblin-MM"], 50)
+    assert len(responses) == 50
+    assert all(response.items or response.coinage for response in responses)
+    assert len({response.coinage for response in responses}) > 1
+    [response] = loot.loot_many(monsters["Ogre-MM"], 1)
+    assert response.items or response.coinage
+
+
+def test_compile_loot_tables():
+    loot.compile_loot_tables()
+    assert all(table._faces is not None for table in loot.gathering_tables.values())
@@ -0,0 +1,72 @@
+import json
+import time
+
+import pytest
+
+from dmtoolkit import search
+
+
+@pytest.fixture
+def index(monsters):
+    """Builds the search index from the fixture monsters, and throws it away afterwards."""
+    search.reset_index()
+    yield search.get_index()
+    search.reset_index()
+
+
+@pytest.mark.parametrize("text,tokens", [
+    ("Tasha's Hideous Laughter", ["tashas", "hideous", "laughter"]),
+    ("Potion of Healing (*)", ["potion", "of", "healing"]),
+    ("cr:1/2 goblin", ["cr:1/2", "goblin"]),
+    ("rarity:very-rare", ["rarity:very-rare"]),
+])
+def test_tokenize(text, tokens):
+    assert search.tokenize(text) == tokens
+
+
+@pytest.mark.parametrize("query,kinds,expected", [
+    ("goblin", None, ("monster", "Goblin")),
+    ("gob", ["monster"], ("monster", "Goblin")),
+    ("fireball", None, ("spell", "Fireball")),
+    ("firebal", ["spell"], ("spell", "Fireball")),
+    ("fierball", ["spell"], ("spell", "Fireball")),
+    ("tashas laughter", None, ("spell", "Tasha's Hideous Laughter")),
+    ("potion of healing", ["item"], ("item", "Potion of Healing")),
+    ("school:evocation bolt", None, ("spell", "Fire Bolt")),
+    ("cr:17", None, ("monster", "Adult Red Dragon")),
+    ("undead cr:21", None, ("monster", "Lich")),
+])
+def test_search(index, query, kinds, expected):
+    results = search.search(query, kinds)
+    assert results
+    assert (results[0].kind, results[0].name) == expected
+    assert results == sorted(results, key=lambda r: r.score, reverse=True)
+    if kinds:
+        assert all(result.kind in kinds for result in results)
+
+
+def test_every_term_must_match(index):
+    assert search.search("goblin fireball") == []
+    assert search.search("cr:1/2 type:undead") == []
+    assert search.search("") == []
+
+
+def test_latency(index):
+    # Warm up, then time each query without the result cache
+    for query in ("a", "fir", "potion of healing", "cr:1/4 undead", "xyzzy"):
+        index.search(query)
+        start = time.perf_counter()
+        for _ in range(10):
+            index.search(query)
+        assert (time.perf_counter() - start) / 10 < 0.005
+
+
+def test_search_route(client, index):
+    resp = client.get("/api/search?q=ghoul&kind=monster,spell&limit=5")
+    assert resp.status_code == 200
+    results = json.loads(resp.data)
+    assert results[0]["key"] == "Ghoul-MM"
+    assert set(results[0]) == {"kind", "key", "name", "source", "detail", "score"}
+    assert len(results) <= 5
+
+    assert client.get("/api/search?q=ghoul&kind=npc").status_code == 400